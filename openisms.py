@@ -4,59 +4,1312 @@
 #########################
 # External dependencies #
 #########################
-from flask import Flask, request, render_template, jsonify, redirect, url_for
+from flask import Flask, Response, request, render_template, jsonify, redirect, url_for, stream_with_context
+from flask import g, has_request_context, make_response
+import argparse
+import bisect
+import collections
+import csv
 import json
-import codecs
+import logging
+import contextlib
+import copy
+import functools
+import hashlib
+import heapq
+import io
 import os
+import random
 import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 DATA = "assessments/data.json"
 SCHEMA = "assessments/schema.json"
 CONTROL_LIBRARY = "assessments/control_library.json"
 DELIVERABLES = "assessments/deliverables.json"
+# Set DATA_BACKEND=sqlite to store DATA in the SQLite database DATA_SQLITE
+DATA_BACKEND = os.getenv("DATA_BACKEND", "json")
+DATA_SQLITE = os.getenv("DATA_SQLITE", os.path.splitext(DATA)[0] + ".sqlite")
+# Set WORKSPACES to a directory with one directory per assessment (each
+# with its own data.json) to serve several assessments, see Workspaces
+WORKSPACES_DIRECTORY = os.getenv("WORKSPACES", "")
+WORKSPACE_MEMORY_MB = float(os.getenv("WORKSPACE_MEMORY_MB", "256"))
+# Format of the snapshots written of the documents, see SNAPSHOT_FORMATS
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json")
+# Set METRICS_LOG=1 to log the calls and timings of every request
+METRICS_LOG = not not os.getenv("METRICS_LOG", False)
 app = Flask(__name__)
 
+###########
+# Metrics #
+###########
+# Upper bounds in seconds of the request latency histogram of /metrics
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class Metrics(object):
+    """
+    Metrics aggregates the number of calls, the time spent and the bytes
+    read or written by instrumented functions, and the number and latency
+    of requests per route. During a request, the calls are also collected
+    per request in flask.g, see request_breakdown().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.functions = {}
+        self.routes = {}
+
+    def observe(self, name, seconds, size=0):
+        """
+        Returns nothing, but records a call of name which took seconds and
+        read or wrote size bytes.
+        """
+        with self._lock:
+            entry = self.functions.setdefault(name, {"calls": 0, "seconds": 0.0, "bytes": 0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["bytes"] += size
+        if has_request_context():
+            breakdown = g.setdefault("metrics", {})
+            entry = breakdown.setdefault(name, {"calls": 0, "seconds": 0.0, "bytes": 0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["bytes"] += size
+
+    def observe_request(self, route, method, status, seconds):
+        """
+        Returns nothing, but records a request of route which took seconds.
+        """
+        with self._lock:
+            entry = self.routes.setdefault((route, method, status), {"requests": 0, "seconds": 0.0,
+                                                                     "buckets": [0]*len(METRICS_BUCKETS)})
+            entry["requests"] += 1
+            entry["seconds"] += seconds
+            for index, bound in enumerate(METRICS_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][index] += 1
+
+    def calls(self, name):
+        """
+        Returns the number of recorded calls of name.
+        """
+        with self._lock:
+            return self.functions.get(name, {}).get("calls", 0)
+
+    def prometheus(self):
+        """
+        Returns the aggregates in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            functions = sorted(self.functions.items())
+            routes = sorted(self.routes.items())
+            for metric, key, kind, text in [
+                    ("openisms_function_calls_total", "calls", "counter", "Calls of instrumented functions"),
+                    ("openisms_function_seconds_total", "seconds", "counter", "Seconds spent in instrumented functions"),
+                    ("openisms_function_bytes_total", "bytes", "counter", "Bytes read or written by instrumented functions")]:
+                lines.append("# HELP %s %s" % (metric, text))
+                lines.append("# TYPE %s %s" % (metric, kind))
+                for name, entry in functions:
+                    lines.append('%s{function="%s"} %s' % (metric, name, repr(entry[key])))
+            lines.append("# HELP openisms_request_seconds Latency of requests per route")
+            lines.append("# TYPE openisms_request_seconds histogram")
+            for (route, method, status), entry in routes:
+                labels = 'route="%s",method="%s",status="%s"' % (route, method, status)
+                for bound, count in zip(METRICS_BUCKETS, entry["buckets"]):
+                    lines.append('openisms_request_seconds_bucket{%s,le="%s"} %d' % (labels, bound, count))
+                lines.append('openisms_request_seconds_bucket{%s,le="+Inf"} %d' % (labels, entry["requests"]))
+                lines.append("openisms_request_seconds_sum{%s} %s" % (labels, repr(entry["seconds"])))
+                lines.append("openisms_request_seconds_count{%s} %d" % (labels, entry["requests"]))
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def instrumented(function):
+    """
+    Decorator recording the calls and the time spent in function in METRICS.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            METRICS.observe(function.__name__, time.time() - start)
+    return wrapper
+
+render_template = instrumented(render_template)
+if METRICS_LOG:
+    app.logger.setLevel(logging.INFO)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.time()
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Records the latency of the request in METRICS, and logs the calls made
+    during the request if METRICS_LOG is set.
+    """
+    seconds = time.time() - g.get("metrics_start", time.time())
+    route = request.endpoint or "unknown"
+    METRICS.observe_request(route, request.method, response.status_code, seconds)
+    if METRICS_LOG:
+        app.logger.info("%s %s %d %.1fms %s", request.method, request.path, response.status_code,
+                        seconds * 1000, request_breakdown())
+    return response
+
+def request_breakdown():
+    """
+    Returns a string with the calls, time and bytes of each instrumented
+    function during the current request, such as
+    "get_table=2/1.3ms render_template=1/8.0ms import_jsondata=1/20.1ms/51234B"
+    """
+    parts = []
+    for name, entry in sorted(g.get("metrics", {}).items()):
+        part = "%s=%d/%.1fms" % (name, entry["calls"], entry["seconds"] * 1000)
+        if entry["bytes"]:
+            part += "/%dB" % entry["bytes"]
+        parts.append(part)
+    return " ".join(parts)
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """
+    Returns the aggregates of METRICS for Prometheus.
+    """
+    return Response(METRICS.prometheus(), mimetype="text/plain; version=0.0.4")
+
 ###########################
 # Multi purpose functions #
 ###########################
 def import_jsondata(selected_file):
     """
     Returns dictionary loaded from specified json file
+    The file may also be a compact snapshot, see decode_snapshot().
     Argument:
         selected_file: String such as "assessments/data.json"
     """
-    f = codecs.open(selected_file, mode='r', encoding='utf-8')
-    data = json.load(f)
-    f.close()
+    start = time.time()
+    with open(selected_file, 'rb') as f:
+        contents = f.read()
+    data = decode_snapshot(contents)
+    METRICS.observe("import_jsondata", time.time() - start, len(contents))
     return data
 
-def write_file(filename, contents, charset='utf-8'):
+# Snapshot formats: "json" is indented json, "json-min" json without
+# whitespace, "msgpack" MessagePack (needs the msgpack package). A
+# "-zlib" suffix compresses the snapshot with zlib.
+SNAPSHOT_FORMATS = ["json", "json-min", "json-zlib", "json-min-zlib", "msgpack", "msgpack-zlib"]
+
+def encode_snapshot(data, snapshot_format=None):
+    """
+    Returns data encoded as a snapshot in snapshot_format (default
+    SNAPSHOT_FORMAT), as a byte string.
+    """
+    snapshot_format = snapshot_format or SNAPSHOT_FORMAT
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise ValueError("Unknown snapshot format %s, use one of %s"
+                         % (snapshot_format, ", ".join(SNAPSHOT_FORMATS)))
+    if snapshot_format.startswith("msgpack"):
+        if msgpack is None:
+            raise ValueError("The snapshot format %s needs the msgpack package" % snapshot_format)
+        contents = msgpack.packb(data, use_bin_type=True)
+    elif snapshot_format.startswith("json-min"):
+        contents = json.dumps(data, separators=(",", ":")).encode('utf-8')
+    else:
+        contents = json.dumps(data, indent=4).encode('utf-8')
+    if snapshot_format.endswith("-zlib"):
+        contents = zlib.compress(contents)
+    return contents
+
+def decode_snapshot(contents):
     """
-    Returns nothing, but writes unicode text to specified file
+    Returns the document in the byte string contents, detecting whether it
+    is json or MessagePack, and whether it is compressed with zlib.
+    """
+    # zlib streams start with 0x78, which neither json nor a msgpack map does
+    if contents[:1] == b"\x78":
+        contents = zlib.decompress(contents)
+    if contents.lstrip()[:1] in [b"{", b"["] or not contents.strip():
+        return json.loads(contents.decode('utf-8'))
+    if msgpack is None:
+        raise ValueError("The snapshot is not json, and the msgpack package is not installed")
+    return msgpack.unpackb(contents, raw=False)
+
+class VersionConflict(Exception):
+    """
+    Raised when a mutation expected another version of the document (or of
+    the row it edits) than the stored one, because someone else changed it
+    in the meantime.
+    """
+    pass
+
+def journal_filename(filename):
+    """
+    Returns the filename of the journal of a json document.
+    """
+    return filename + ".journal"
+
+def replay_operations(data, operations):
+    """
+    Returns nothing, but applies journal operations to a document.
+    Operations are dicts with an "op" and a "path" of keys into the document:
+    - append: {"op":"append", "path":["assets"], "value":{row}}
+    - update: {"op":"update", "path":["assets"], "key":"asset_id", "id":"asset000001", "value":{row}}
+      replaces the content of the row where row[key]==id.
+    - delete: {"op":"delete", "path":["assets"], "key":"asset_id", "ids":[ids]}
+      removes the rows where row[key] is in ids.
+    - unlink: {"op":"unlink", "path":["risktable"], "ids":[ids], "match":"all"}
+      removes the rows containing all (or "any") of ids as values.
+    - set / unset: {"op":"set", "path":["risk_scores","threats","threat000001"], "value":value}
     Arguments:
-        filename: String, such as "assessments/data.json"
-        contents: String, such as output form json.dumps()
-        charset: Must be utf-8 to allow special characters
+    - data: the document, such as loaded from data.json
+    - operations: list of operation dicts
     """
-    with open(filename, 'w') as f:
-        f.write(contents.encode(charset))
+    for operation in operations:
+        path = operation["path"]
+        target = data
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        last_key = path[-1]
+        op = operation["op"]
+        if op == "set":
+            target[last_key] = operation["value"]
+        elif op == "unset":
+            target.pop(last_key, None)
+        elif op == "append":
+            target.setdefault(last_key, []).append(operation["value"])
+        elif op == "update":
+            for row in target.get(last_key, []):
+                if row.get(operation["key"], None) == operation["id"]:
+                    row.clear()
+                    row.update(operation["value"])
+        elif op == "delete":
+            ids = set(operation["ids"])
+            key = operation["key"]
+            target[last_key] = [row for row in target.get(last_key, [])
+                                if row.get(key, None) not in ids]
+        elif op == "unlink":
+            ids = set(operation["ids"])
+            match = all if operation.get("match", "all") == "all" else any
+            target[last_key] = [row for row in target.get(last_key, [])
+                                if not match(id_value in set(row.values()) for id_value in ids)]
+        else:
+            raise ValueError("Unknown journal operation: " + str(op))
 
-def fix_json_dict(reference_dict, target_dict):
+class AssessmentStore(object):
     """
-    fix_json_dict 
+    AssessmentStore keeps the parsed json documents (data.json, schema.json,
+    control_library.json and deliverables.json) in memory, so every helper
+    reads from the same parsed copy instead of parsing the file per call.
+    A document is parsed again when its modification time or size changes
+    on disk.
+    A document is persisted as a snapshot (the json file itself) plus an
+    append-only journal of operations next to it (e.g. data.json.journal).
+    commit() appends one journal line per mutation. After JOURNAL_COMPACT_EVERY
+    commits, the journal is compacted into a new snapshot written to a
+    temporary file and renamed over the old one. load() replays the journal
+    on top of the snapshot.
+    Documents can instead be stored by a backend registered in backends,
+    such as SqliteBackend, which exports the document and applies commits.
+    Mutations must run inside transaction(), which serializes writers across
+    threads and processes with a lock per document and an advisory lock
+    file, so every mutation is applied to the latest version of the
+    document. Readers take neither: while a thread writes a document,
+    readers in other threads get the loaded copy, which the writer keeps
+    up to date. The store-wide lock is only held to swap loaded documents.
+    The document version (data["journal_sequence"]) increases with every
+    commit.
+    Documents are identified by their name in the default directory, such as
+    DATA. A store with a directory keeps the files of its documents in that
+    directory instead, e.g. "workspaces/sales/data.json" for DATA.
+    Documents returned by load() are shared. Callers must copy rows before
+    changing them, unless the change is persisted with commit() or save().
     """
-    assert(type(reference_dict) is dict)
-    assert(type(target_dict) is dict)
-    result = {}
-    result.update(target_dict) 
-    for rkey, rvalue in reference_dict.iteritems():
-        tkey_found=False
-        for tkey, tvalue in target_dict.iteritems():
-            if (rkey in tkey):
-                tkey_found=True
-        if not tkey_found:
-            result.update({rkey:rvalue})
-    return result 
+    def __init__(self, compact_every=None, directory=None):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._documents = {}
+        self._file_locks = {}
+        self.backends = {}
+        if compact_every is None:
+            compact_every = int(os.getenv("JOURNAL_COMPACT_EVERY", "500"))
+        self.compact_every = compact_every
+
+    def path(self, filename):
+        """
+        Returns the file storing the document filename.
+        """
+        if self.directory is None:
+            return filename
+        return os.path.join(self.directory, os.path.basename(filename))
+
+    def _stamp(self, filename):
+        stat = os.stat(self.path(filename))
+        return (stat.st_mtime, stat.st_size)
+
+    def _journal_size(self, filename):
+        try:
+            return os.path.getsize(journal_filename(self.path(filename)))
+        except OSError:
+            return 0
+
+    def _replay_journal(self, filename, document):
+        """
+        Replays the complete journal lines after document["journal_offset"].
+        A torn last line, left by a writer that died, is ignored.
+        """
+        try:
+            f = open(journal_filename(self.path(filename)), 'rb')
+        except IOError:
+            return
+        with f:
+            f.seek(document["journal_offset"])
+            data = document["data"]
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if entry["sequence"] > data.get("journal_sequence", 0):
+                    replay_operations(data, entry["operations"])
+                    data["journal_sequence"] = entry["sequence"]
+                    document["commits"] += 1
+                document["journal_offset"] += len(line)
+
+    def load(self, filename):
+        """
+        Returns the parsed document of filename, parsing it only if it is not
+        loaded yet or has changed on disk.
+        Arguments:
+        - filename: String such as "assessments/data.json"
+        """
+        with self._lock:
+            document = self._documents.get(filename, None)
+            if document is not None and self._written_by_other_thread(filename):
+                return document["data"]
+            backend = self.backends.get(filename, None)
+            if backend is not None:
+                stamp = backend.version()
+                if document is None or document["stamp"] != stamp:
+                    document = {"data": backend.export_document(), "stamp": stamp, "derived": {},
+                                "journal_offset": 0, "commits": 0}
+                    self._documents[filename] = document
+                return document["data"]
+            stamp = self._stamp(filename)
+            journal_size = self._journal_size(filename)
+            if (document is None or document["stamp"] != stamp
+                    or journal_size < document["journal_offset"]):
+                document = {"data": import_jsondata(self.path(filename)), "stamp": stamp, "derived": {},
+                            "journal_offset": 0, "commits": 0}
+                self._replay_journal(filename, document)
+                self._documents[filename] = document
+            elif journal_size > document["journal_offset"]:
+                self._replay_journal(filename, document)
+                document["derived"] = {}
+            return document["data"]
+
+    def derived(self, filename, name, builder):
+        """
+        Returns a structure derived from the document of filename, such as an
+        index. The structure is built with builder(data) on first use and kept
+        until the document is parsed again. Mutating helpers are responsible
+        for keeping derived structures up to date, or for dropping them.
+        Arguments:
+        - filename: String such as "assessments/data.json"
+        - name: String identifying the derived structure
+        - builder: Function taking the document and returning the structure
+        """
+        with self._lock:
+            data = self.load(filename)
+            derived = self._documents[filename]["derived"]
+            if name not in derived:
+                derived[name] = builder(data)
+            return derived[name]
+
+    def drop_derived(self, filename, name=None):
+        """
+        Returns nothing, but drops the derived structure name of filename (or
+        all derived structures of filename), so it is rebuilt on next use.
+        """
+        with self._lock:
+            document = self._documents.get(filename, None)
+            if document is None:
+                return
+            if name is None:
+                document["derived"] = {}
+            else:
+                document["derived"].pop(name, None)
+
+    def built_derived(self, filename, name):
+        """
+        Returns the derived structure name of filename if it is built, else None.
+        """
+        with self._lock:
+            document = self._documents.get(filename, None)
+            if document is None:
+                return None
+            return document["derived"].get(name, None)
+
+    def _written_by_other_thread(self, filename):
+        file_lock = self._file_locks.get(filename, None)
+        return file_lock is not None and file_lock["owner"] not in [None, threading.current_thread().ident]
+
+    @contextlib.contextmanager
+    def transaction(self, filename, expected_version=None):
+        """
+        Context manager holding the write lock of filename. Transactions of
+        the same thread can be nested. Loading the document inside the
+        transaction picks up commits made by other processes before the lock
+        was taken.
+        Arguments:
+        - filename: String such as "assessments/data.json"
+        - expected_version: if given, VersionConflict is raised unless the
+          document still has this version
+        """
+        with self._lock:
+            file_lock = self._file_locks.setdefault(filename, {"lock": threading.RLock(), "file": None,
+                                                               "depth": 0, "owner": None})
+        with file_lock["lock"]:
+            if file_lock["depth"] == 0 and fcntl is not None:
+                file_lock["file"] = open(self.path(filename) + ".lock", 'a')
+                fcntl.flock(file_lock["file"].fileno(), fcntl.LOCK_EX)
+            # Taken after any reload by a reader has finished, see load()
+            with self._lock:
+                file_lock["owner"] = threading.current_thread().ident
+                file_lock["depth"] += 1
+            try:
+                self.check_version(filename, expected_version)
+                yield
+            finally:
+                with self._lock:
+                    file_lock["depth"] -= 1
+                    if file_lock["depth"] == 0:
+                        file_lock["owner"] = None
+                if file_lock["depth"] == 0 and file_lock["file"] is not None:
+                    fcntl.flock(file_lock["file"].fileno(), fcntl.LOCK_UN)
+                    file_lock["file"].close()
+                    file_lock["file"] = None
+
+    @contextlib.contextmanager
+    def batch(self, filename, expected_version=None):
+        """
+        Context manager running a transaction of filename whose commits are
+        written as one journal line (or one database transaction) when the
+        block ends. If the block raises, nothing is written and the loaded
+        document, which the block may have changed, is dropped.
+        Arguments:
+        - filename: String such as "assessments/data.json"
+        - expected_version: see transaction()
+        """
+        with self.transaction(filename, expected_version):
+            file_lock = self._file_locks[filename]
+            if file_lock.get("batch", None) is not None:
+                yield
+                return
+            backend = self.backends.get(filename, None)
+            if backend is not None:
+                try:
+                    with backend.batch():
+                        yield
+                except Exception:
+                    self.invalidate(filename)
+                    raise
+                return
+            file_lock["batch"] = []
+            try:
+                yield
+            except Exception:
+                file_lock["batch"] = None
+                self.invalidate(filename)
+                raise
+            operations, file_lock["batch"] = file_lock["batch"], None
+            self.commit(filename, operations)
+
+    def stamp(self, filename):
+        """
+        Returns the stamp of the loaded document of filename, which changes
+        when the file (or database) changed on disk.
+        """
+        with self._lock:
+            self.load(filename)
+            return self._documents[filename]["stamp"]
+
+    def check_version(self, filename, expected_version):
+        """
+        Returns nothing, but raises VersionConflict if expected_version is
+        given and differs from the version of the document of filename.
+        """
+        if expected_version not in [None, ""] and self.version(filename) != int(expected_version):
+            raise VersionConflict("%s changed since version %s" % (filename, expected_version))
+
+    def version(self, filename):
+        """
+        Returns the version of the document of filename, which increases with
+        every commit.
+        """
+        with self._lock:
+            backend = self.backends.get(filename, None)
+            if backend is not None:
+                return backend.sequence()
+            return self.load(filename).get("journal_sequence", 0)
+
+    def commit(self, filename, operations):
+        """
+        Returns nothing, but appends operations to the journal of filename as
+        one atomic journal line. The caller must already have applied the same
+        operations to the loaded document (and its derived structures).
+        Arguments:
+        - filename: String such as "assessments/data.json"
+        - operations: list of operation dicts, see replay_operations()
+        """
+        assert(type(operations) is list)
+        if not operations:
+            return
+        # Only the writer, holding the write lock, changes the document from
+        # here on, and readers in other threads do not reload it meanwhile
+        file_lock = self._file_locks.get(filename, {})
+        assert file_lock.get("owner", None) == threading.current_thread().ident, "commit outside transaction"
+        if file_lock.get("batch", None) is not None:
+            file_lock["batch"].extend(operations)
+            return
+        with self._lock:
+            document = self._documents[filename]
+        data = document["data"]
+        sequence = data.get("journal_sequence", 0) + 1
+        backend = self.backends.get(filename, None)
+        if backend is not None:
+            try:
+                data["journal_sequence"] = backend.apply_operations(operations)
+            except Exception:
+                self.invalidate(filename)
+                raise
+            return
+        start = time.time()
+        line = json.dumps({"sequence": sequence, "operations": operations}) + "\n"
+        f = open(journal_filename(self.path(filename)), 'ab')
+        try:
+            # Drop a torn last line, so the new line starts on its own
+            f.seek(0, os.SEEK_END)
+            if f.tell() > document["journal_offset"]:
+                f.truncate(document["journal_offset"])
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        except Exception:
+            f.close()
+            self.invalidate(filename)
+            raise
+        f.close()
+        METRICS.observe("journal_write", time.time() - start, len(line))
+        data["journal_sequence"] = sequence
+        document["journal_offset"] += len(line)
+        document["commits"] += 1
+        if document["commits"] >= self.compact_every:
+            self.save(filename, data)
+
+    def save(self, filename, data):
+        """
+        Returns nothing, but writes data as the new snapshot of filename,
+        empties its journal and keeps data as the loaded document.
+        The snapshot is written to a temporary file which is renamed over
+        filename, so a crash never leaves a partially written snapshot.
+        Arguments:
+        - filename: String such as "assessments/data.json"
+        - data: The complete document, usually obtained from load()
+        """
+        with self._lock:
+            backend = self.backends.get(filename, None)
+            document = self._documents.get(filename, None)
+        derived = {}
+        if document is not None and document["data"] is data:
+            derived = document["derived"]
+        if backend is not None:
+            backend.import_document(data)
+            with self._lock:
+                self._documents[filename] = {"data": data, "stamp": backend.version(), "derived": derived,
+                                             "journal_offset": 0, "commits": 0}
+            return
+        start = time.time()
+        output = encode_snapshot(data)
+        path = self.path(filename)
+        temporary_filename = path + ".tmp"
+        try:
+            with open(temporary_filename, 'w') as f:
+                f.write(output)
+                f.flush()
+                os.fsync(f.fileno())
+            METRICS.observe("snapshot_write", time.time() - start, len(output))
+            os.rename(temporary_filename, path)
+            # The snapshot holds journal_sequence, so replaying a journal
+            # which was not emptied because of a crash is harmless.
+            if os.path.exists(journal_filename(path)):
+                open(journal_filename(path), 'w').close()
+        except Exception:
+            self.invalidate(filename)
+            raise
+        with self._lock:
+            self._documents[filename] = {"data": data, "stamp": self._stamp(filename), "derived": derived,
+                                         "journal_offset": 0, "commits": 0}
+
+    def compact(self, filename):
+        """
+        Returns nothing, but writes the loaded document of filename, including
+        its journal, as a new snapshot.
+        """
+        self.save(filename, self.load(filename))
+
+    def invalidate(self, filename=None):
+        """
+        Returns nothing, but forgets the loaded copy of filename (or of all
+        documents), forcing the next load() to parse the file again.
+        """
+        with self._lock:
+            if filename is None:
+                self._documents.clear()
+            else:
+                self._documents.pop(filename, None)
+
+    def size(self):
+        """
+        Returns an estimate in bytes of the memory used by the loaded
+        documents and their derived structures, from their number of rows
+        (see count_rows), whatever the snapshot format.
+        """
+        with self._lock:
+            documents = [document["data"] for document in self._documents.values()]
+        return DOCUMENT_ROW_BYTES * sum(count_rows(data) for data in documents)
+
+    def flush(self):
+        """
+        Returns nothing, but writes every loaded document with commits in its
+        journal as a new snapshot, closes the backends and forgets the loaded
+        documents.
+        """
+        with self._lock:
+            filenames = list(self._documents)
+        for filename in filenames:
+            if filename not in self.backends and self._journal_size(filename) > 0:
+                with self.transaction(filename):
+                    self.compact(filename)
+        for backend in self.backends.values():
+            backend.close()
+        self.invalidate()
+
+# Memory of a parsed row with its share of the derived indexes, measured
+# with Python 2.7 on an assessment made by generate_assessment()
+DOCUMENT_ROW_BYTES = 1536
+
+def count_rows(data):
+    """
+    Returns the number of rows of a document: the items of its top level
+    lists and dicts and of the lists and dicts within those.
+    """
+    rows = 0
+    for value in data.values():
+        if isinstance(value, (list, dict)):
+            rows += len(value)
+        if isinstance(value, dict):
+            rows += sum(len(x) for x in value.values() if isinstance(x, (list, dict)))
+    return rows
+
+class CurrentStore(object):
+    """
+    CurrentStore forwards to the AssessmentStore of the workspace of the
+    current request (see Workspaces), or to DEFAULT_STORE.
+    """
+    def __getattr__(self, name):
+        return getattr(get_store(), name)
+
+DEFAULT_STORE = AssessmentStore()
+STORE = CurrentStore()
+
+def get_store():
+    """
+    Returns the AssessmentStore of the workspace of the current request,
+    or DEFAULT_STORE outside of a workspace.
+    """
+    if has_request_context():
+        workspace = getattr(g, "workspace", None)
+        if workspace is not None:
+            return workspace.store
+    return DEFAULT_STORE
+
+def transactional(filename):
+    """
+    Decorator running a function inside STORE.transaction(filename)
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with STORE.transaction(filename):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def batched(filename):
+    """
+    Decorator running a function inside STORE.batch(filename), so all its
+    commits are written as one journal line
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with STORE.batch(filename):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+##################
+# SQLite backend #
+##################
+# Aspect type -> sqlite table of a collection in data.json
+SQLITE_TABLES = {"process": "processes", "asset": "assets",
+                 "threat": "threats", "container": "containers"}
+# Id columns of the risktable table, all of them indexed
+SQLITE_RISK_COLUMNS = ["process_id", "asset_id", "threat_id",
+                       "container_id", "control_id", "deliverable_id"]
+# Maximum number of ids bound in one "IN (...)" clause
+SQLITE_CHUNK = 500
+
+def chunks(items, size=SQLITE_CHUNK):
+    """
+    Yields consecutive slices of the list items with at most size elements.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start+size]
+
+class SqliteBackend(object):
+    """
+    SqliteBackend stores data.json in a SQLite database with a table per
+    aspect collection (processes, assets, threats, containers), a table
+    for the impact_scores of threats, a risktable link table and a table
+    with the remaining top level keys of data.json. Every id column is
+    indexed.
+    get_table, get_process_assets and get_asset_threats query the database
+    directly. Other views use the document exported by export_document(),
+    which writers keep up to date like a json document, and the journal
+    operations of their commits are translated to SQL by apply_operations().
+    """
+    def __init__(self, filename, seed_filename=None):
+        self.filename = filename
+        self.seed_filename = seed_filename
+        self._lock = threading.RLock()
+        self._connection = None
+        self._batch_depth = 0
+        self._batch_sequence = None
+        self._version = None
+
+    def connection(self):
+        """
+        Returns the database connection, creating the tables (and importing
+        seed_filename into an empty database) on first use.
+        """
+        with self._lock:
+            if self._connection is None:
+                connection = sqlite3.connect(self.filename, check_same_thread=False)
+                self._connection = connection
+                self._create_tables()
+                empty = connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 0
+                if empty and self.seed_filename and os.path.exists(self.seed_filename):
+                    self.import_document(import_jsondata(self.seed_filename))
+            return self._connection
+
+    def _create_tables(self):
+        connection = self._connection
+        for aspect, table in SQLITE_TABLES.items():
+            id_key = ASPECT_COLLECTIONS[aspect][1]
+            connection.execute("CREATE TABLE IF NOT EXISTS %s (position INTEGER PRIMARY KEY AUTOINCREMENT, "
+                               "%s TEXT, body TEXT NOT NULL)" % (table, id_key))
+            connection.execute("CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)" % (table, id_key, table, id_key))
+        connection.execute("CREATE TABLE IF NOT EXISTS impact_scores (position INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           "threat_id TEXT, type TEXT, score TEXT, body TEXT NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS impact_scores_threat_id ON impact_scores (threat_id)")
+        connection.execute("CREATE TABLE IF NOT EXISTS risktable (position INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           + ", ".join("%s TEXT" % column for column in SQLITE_RISK_COLUMNS)
+                           + ", body TEXT NOT NULL)")
+        for column in SQLITE_RISK_COLUMNS:
+            connection.execute("CREATE INDEX IF NOT EXISTS risktable_%s ON risktable (%s)" % (column, column))
+        # Rows are never looked up by their json text
+        connection.execute("DROP INDEX IF EXISTS risktable_body")
+        connection.execute("CREATE TABLE IF NOT EXISTS risk_scores (threat_id TEXT PRIMARY KEY, "
+                           "impact TEXT, score TEXT)")
+        connection.execute("CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, value TEXT)")
+        connection.commit()
+
+    def sequence(self):
+        """
+        Returns the document version, increased by every change made through
+        this backend.
+        """
+        with self._lock:
+            row = self.connection().execute("SELECT value FROM documents WHERE key='journal_sequence'").fetchone()
+            return json.loads(row[0]) if row else 0
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager collecting the changes made through this backend in
+        one database transaction, which is rolled back if the block raises.
+        """
+        with self._lock:
+            if self._batch_depth == 0:
+                self.version()
+            self._batch_depth += 1
+            try:
+                yield
+            except Exception:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._batch_sequence = None
+                    self._connection.rollback()
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._batch_sequence = None
+                self._connection.commit()
+
+    def close(self):
+        """
+        Returns nothing, but closes the database connection, which is opened
+        again on next use.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _commit(self):
+        if self._batch_depth == 0:
+            self._connection.commit()
+
+    def _bump_sequence(self):
+        # A batch is one change of the document version
+        if self._batch_sequence is not None:
+            return self._batch_sequence
+        sequence = self.sequence() + 1
+        if self._batch_depth > 0:
+            self._batch_sequence = sequence
+        self._connection.execute("INSERT OR REPLACE INTO documents (key, value) VALUES (?, ?)",
+                                 ("journal_sequence", json.dumps(sequence)))
+        return sequence
+
+    def version(self):
+        """
+        Returns a value which changes when another connection modified the
+        database. Changes made through this backend must be applied to the
+        loaded document by the caller, or the document must be invalidated.
+        """
+        with self._lock:
+            # Python's sqlite3 commits the open transaction before a PRAGMA,
+            # and no other connection can write while a batch is open
+            if self._batch_depth > 0:
+                return self._version
+            self._version = self.connection().execute("PRAGMA data_version").fetchone()[0]
+            return self._version
+
+    def _insert_aspect(self, aspect, row):
+        connection = self._connection
+        table = SQLITE_TABLES[aspect]
+        id_key = ASPECT_COLLECTIONS[aspect][1]
+        body = dict(row)
+        if aspect == "threat":
+            impact_scores = body.pop("impact_scores", None)
+            body["_impact_scores"] = impact_scores is not None
+            self._insert_impact_scores(row.get(id_key, None), impact_scores or [])
+        connection.execute("INSERT INTO %s (%s, body) VALUES (?, ?)" % (table, id_key),
+                           (row.get(id_key, None), json.dumps(body)))
+
+    def _insert_impact_scores(self, threat_id, impact_scores):
+        self._connection.executemany(
+            "INSERT INTO impact_scores (threat_id, type, score, body) VALUES (?, ?, ?, ?)",
+            [(threat_id, impact_score.get("type", None), impact_score.get("score", None),
+              json.dumps(impact_score)) for impact_score in impact_scores])
+
+    def _insert_risk(self, risk):
+        values = [risk.get(column, None) for column in SQLITE_RISK_COLUMNS]
+        self._connection.execute("INSERT INTO risktable (%s, body) VALUES (%s)"
+                                 % (", ".join(SQLITE_RISK_COLUMNS), ", ".join(["?"]*(len(values)+1))),
+                                 values + [json.dumps(risk, sort_keys=True)])
+
+    def _select_aspects(self, aspect, where, parameters):
+        """
+        Returns a list of the rows of aspect matching the where clause, in
+        insertion order, with the impact_scores of threats.
+        """
+        table = SQLITE_TABLES[aspect]
+        rows = [json.loads(body) for (body,) in self._connection.execute(
+                "SELECT body FROM %s %s ORDER BY position" % (table, where), parameters)]
+        if aspect == "threat" and rows:
+            threat_ids = [row.get("threat_id", None) for row in rows]
+            impact_scores = {}
+            for threat_ids_chunk in chunks(threat_ids):
+                for threat_id, body in self._connection.execute(
+                        "SELECT threat_id, body FROM impact_scores WHERE threat_id IN (%s) ORDER BY position"
+                        % ",".join(["?"]*len(threat_ids_chunk)), threat_ids_chunk):
+                    impact_scores.setdefault(threat_id, []).append(json.loads(body))
+            if where == "":
+                # Threats without threat_id are not found with IN (...)
+                for threat_id, body in self._connection.execute(
+                        "SELECT threat_id, body FROM impact_scores WHERE threat_id IS NULL ORDER BY position"):
+                    impact_scores.setdefault(threat_id, []).append(json.loads(body))
+            for row in rows:
+                if row.pop("_impact_scores", True):
+                    row["impact_scores"] = impact_scores.get(row.get("threat_id", None), [])
+        return rows
+
+    def import_document(self, data):
+        """
+        Returns nothing, but replaces the content of the database with data,
+        a document in the data.json format.
+        """
+        with self._lock:
+            self.connection()
+            connection = self._connection
+            try:
+                for table in list(SQLITE_TABLES.values()) + ["impact_scores", "risktable",
+                                                             "risk_scores", "documents"]:
+                    connection.execute("DELETE FROM %s" % table)
+                for aspect in SQLITE_TABLES:
+                    for row in data.get(ASPECT_COLLECTIONS[aspect][0], []):
+                        self._insert_aspect(aspect, row)
+                for risk in data.get("risktable", []):
+                    self._insert_risk(risk)
+                risk_scores = data.get("risk_scores", None)
+                collections_ = set(collection for collection, id_key in ASPECT_COLLECTIONS.values())
+                for key, value in data.items():
+                    if key not in collections_ and key not in ["risktable", "risk_scores"]:
+                        connection.execute("INSERT INTO documents (key, value) VALUES (?, ?)",
+                                           (key, json.dumps(value)))
+                if risk_scores is not None:
+                    connection.execute("INSERT INTO documents (key, value) VALUES (?, ?)",
+                                       ("risk_scores.weights", json.dumps(risk_scores.get("weights", ""))))
+                    connection.executemany("INSERT INTO risk_scores (threat_id, impact, score) VALUES (?, ?, ?)",
+                                           [(threat_id, entry.get("impact", None), entry.get("score", None))
+                                            for threat_id, entry in risk_scores.get("threats", {}).items()])
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+
+    def export_document(self):
+        """
+        Returns the content of the database as a document in the data.json format.
+        """
+        with self._lock:
+            connection = self.connection()
+            data = {}
+            for key, value in connection.execute("SELECT key, value FROM documents"):
+                if key != "risk_scores.weights":
+                    data[key] = json.loads(value)
+            for aspect in SQLITE_TABLES:
+                data[ASPECT_COLLECTIONS[aspect][0]] = self._select_aspects(aspect, "", ())
+            data["risktable"] = [json.loads(body) for (body,) in
+                                 connection.execute("SELECT body FROM risktable ORDER BY position")]
+            weights = connection.execute("SELECT value FROM documents WHERE key='risk_scores.weights'").fetchone()
+            if weights is not None:
+                data["risk_scores"] = {"weights": json.loads(weights[0]), "threats": dict(
+                    (threat_id, {"impact": impact, "score": score}) for threat_id, impact, score in
+                    connection.execute("SELECT threat_id, impact, score FROM risk_scores"))}
+            return data
+
+    def get_rows(self, aspect, aspect_ids):
+        """
+        Returns a list of the rows of aspect with an id in aspect_ids.
+        """
+        with self._lock:
+            self.connection()
+            id_key = ASPECT_COLLECTIONS[aspect][1]
+            result = []
+            for aspect_ids_chunk in chunks(list(aspect_ids)):
+                result.extend(self._select_aspects(aspect, "WHERE %s IN (%s)"
+                                                   % (id_key, ",".join(["?"]*len(aspect_ids_chunk))),
+                                                   aspect_ids_chunk))
+            return result
+
+    def linked(self, from_key, from_ids, to_key):
+        """
+        Returns a set of to_key ids in risktable rows with a from_key in from_ids.
+        """
+        assert(from_key in SQLITE_RISK_COLUMNS and to_key in SQLITE_RISK_COLUMNS)
+        with self._lock:
+            connection = self.connection()
+            result = set()
+            for from_ids_chunk in chunks(list(from_ids)):
+                for (to_id,) in connection.execute(
+                        "SELECT DISTINCT %s FROM risktable WHERE %s IN (%s) AND %s IS NOT NULL AND %s != ''"
+                        % (to_key, from_key, ",".join(["?"]*len(from_ids_chunk)), to_key, to_key),
+                        from_ids_chunk):
+                    result.add(to_id)
+            return result
+
+    def _upsert_aspect(self, aspect, table, id_key, row):
+        connection = self._connection
+        aspect_id = row.get(id_key, None)
+        position = connection.execute("SELECT position FROM %s WHERE %s=?" % (table, id_key),
+                                      (aspect_id,)).fetchone()
+        if position is None:
+            self._insert_aspect(aspect, row)
+            return
+        body = dict(row)
+        if aspect == "threat":
+            impact_scores = body.pop("impact_scores", None)
+            body["_impact_scores"] = impact_scores is not None
+            connection.execute("DELETE FROM impact_scores WHERE threat_id=?", (aspect_id,))
+            self._insert_impact_scores(aspect_id, impact_scores or [])
+        connection.execute("UPDATE %s SET body=? WHERE position=?" % table, (json.dumps(body), position[0]))
+
+    def apply_operations(self, operations):
+        """
+        Returns the new document version, after applying journal operations
+        (see replay_operations) to the database in one transaction.
+        """
+        with self._lock:
+            self.connection()
+            try:
+                for operation in operations:
+                    self._apply_operation(operation)
+                sequence = self._bump_sequence()
+                self._commit()
+                return sequence
+            except Exception:
+                self._connection.rollback()
+                raise
+
+    def _apply_operation(self, operation):
+        connection = self._connection
+        op = operation["op"]
+        path = operation["path"]
+        tables = dict((collection, aspect) for aspect, (collection, id_key) in ASPECT_COLLECTIONS.items())
+        if path[0] in tables and len(path) == 1:
+            aspect = tables[path[0]]
+            table = SQLITE_TABLES[aspect]
+            id_key = ASPECT_COLLECTIONS[aspect][1]
+            if op == "append":
+                self._insert_aspect(aspect, operation["value"])
+            elif op == "update":
+                self._upsert_aspect(aspect, table, id_key, operation["value"])
+            elif op == "delete":
+                for ids_chunk in chunks(list(operation["ids"])):
+                    marks = ",".join(["?"]*len(ids_chunk))
+                    if aspect == "threat":
+                        connection.execute("DELETE FROM impact_scores WHERE threat_id IN (%s)" % marks, ids_chunk)
+                    connection.execute("DELETE FROM %s WHERE %s IN (%s)" % (table, id_key, marks), ids_chunk)
+            else:
+                raise ValueError("Unsupported operation on %s: %s" % (path[0], op))
+        elif path == ["risktable"]:
+            if op == "append":
+                self._insert_risk(operation["value"])
+            elif op == "unlink":
+                ids = list(operation["ids"])
+                positions = {}
+                for ids_chunk in chunks(ids):
+                    marks = ",".join(["?"]*len(ids_chunk))
+                    where = " OR ".join("%s IN (%s)" % (column, marks) for column in SQLITE_RISK_COLUMNS)
+                    for position, body in connection.execute("SELECT position, body FROM risktable WHERE "
+                                                              + where, ids_chunk*len(SQLITE_RISK_COLUMNS)):
+                        positions[position] = json.loads(body)
+                match = all if operation.get("match", "all") == "all" else any
+                remove = [(position,) for position, risk in positions.items()
+                          if match(id_value in set(risk.values()) for id_value in ids)]
+                connection.executemany("DELETE FROM risktable WHERE position=?", remove)
+            else:
+                raise ValueError("Unsupported operation on risktable: " + str(op))
+        elif path[:2] == ["risk_scores", "threats"] and len(path) == 3:
+            if op == "set":
+                entry = operation["value"]
+                connection.execute("INSERT OR REPLACE INTO risk_scores (threat_id, impact, score) VALUES (?, ?, ?)",
+                                   (path[2], entry.get("impact", None), entry.get("score", None)))
+            else:
+                connection.execute("DELETE FROM risk_scores WHERE threat_id=?", (path[2],))
+        elif path == ["risk_scores", "weights"]:
+            connection.execute("INSERT OR REPLACE INTO documents (key, value) VALUES (?, ?)",
+                               ("risk_scores.weights", json.dumps(operation["value"])))
+        else:
+            # Other top level keys are stored as one json value each
+            row = connection.execute("SELECT value FROM documents WHERE key=?", (path[0],)).fetchone()
+            document = {path[0]: json.loads(row[0])} if row else {}
+            replay_operations(document, [operation])
+            if path[0] in document:
+                connection.execute("INSERT OR REPLACE INTO documents (key, value) VALUES (?, ?)",
+                                   (path[0], json.dumps(document[path[0]])))
+            else:
+                connection.execute("DELETE FROM documents WHERE key=?", (path[0],))
+
+def get_backend():
+    """
+    Returns the SqliteBackend storing data.json, or None when data.json is
+    stored as a json file.
+    """
+    return STORE.backends.get(DATA, None)
+
+if DATA_BACKEND == "sqlite":
+    STORE.backends[DATA] = SqliteBackend(DATA_SQLITE, seed_filename=DATA)
+
+##############
+# Workspaces #
+##############
+# A request is served from workspace "sales" (WORKSPACES/sales/data.json)
+# when its path starts with /workspace/sales/ or it has the header
+# "X-Workspace: sales". Other requests use the default assessments directory.
+WORKSPACE_PREFIX = "/workspace/"
+WORKSPACE_HEADER = "X-Workspace"
+WORKSPACE_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+# Documents copied from the default assessments directory into a workspace
+# which has no copy of its own yet
+WORKSPACE_SEEDS = [SCHEMA, CONTROL_LIBRARY, DELIVERABLES]
+
+class Workspace(object):
+    """
+    Workspace is an assessment stored in its own directory, with its own
+    AssessmentStore. active counts the requests using the workspace, and
+    size is the estimated memory of its loaded documents.
+    """
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+        self.store = AssessmentStore(directory=directory)
+        if DATA_BACKEND == "sqlite":
+            data_file = self.store.path(DATA)
+            self.store.backends[DATA] = SqliteBackend(os.path.splitext(data_file)[0] + ".sqlite",
+                                                      seed_filename=data_file)
+        self.active = 0
+        self.size = 0
+        self.migrated = False
+
+class Workspaces(object):
+    """
+    Workspaces loads the workspaces of directory on first access and keeps
+    the most recently used ones in memory. When the loaded workspaces use
+    more than budget bytes (estimated by AssessmentStore.size), the least
+    recently used workspaces without running requests are flushed to disk
+    and evicted.
+    """
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._workspaces = collections.OrderedDict()
+
+    def acquire(self, name):
+        """
+        Returns the Workspace name marked as used until release(), or None
+        if directory has no such workspace.
+        """
+        if not WORKSPACE_NAME.match(name):
+            return None
+        with self._lock:
+            workspace = self._workspaces.pop(name, None)
+            if workspace is None:
+                directory = os.path.join(self.directory, name)
+                if not os.path.isfile(os.path.join(directory, os.path.basename(DATA))):
+                    return None
+                workspace = Workspace(name, directory)
+                for filename in WORKSPACE_SEEDS:
+                    if not os.path.exists(workspace.store.path(filename)):
+                        shutil.copy(filename, workspace.store.path(filename))
+            self._workspaces[name] = workspace
+            workspace.active += 1
+            return workspace
+
+    def release(self, workspace):
+        """
+        Returns nothing, but ends a use of workspace, and evicts workspaces
+        while the budget is exceeded.
+        """
+        with self._lock:
+            workspace.active -= 1
+            workspace.size = workspace.store.size()
+            size = sum(loaded.size for loaded in self._workspaces.values())
+            for name, loaded in list(self._workspaces.items()):
+                if size <= self.budget:
+                    break
+                if loaded.active > 0:
+                    continue
+                start = time.time()
+                loaded.store.flush()
+                METRICS.observe("workspace_flush", time.time() - start, loaded.size)
+                size -= loaded.size
+                del self._workspaces[name]
+
+    def names(self):
+        """
+        Returns the names of the loaded workspaces, least recently used first.
+        """
+        with self._lock:
+            return list(self._workspaces)
+
+class WorkspacePrefix(object):
+    """
+    WSGI middleware serving /workspace/<name>/<path> as <path> of workspace
+    name. The prefix is moved to SCRIPT_NAME, so url_for() and
+    request.script_root keep links inside the workspace.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path.startswith(WORKSPACE_PREFIX):
+            name, _, path = path[len(WORKSPACE_PREFIX):].partition("/")
+            environ["openisms.workspace"] = name
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + WORKSPACE_PREFIX + name
+            environ["PATH_INFO"] = "/" + path
+        return self.wsgi_app(environ, start_response)
+
+WORKSPACES = None
+if WORKSPACES_DIRECTORY:
+    WORKSPACES = Workspaces(WORKSPACES_DIRECTORY, int(WORKSPACE_MEMORY_MB * 1024 * 1024))
+    app.wsgi_app = WorkspacePrefix(app.wsgi_app)
+
+@app.before_request
+def open_workspace():
+    """
+    Selects the workspace of the request, migrating it on first access
+    """
+    if WORKSPACES is None:
+        return None
+    name = request.environ.get("openisms.workspace", None) or request.headers.get(WORKSPACE_HEADER, None)
+    if not name:
+        return None
+    workspace = WORKSPACES.acquire(name)
+    if workspace is None:
+        if request.path.startswith("/api/"):
+            return jsonify({"error": "Unknown workspace " + name}), 404
+        return "Unknown workspace " + name, 404
+    g.workspace = workspace
+    if not workspace.migrated:
+        fix_data_structure()
+        workspace.migrated = True
+    return None
+
+@app.teardown_request
+def close_workspace(exception=None):
+    workspace = g.pop("workspace", None)
+    if workspace is not None:
+        WORKSPACES.release(workspace)
+
 
 def get_impact_type_list(data):
     """
@@ -73,84 +1326,849 @@ def get_impact_type_list(data):
     assert(type(result) is list)
     return result
 
+##############
+# Migrations #
+##############
+# Version of the structure of data.json written by this version of openisms
+SCHEMA_VERSION = 1
+
+def compile_templates(schema, impact_types):
+    """
+    Returns a dict mapping each aspect collection to a list of
+    (key, default value) pairs taken from its template in schema.json, and
+    "impact_scores" to the default impact score of each impact type.
+    """
+    templates = {}
+    for aspect, (collection, id_key) in ASPECT_COLLECTIONS.items():
+        template = schema.get(collection, None) or [{}]
+        templates[collection] = [(key, value) for key, value in sorted(template[0].items())
+                                 if key != "impact_scores" or collection != "threats"]
+    templates["impact_scores"] = [{"type": impact_type, "score": "0"} for impact_type in impact_types]
+    return templates
+
+def get_schema_fingerprint(schema, impact_types):
+    """
+    Returns a hash of the templates in schema.json and the impact types,
+    which changes whenever stored rows may lack keys.
+    """
+    templates = dict((collection, schema.get(collection, None))
+                     for collection, id_key in ASPECT_COLLECTIONS.values())
+    return hashlib.sha1(json.dumps([templates, impact_types], sort_keys=True)).hexdigest()
+
+def migrate_templates(data, schema):
+    """
+    Returns nothing, but adds the keys missing from the processes, assets,
+    threats and containers in data with the defaults of schema.json, and a
+    zero score for each impact type missing from a threat. Each row is
+    visited once.
+    """
+    impact_types = get_impact_type_list(data)
+    templates = compile_templates(schema, impact_types)
+    for collection, id_key in ASPECT_COLLECTIONS.values():
+        template = templates[collection]
+        for row in data.get(collection, None) or []:
+            for key, value in template:
+                if key not in row:
+                    row[key] = copy.deepcopy(value)
+            if collection == "threats":
+                impact_scores = row.setdefault("impact_scores", [])
+                scored_types = set(impact_score.get("type", None) for impact_score in impact_scores)
+                for impact_score in templates["impact_scores"]:
+                    if impact_score["type"] not in scored_types:
+                        impact_scores.append(dict(impact_score))
+
+# Migrations of data.json: (version, function(data, schema)). A function
+# runs when data.json has an older schema_version. migrate_templates also
+# runs when schema.json or the impact types changed.
+MIGRATIONS = [(1, migrate_templates)]
+
+def migrate_data(data, schema):
+    """
+    Returns True if data was migrated to SCHEMA_VERSION and the current
+    schema.json, or False if it was already current.
+    Arguments:
+    - data: the document loaded from data.json
+    - schema: the document loaded from schema.json
+    """
+    version = data.get("schema_version", 0)
+    fingerprint = get_schema_fingerprint(schema, get_impact_type_list(data))
+    if version == SCHEMA_VERSION and data.get("schema_fingerprint", None) == fingerprint:
+        return False
+    migrations = [migration for migration_version, migration in MIGRATIONS if migration_version > version]
+    if migrate_templates not in migrations:
+        migrations.append(migrate_templates)
+    for migration in migrations:
+        migration(data, schema)
+    data["schema_version"] = SCHEMA_VERSION
+    data["schema_fingerprint"] = fingerprint
+    return True
+
+@instrumented
+@transactional(DATA)
 def fix_data_structure():
-    data   = import_jsondata(DATA)
-    schema = import_jsondata(SCHEMA)
-
-    for index, process in enumerate(data['processes']):
-        fixed_process = fix_json_dict(schema['processes'][0],process)
-        data['processes'][index]=fixed_process
-    for index, asset in enumerate(data['assets']):
-        fixed_asset = fix_json_dict(schema['assets'][0],asset)
-        data['assets'][index]=fixed_asset
-    for index, threat in enumerate(data['threats']):
-        fixed_threat = fix_json_dict(schema['threats'][0],threat)
-        impact_details = threat.get("impact_scores",None)
-        impact_types = []
-        for impact_detail in impact_details:
-            impact_type = impact_detail.get("type",None)
-     	    if impact_type:
-                impact_types.append(impact_type)
-        global_impact_types = get_impact_type_list(data)
-        for global_impact_type in global_impact_types:
-            if not global_impact_type in impact_types: 
-                new_score = {"type":global_impact_type, "score":"0"}
-                fixed_threat['impact_scores'].append(new_score)
-        data['threats'][index]=fixed_threat
-    output = json.dumps(data, indent=4)
-    write_file(DATA, output, charset='utf-8')
+    """
+    Migrates data.json to the current structure (see migrate_data), and
+    writes it only if anything changed.
+    """
+    data   = STORE.load(DATA)
+    schema = STORE.load(SCHEMA)
+    if not migrate_data(data, schema):
+        return False
+    STORE.drop_derived(DATA)
+    # The journal was replayed by STORE.load(), so this compacts it as well
+    STORE.save(DATA, data)
+    return True
+
+
+##############
+# Risk graph #
+##############
+# Links between aspect ids recorded in the risktable, from parent to child.
+RISK_EDGES = [("process_id", "asset_id"),
+              ("asset_id", "threat_id"),
+              ("threat_id", "container_id"),
+              ("container_id", "control_id")]
+
+def risk_key(risk):
+    """
+    Returns a hashable key of a risktable row, equal for equal rows.
+    """
+    return frozenset(risk.items())
+
+class RiskGraph(object):
+    """
+    RiskGraph indexes the rows of data["risktable"] as a graph, with forward
+    (process->asset->threat->container->control) and reverse adjacency, so
+    helpers can look up linked ids without scanning the risktable.
+    Each edge and each id counts the risktable rows referring to it, so rows
+    can be added and removed incrementally.
+    Functions in listeners are called with every added row (after adding
+    it) and every removed row (before removing it).
+    The rows themselves are counted by their risk_key(), so duplicate rows
+    are found in constant time, and indexed by each of their ids.
+    """
+    def __init__(self, risktable):
+        assert(type(risktable) is list)
+        self._edges = {}
+        self._nodes = {}
+        self._rows = {}
+        self._id_rows = {}
+        self.listeners = []
+        for parent_key, child_key in RISK_EDGES:
+            self._edges[(parent_key, child_key)] = {}
+            self._edges[(child_key, parent_key)] = {}
+        for risk in risktable:
+            self.add(risk)
+
+    def _count(self, table, key, value, delta):
+        counts = table.setdefault(key, {})
+        count = counts.get(value, 0) + delta
+        if count > 0:
+            counts[value] = count
+        else:
+            counts.pop(value, None)
+            if not counts:
+                table.pop(key, None)
+
+    def _update(self, risk, delta):
+        key = risk_key(risk)
+        count = self._rows.get(key, 0) + delta
+        if count > 0:
+            self._rows[key] = count
+        else:
+            self._rows.pop(key, None)
+        for id_key, id_value in risk.items():
+            if id_value:
+                self._count(self._id_rows, (id_key, id_value), key, delta)
+                nodes = self._nodes.setdefault(id_key, {})
+                count = nodes.get(id_value, 0) + delta
+                if count > 0:
+                    nodes[id_value] = count
+                else:
+                    nodes.pop(id_value, None)
+        for parent_key, child_key in RISK_EDGES:
+            parent_id = risk.get(parent_key, None)
+            child_id = risk.get(child_key, None)
+            if parent_id and child_id:
+                self._count(self._edges[(parent_key, child_key)], parent_id, child_id, delta)
+                self._count(self._edges[(child_key, parent_key)], child_id, parent_id, delta)
+
+    def add(self, risk):
+        """
+        Returns nothing, but adds the links of a risktable row to the graph.
+        """
+        assert(type(risk) is dict)
+        self._update(risk, 1)
+        for listener in self.listeners:
+            listener(risk)
+
+    def remove(self, risk):
+        """
+        Returns nothing, but removes the links of a risktable row from the graph.
+        """
+        assert(type(risk) is dict)
+        for listener in self.listeners:
+            listener(risk)
+        self._update(risk, -1)
+
+    def contains(self, risk):
+        """
+        Returns True if the risktable has a row equal to risk.
+        """
+        return risk_key(risk) in self._rows
+
+    def rows(self, filters):
+        """
+        Returns a list of the risktable rows containing all ids of filters,
+        sorted by their ids. Duplicate rows are returned as often as they
+        are in the risktable.
+        Arguments:
+        - filters: non empty dict of ids, such as {"threat_id": "threat000001"}
+        """
+        assert(type(filters) is dict and filters)
+        indexes = sorted((self._id_rows.get(item, {}) for item in filters.items()), key=len)
+        result = []
+        for key in indexes[0]:
+            if all(key in index for index in indexes[1:]):
+                result.extend(dict(key) for x in range(self._rows[key]))
+        result.sort(key=lambda risk: sorted(risk.items()))
+        return result
+
+    def linked(self, from_key, from_ids, to_key):
+        """
+        Returns a set of to_key ids directly linked to any of from_ids.
+        Arguments:
+        - from_key: id type such as "process_id"
+        - from_ids: list or set of ids of type from_key
+        - to_key: neighbouring id type in RISK_EDGES, such as "asset_id"
+        """
+        adjacency = self._edges[(from_key, to_key)]
+        result = set()
+        for from_id in from_ids:
+            result.update(adjacency.get(from_id, {}))
+        return result
+
+    def reachable(self, from_key, from_ids, to_key):
+        """
+        Returns a set of to_key ids reachable from any of from_ids following
+        the links of RISK_EDGES downwards (e.g. from "asset_id" to
+        "control_id") or upwards (e.g. from "threat_id" to "process_id").
+        """
+        keys = self.keys()
+        start, stop = keys.index(from_key), keys.index(to_key)
+        step = 1 if stop >= start else -1
+        result = set(from_ids)
+        for position in range(start, stop, step):
+            result = self.linked(keys[position], result, keys[position+step])
+        return result
+
+    def keys(self):
+        """
+        Returns the list of id types linked by the graph, parents first.
+        """
+        return [parent_key for parent_key, child_key in RISK_EDGES] + [RISK_EDGES[-1][1]]
+
+    def ids(self, id_key):
+        """
+        Returns a set of all ids of type id_key referenced in the risktable.
+        """
+        return set(self._nodes.get(id_key, {}))
+
+    def count(self, id_key, id_value):
+        """
+        Returns the number of risktable rows referencing id_value as id_key.
+        """
+        return self._nodes.get(id_key, {}).get(id_value, 0)
+
+def get_risk_graph():
+    """
+    Returns the RiskGraph of the risktable in data.json.
+    """
+    return STORE.derived(DATA, "risk_graph", lambda data: RiskGraph(data["risktable"]))
+
+##################
+# Aspect indexes #
+##################
+# Aspect type -> (collection in data.json, primary key)
+ASPECT_COLLECTIONS = {"process": ("processes", "process_id"),
+                      "asset": ("assets", "asset_id"),
+                      "threat": ("threats", "threat_id"),
+                      "container": ("containers", "container_id")}
+
+class AspectIndex(object):
+    """
+    AspectIndex maps the primary key of each row in an aspect collection
+    (or in the control library) to the row itself, for exact lookups.
+    The rows are the ones stored in the document, not copies.
+    """
+    def __init__(self, rows, id_key):
+        assert(type(rows) is list)
+        self.id_key = id_key
+        self._rows = {}
+        for row in rows:
+            self.add(row)
+
+    def get(self, row_id):
+        """
+        Returns the row with primary key row_id, or None.
+        """
+        return self._rows.get(row_id, None)
+
+    def add(self, row):
+        """
+        Returns nothing, but indexes row by its primary key.
+        """
+        row_id = row.get(self.id_key, None)
+        if row_id:
+            self._rows[row_id] = row
+
+    def remove(self, row_id):
+        """
+        Returns the removed row with primary key row_id, or None.
+        """
+        return self._rows.pop(row_id, None)
+
+    def ids(self):
+        return set(self._rows)
+
+class PrefixIndex(object):
+    """
+    PrefixIndex keeps ids sorted, so all ids starting with a given prefix are
+    found with a binary search instead of a substring test on every id.
+    """
+    def __init__(self, ids):
+        self._ids = sorted(set(ids))
+
+    def startswith(self, prefix):
+        """
+        Returns a sorted list of the ids starting with prefix.
+        """
+        result = []
+        position = bisect.bisect_left(self._ids, prefix)
+        while position < len(self._ids) and self._ids[position].startswith(prefix):
+            result.append(self._ids[position])
+            position += 1
+        return result
+
+def get_aspect_index(aspect):
+    """
+    Returns the AspectIndex of an aspect collection in data.json.
+    Arguments:
+    - aspect: one of the keys of ASPECT_COLLECTIONS, such as "asset"
+    """
+    collection, id_key = ASPECT_COLLECTIONS[aspect]
+    return STORE.derived(DATA, aspect + "_index",
+                         lambda data: AspectIndex(data[collection], id_key))
+
+def get_control_index():
+    """
+    Returns the AspectIndex of control_library.json, keyed on control_id.
+    """
+    return STORE.derived(CONTROL_LIBRARY, "control_index",
+                         lambda library: AspectIndex(library["control_library"], "control_id"))
+
+def get_control_prefix_index():
+    """
+    Returns the PrefixIndex of the control_ids in control_library.json.
+    """
+    return STORE.derived(CONTROL_LIBRARY, "control_prefix_index",
+                         lambda library: PrefixIndex(get_control_index().ids()))
+
+class AssetOwners(object):
+    """
+    AssetOwners maps the owner of each asset, case insensitively, to the
+    set of its asset ids, so risks are filtered by owner without visiting
+    every asset. Assets marked dirty by invalidate() are indexed again on
+    next use.
+    """
+    def __init__(self, asset_ids):
+        self._lock = threading.RLock()
+        self._owners = {}
+        self._owner_of = {}
+        self._dirty = set(asset_ids)
+
+    def invalidate(self, id_key, id_value):
+        if id_key == "asset_id":
+            with self._lock:
+                self._dirty.add(id_value)
+
+    def asset_ids(self, asset_owner):
+        """
+        Returns the set of asset ids owned by asset_owner.
+        """
+        with self._lock:
+            if self._dirty:
+                asset_index = get_aspect_index("asset")
+                dirty, self._dirty = self._dirty, set()
+                for asset_id in dirty:
+                    owner = self._owner_of.pop(asset_id, None)
+                    if owner is not None:
+                        self._owners[owner].discard(asset_id)
+                        if not self._owners[owner]:
+                            del self._owners[owner]
+                    asset = asset_index.get(asset_id)
+                    if asset is not None:
+                        owner = (asset.get("asset_owner", None) or "").lower()
+                        self._owner_of[asset_id] = owner
+                        self._owners.setdefault(owner, set()).add(asset_id)
+            return set(self._owners.get(asset_owner.lower(), ()))
+
+def get_asset_owners():
+    """
+    Returns the AssetOwners of the assets in data.json.
+    """
+    return STORE.derived(DATA, "asset_owners",
+                         lambda data: AssetOwners(get_aspect_index("asset").ids()))
+
+#################
+# Process views #
+#################
+class ProcessViewCache(object):
+    """
+    ProcessViewCache memoizes the view model of each process built by
+    build_process_view(). A view is dropped when a risktable row or an
+    aspect within the subgraph of its process changes.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.views = {}
+        self.generation = 0
+        graph.listeners.append(self._risk_changed)
+
+    def _risk_changed(self, risk):
+        for id_key, id_value in risk.items():
+            self.invalidate(id_key, id_value)
+
+    def invalidate(self, id_key, id_value):
+        """
+        Returns nothing, but drops the views of the processes linked to id_value.
+        """
+        self.generation += 1
+        if id_key == "process_id":
+            self.views.pop(id_value, None)
+        elif id_key in self.graph.keys():
+            for process_id in self.graph.reachable(id_key, [id_value], "process_id"):
+                self.views.pop(process_id, None)
+
+def get_process_views():
+    """
+    Returns the ProcessViewCache of data.json.
+    """
+    return STORE.derived(DATA, "process_views", lambda data: ProcessViewCache(get_risk_graph()))
+
+@instrumented
+def build_process_view(process_id):
+    """
+    Returns the view model used to analyse and report a process: a dict
+    with process_table, asset_table, threat_table (with containers,
+    controls and risk scores), rxo_values, threat_library,
+    global_impact_details, control_library and container_library.
+    The process subgraph is walked once per level and the result is
+    memoized until a change touches the process.
+    Arguments:
+    - process_id: string with a process_id
+    """
+    process_views = get_process_views()
+    view = process_views.views.get(process_id, None)
+    if view is not None:
+        return view
+    generation = process_views.generation
+    data = STORE.load(DATA)
+    asset_ids = get_process_assets([process_id])
+    threat_ids = get_asset_threats(asset_ids)
+    threat_table = get_table(threat_ids)
+    threat_table = inject_containers_and_controls(threat_table)
+    threat_table = inject_risk_scores(threat_table)
+    view = {"process_table": get_table([process_id]),
+            "asset_table": get_table(asset_ids),
+            "threat_table": threat_table,
+            "rxo_values": data["rxo_values"],
+            "threat_library": data.get("threat_library"),
+            "global_impact_details": data["global_impact_details"],
+            "control_library": STORE.load(CONTROL_LIBRARY),
+            "container_library": data.get("container_library", None)}
+    if process_views.generation == generation:
+        process_views.views[process_id] = view
+    return view
+
+# Derived structures of data.json told about changed aspects
+ASPECT_LISTENERS = ["process_views", "risk_ranking", "process_names", "asset_owners"]
+
+def aspect_changed(id_key, id_value):
+    """
+    Returns nothing, but refreshes the built structures of ASPECT_LISTENERS
+    depending on the aspect id_value, such as memoized process views.
+    Arguments:
+    - id_key: id type such as "asset_id"
+    - id_value: the id of the changed aspect
+    """
+    for name in ASPECT_LISTENERS:
+        structure = STORE.built_derived(DATA, name)
+        if structure is not None:
+            structure.invalidate(id_key, id_value)
 
+#########
+# Pages #
+#########
+# Number of rows on a page, unless the request asks for another limit
+PAGE_LIMIT = 50
+PAGE_LIMIT_MAX = 500
+
+class SortedPages(object):
+    """
+    SortedPages keeps the sort keys of a collection in a sorted list, so a
+    page of rows is found with bisect and slicing instead of sorting the
+    collection on every request. Sort keys are tuples ending with the id
+    of the row, and ids marked dirty get their key recomputed on next use.
+    Subclasses implement sort_key(row_id), returning None for rows which
+    are not listed, or override sort_keys(row_ids) to compute the keys of
+    many rows at once.
+    Readers in several threads share the sorted list, so it is only
+    changed and read while holding the lock of the object.
+    """
+    def __init__(self, row_ids):
+        self._lock = threading.RLock()
+        self.keys = []
+        self.positions = {}
+        self._dirty = set(row_ids)
+
+    def mark_dirty(self, row_id):
+        """
+        Returns nothing, but recomputes the sort key of row_id on next use.
+        """
+        with self._lock:
+            self._dirty.add(row_id)
+
+    def sort_keys(self, row_ids):
+        """
+        Returns a dict mapping row ids to the sort keys of sort_key().
+        """
+        return dict((row_id, self.sort_key(row_id)) for row_id in row_ids)
+
+    def refresh(self):
+        """
+        Returns nothing, but recomputes the sort keys of the dirty ids.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            for row_id in dirty:
+                key = self.positions.pop(row_id, None)
+                if key is not None:
+                    del self.keys[bisect.bisect_left(self.keys, key)]
+            new_keys = [(row_id, key) for row_id, key in self.sort_keys(dirty).items() if key is not None]
+            if len(new_keys) > len(self.keys):
+                self.keys.extend(key for row_id, key in new_keys)
+                self.keys.sort()
+            else:
+                for row_id, key in new_keys:
+                    bisect.insort(self.keys, key)
+            self.positions.update(new_keys)
+
+    def page(self, row_ids=None, low=None, high=None, offset=0, limit=PAGE_LIMIT,
+             after=None, reverse=False):
+        """
+        Returns a dict describing a page of rows in sort key order:
+        {"ids":[row ids], "total":rows matching, "offset":position of the
+         first row, "limit":limit, "next":id to continue after, or None}
+        Arguments:
+        - row_ids: optional set of ids; other rows are skipped
+        - low, high: optional bounds; only keys with low <= key < high match
+        - offset: number of matching rows to skip
+        - limit: maximum number of rows
+        - after: optional id of the last row of the previous page, used
+          instead of offset
+        - reverse: if True, rows are returned in reverse key order
+        """
+        with self._lock:
+            self.refresh()
+            after_key = self.positions.get(after, None) if after is not None else None
+            if row_ids is not None:
+                return self._filtered_page(row_ids, low, high, offset, limit, after_key, reverse)
+            keys = self.keys
+            start = 0 if low is None else bisect.bisect_left(keys, low)
+            stop = len(keys) if high is None else bisect.bisect_left(keys, high)
+            stop = max(start, stop)
+            if after_key is not None:
+                if reverse:
+                    offset = stop - bisect.bisect_left(keys, after_key, start, stop)
+                else:
+                    offset = bisect.bisect_right(keys, after_key, start, stop) - start
+            offset = max(0, offset)
+            if reverse:
+                selected = keys[max(start, stop - offset - limit):max(start, stop - offset)][::-1]
+            else:
+                selected = keys[start + offset:min(stop, start + offset + limit)]
+        return self._page_result(selected, stop - start, offset, limit)
+
+    def _filtered_page(self, row_ids, low, high, offset, limit, after_key, reverse):
+        """
+        Returns the page of page() restricted to row_ids. Only the keys of
+        row_ids are visited, and only the rows up to the end of the page
+        are ordered, so the cost grows with the matching rows, not with
+        the collection.
+        """
+        keys = [self.positions[x] for x in row_ids if x in self.positions]
+        if low is not None or high is not None:
+            keys = [key for key in keys if (low is None or low <= key) and (high is None or key < high)]
+        if after_key is not None:
+            if reverse:
+                offset = sum(1 for key in keys if key >= after_key)
+            else:
+                offset = sum(1 for key in keys if key <= after_key)
+        offset = max(0, offset)
+        if reverse:
+            selected = heapq.nlargest(offset + limit, keys)[offset:]
+        else:
+            selected = heapq.nsmallest(offset + limit, keys)[offset:]
+        return self._page_result(selected, len(keys), offset, limit)
+
+    def _page_result(self, selected, total, offset, limit):
+        ids = [key[-1] for key in selected]
+        following = None
+        if ids and offset + len(ids) < total:
+            following = ids[-1]
+        return {"ids": ids, "total": total, "offset": offset,
+                "limit": limit, "next": following}
+
+class RiskRanking(SortedPages):
+    """
+    RiskRanking keeps the threats linked in the risktable sorted by risk
+    score, highest first, with unscored threats last. Threats are marked
+    dirty when their risktable rows or their details change.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        SortedPages.__init__(self, graph.ids("threat_id"))
+        graph.listeners.append(self._risk_changed)
+
+    def _risk_changed(self, risk):
+        threat_id = risk.get("threat_id", None)
+        if threat_id:
+            self.mark_dirty(threat_id)
+
+    def invalidate(self, id_key, id_value):
+        if id_key == "threat_id":
+            self.mark_dirty(id_value)
+
+    def sort_keys(self, threat_ids):
+        threat_index = get_aspect_index("threat")
+        threats = []
+        for threat_id in threat_ids:
+            threat = threat_index.get(threat_id)
+            if threat is not None and self.graph.count("threat_id", threat_id):
+                threats.append(threat)
+        result = dict((threat_id, None) for threat_id in threat_ids)
+        for threat, risk_score in zip(threats, get_cached_risk_scores(threats)):
+            result[threat["threat_id"]] = risk_rank_key(risk_score, threat["threat_id"])
+        return result
+
+def risk_rank_key(risk_score, threat_id=""):
+    """
+    Returns the sort key of a threat in the RiskRanking.
+    Arguments:
+    - risk_score: string such as "03.3" or "No risk calculated"
+    - threat_id: string with a threat_id
+    """
+    try:
+        return (0, -float(risk_score), threat_id)
+    except (TypeError, ValueError):
+        return (1, 0.0, threat_id)
+
+def get_risk_ranking():
+    """
+    Returns the RiskRanking of the threats in data.json.
+    """
+    return STORE.derived(DATA, "risk_ranking", lambda data: RiskRanking(get_risk_graph()))
+
+class ProcessNames(SortedPages):
+    """
+    ProcessNames keeps the processes sorted by name, case insensitively.
+    """
+    def __init__(self, process_ids):
+        SortedPages.__init__(self, process_ids)
+
+    def invalidate(self, id_key, id_value):
+        if id_key == "process_id":
+            self.mark_dirty(id_value)
+
+    def sort_key(self, process_id):
+        process = get_aspect_index("process").get(process_id)
+        if process is None:
+            return None
+        return ((process.get("process_name", None) or "").lower(), process_id)
+
+def get_process_names():
+    """
+    Returns the ProcessNames of the processes in data.json.
+    """
+    return STORE.derived(DATA, "process_names",
+                         lambda data: ProcessNames(get_aspect_index("process").ids()))
+
+def get_page_arguments(arguments):
+    """
+    Returns a dict with the offset, limit and after arguments of a page,
+    read from the request arguments.
+    """
+    try:
+        offset = max(0, int(arguments.get("offset", 0)))
+        limit = min(PAGE_LIMIT_MAX, max(1, int(arguments.get("limit", PAGE_LIMIT))))
+    except ValueError:
+        offset, limit = 0, PAGE_LIMIT
+    return {"offset": offset, "limit": limit, "after": arguments.get("after", None) or None}
+
+def get_page_links(endpoint, page, arguments):
+    """
+    Returns page with "previous_url" and "next_url" added, linking to the
+    neighbouring pages of endpoint with the same request arguments.
+    """
+    arguments = dict((key, value) for key, value in arguments.items()
+                     if value and key not in ["offset", "after"])
+    page["previous_url"] = None
+    page["next_url"] = None
+    if page["offset"] > 0:
+        page["previous_url"] = url_for(endpoint, offset=max(0, page["offset"] - page["limit"]), **arguments)
+    if page["next"] is not None:
+        page["next_url"] = url_for(endpoint, offset=page["offset"] + len(page["ids"]), **arguments)
+    return page
+
+##############################
+# Statement of Applicability #
+##############################
+class SoaMaterializer(object):
+    """
+    SoaMaterializer keeps the Statement of Applicability figures of every
+    control used in the risktable: the number of risktable rows with the
+    control and the ids of its containers and of the assets they protect.
+    The figures are computed in one pass over the risk graph and refreshed
+    for the affected controls only when risktable rows change. Readers in
+    several threads share the entries, so they are only refreshed and read
+    while holding the lock of the object.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self._lock = threading.RLock()
+        self.entries = {}
+        self._dirty = set()
+        for control_id in graph.ids("control_id"):
+            self._refresh(control_id)
+        graph.listeners.append(self._risk_changed)
+
+    def _risk_changed(self, risk):
+        for id_key in ["asset_id", "threat_id", "container_id", "control_id"]:
+            id_value = risk.get(id_key, None)
+            if id_value:
+                control_ids = self.graph.reachable(id_key, [id_value], "control_id")
+                with self._lock:
+                    self._dirty.update(control_ids)
+
+    def _refresh(self, control_id):
+        control_count = self.graph.count("control_id", control_id)
+        if control_count == 0:
+            self.entries.pop(control_id, None)
+            return
+        container_ids = self.graph.linked("control_id", [control_id], "container_id")
+        threat_ids = self.graph.linked("container_id", container_ids, "threat_id")
+        asset_ids = self.graph.linked("threat_id", threat_ids, "asset_id")
+        self.entries[control_id] = {"control_count": control_count,
+                                    "container_ids": container_ids,
+                                    "asset_ids": asset_ids}
+
+    def get(self, control_id):
+        """
+        Returns a dict with control_count, container_ids and asset_ids of
+        control_id, or None if the control is not used in the risktable.
+        """
+        with self._lock:
+            while self._dirty:
+                self._refresh(self._dirty.pop())
+            return self.entries.get(control_id, None)
+
+def get_soa():
+    """
+    Returns the SoaMaterializer of the risktable in data.json.
+    """
+    return STORE.derived(DATA, "soa", lambda data: SoaMaterializer(get_risk_graph()))
+
+def get_control_deliverables():
+    """
+    Returns a dict mapping each control_id to the list of positions of the
+    deliverables in deliverables.json referring to it.
+    """
+    def build(deliverables_import):
+        result = {}
+        for position, deliverable in enumerate(deliverables_import["deliverables"]):
+            for control_id in set(deliverable.get("controls", None) or []):
+                result.setdefault(control_id, []).append(position)
+        return result
+    return STORE.derived(DELIVERABLES, "control_deliverables", build)
+
+@instrumented
+def get_deliverable_coverage():
+    """
+    Returns a copy of the deliverables table in deliverables.json, where every
+    deliverable has a "count" with the number of risktable rows referring to
+    one of its controls.
+    The risktable control counts are aggregated once per used control through
+    the control -> deliverables index.
+    """
+    graph = get_risk_graph()
+    control_deliverables = get_control_deliverables()
+    deliverables_import = STORE.load(DELIVERABLES)
+    deliverables_table = [dict(deliverable) for deliverable in deliverables_import['deliverables']]
+    for deliverable in deliverables_table:
+        deliverable["count"] = 0
+    for control_id in graph.ids("control_id"):
+        control_counter = graph.count("control_id", control_id)
+        for position in control_deliverables.get(control_id, []):
+            deliverables_table[position]["count"] += control_counter
+    return deliverables_table
 
 ##################
 # Risk functions #
 ##################
+@instrumented
 def get_table(aspect_ids):
     """
     get_details returns a list of dictionaries where each
     list row is a dictionary with details about aspect_ids.
+    The rows are copies, so callers may inject extra keys.
     Arguments:
     - aspect_ids must be a list with strings. The aspects 
       must be of the same kind.
     """
     #Check and collect input
     assert(type(aspect_ids) is list),"Function get_table only accepts lists"
-    data=import_jsondata(DATA)
     aspect_ids = [x for x in aspect_ids if x is not None]
     aspect_ids = sorted(set(aspect_ids))
-    control_library=import_jsondata(CONTROL_LIBRARY)
     if len(aspect_ids)>0:
         aspect_id_sample = aspect_ids[0]
     else:
         return []
     #Prepare output
-    if "process" in aspect_id_sample:
-        aspect_type="process"
-        aspect_data = data["processes"]
-    elif "asset" in aspect_id_sample:
-        aspect_type="asset"
-        aspect_data = data["assets"]
-    elif "threat" in aspect_id_sample:
-        aspect_type="threat"
-        aspect_data = data["threats"]
-    elif "container" in aspect_id_sample:
-        aspect_type="container"
-        aspect_data = data["containers"]
-    else:
-        aspect_type="control"
-        aspect_data = control_library["control_library"]
+    aspect_index = None
+    for aspect_type in ["process", "asset", "threat", "container"]:
+        if aspect_type in aspect_id_sample:
+            backend = get_backend()
+            if backend is not None:
+                rows = dict((row.get(aspect_type + "_id", None), row)
+                            for row in backend.get_rows(aspect_type, aspect_ids))
+                return [rows[aspect_id] for aspect_id in aspect_ids if aspect_id in rows]
+            aspect_index = get_aspect_index(aspect_type)
+            break
+    if aspect_index is None:
+        aspect_index = get_control_index()
     result=[]
     for aspect_id in aspect_ids:
-       result_row = {}
-       id_identifier = aspect_type + "_id"
-       for item in aspect_data:
-           row_id = item.get(id_identifier, None)
-           if (row_id and aspect_id):
-               if (row_id==aspect_id):
-                   result.append(item) 
+        item = aspect_index.get(aspect_id)
+        if item is not None:
+            result.append(dict(item))
     #Output validation
     assert(type(result) is list)
     return result
 
+@instrumented
 def get_process_assets(process_ids):
     """
     get_process_assets returns a list of asset ids for assets with a given process name
@@ -158,18 +2176,16 @@ def get_process_assets(process_ids):
     - process_id. A string like "process0000001"
     """
     assert(type(process_ids) is list), "get_process_assets got wrong input. Must be list"
-    process_ids = sorted(set(process_ids))
-    data=import_jsondata(DATA)
-    result = []
-    for risk in data["risktable"]:
-        temp_process_id = risk.get("process_id", None) 
-        temp_asset_id   = risk.get("asset_id", None)
-        if temp_process_id in process_ids:
-            result.append(temp_asset_id)
-    result = sorted(set(result))
+    backend = get_backend()
+    if backend is not None:
+        result = sorted(backend.linked("process_id", set(process_ids), "asset_id"))
+    else:
+        graph = get_risk_graph()
+        result = sorted(graph.linked("process_id", set(process_ids), "asset_id"))
     assert(type(result) is list), "get_process_assets encountered an error in result variable"
     return result
 
+@instrumented
 def get_asset_threats(asset_ids):
     """
     Returns a list of threat dictionaries. Each dictionary contains needed information to describe the threat, affected containers and security controls. 
@@ -177,111 +2193,244 @@ def get_asset_threats(asset_ids):
     - asset_ids: A list of strings in the format "asset" followed by a unique integer number.
     """
     assert(type(asset_ids) is list), "get_asset_threats got wrong input. Must be list"
-    asset_ids = sorted(set(asset_ids))
-    data=import_jsondata(DATA)
-    result = []
-    for risk in data["risktable"]:
-        temp_asset_id = risk.get("asset_id",None)
-        temp_threat_id = risk.get("threat_id",None)
-        if temp_asset_id and (temp_asset_id in asset_ids):
-            result.append(temp_threat_id)
-    result = sorted(set(result))
+    backend = get_backend()
+    if backend is not None:
+        result = sorted(backend.linked("asset_id", set(asset_ids), "threat_id"))
+    else:
+        graph = get_risk_graph()
+        result = sorted(graph.linked("asset_id", set(asset_ids), "threat_id"))
     assert(type(result) is list), "get_asset_threats encountered an error in result variable"
     return result
 
 
-def get_threat_process(threat_id, data):
+@instrumented
+def get_threat_process(threat_id):
+    """
+    Returns the process_id of the process owning the asset of threat_id.
+    Returns None if the threat is not linked to a process.
+    Arguments:
+    - threat_id: string with a threat_id
+    """
     assert(type(threat_id) is str)
-    process_id = None 
-    asset_id = None
-    for risk in data['risktable']:
-        var_threat_id = risk.get("threat_id", None)
-        var_asset_id = risk.get("asset_id",None)
-        if var_threat_id and var_asset_id:
-            if var_threat_id == threat_id:
-                asset_id = var_asset_id
-    for risk in data['risktable']:
-        var_process_id = risk.get("process_id",None)
-        var_asset_id = risk.get("asset_id", None)
-        if var_process_id and var_asset_id:
-            if var_asset_id == asset_id:
-                process_id = var_process_id            
+    graph = get_risk_graph()
+    process_id = None
+    asset_ids = sorted(graph.linked("threat_id", [threat_id], "asset_id"))
+    if asset_ids:
+        process_ids = sorted(graph.linked("asset_id", asset_ids[:1], "process_id"))
+        if process_ids:
+            process_id = process_ids[0]
     return process_id
 
 def get_control_dict(search_control_id):
     """
     Returns a dict with control_id and control_name if searc_control_id is found in control_library.json 
+    If there is no exact match, the last control_id starting with search_control_id is used.
     Returns an empty dict if nothing is found.
     Arguments:
     - search_control_id: string with a control_id
     """
-    assert(type(search_control_id) is str)
-    control_library=import_jsondata(CONTROL_LIBRARY)
-    result = {}
-    for index, control in enumerate(control_library["control_library"]):
-        control_id = control.get("control_id", None)
-        if search_control_id in control_id:
-            control_name = control.get("control_name", None)
-            result.update({"control_id":control_id,"control_name":control_name})
-    assert(type(result) is dict)
-    return result
+    assert(type(search_control_id) is str)
+    control_index = get_control_index()
+    result = {}
+    control = control_index.get(search_control_id)
+    if control is None:
+        control_ids = get_control_prefix_index().startswith(search_control_id)
+        if control_ids:
+            control = control_index.get(control_ids[-1])
+    if control is not None:
+        control_id = control.get("control_id", None)
+        control_name = control.get("control_name", None)
+        result.update({"control_id":control_id,"control_name":control_name})
+    assert(type(result) is dict)
+    return result
+
+def get_container_dict(search_container_id):
+    """
+    Returns a dict with container_id and container_name from the table containers in data.json
+    Returns an empty dict if nothgin is found.
+    Arguments:
+    - search_container_id: string with container_id
+    """
+    assert(type(search_container_id) is str)
+    result={}
+    container = get_aspect_index("container").get(search_container_id)
+    if container is not None:
+        container_id = container.get("container_id", None)
+        container_name = container.get("container_name", "No name")
+        result.update({"container_id":container_id, "container_name":container_name})
+    assert(type(result) is dict)
+    return result
+
+
+def get_impact_weights(global_impact_details):
+    """
+    Returns a tuple (impact_types, weights) with one weight per impact type
+    in global_impact_details.
+    Note that priority 1 is weighted 5 and priority 5 is weighted 1.
+    The weight is therefore weight=6-priority
+    Arguments:
+    - global_impact_details: the list "global_impact_details" from data.json
+    """
+    impact_types = []
+    weights = []
+    for global_impact in global_impact_details:
+        impact_type = global_impact.get("type", None)
+        priority = global_impact.get("priority", None)
+        if not impact_type or priority is None:
+            continue
+        weight = 6.0-float(priority)
+        if impact_type in impact_types:
+            weights[impact_types.index(impact_type)] += weight
+        else:
+            impact_types.append(impact_type)
+            weights.append(weight)
+    return impact_types, weights
+
+def get_impact_matrix(threat_dicts, impact_types):
+    """
+    Returns a list with one row per threat in threat_dicts, each row holding
+    the threat's score for every impact type in impact_types.
+    """
+    positions = dict((impact_type, index) for index, impact_type in enumerate(impact_types))
+    matrix = []
+    for threat_dict in threat_dicts:
+        row = [0.0]*len(impact_types)
+        for impact_score in threat_dict.get("impact_scores", None) or []:
+            position = positions.get(impact_score.get("type", None), None)
+            if position is None:
+                continue
+            try:
+                row[position] += float(impact_score.get("score", None))
+            except (TypeError, ValueError):
+                pass
+        matrix.append(row)
+    return matrix
+
+def format_risk_score(risk_score):
+    """
+    Returns a risk score as a string with 1 decimal, or "No risk calculated".
+    """
+    if risk_score>0.0:
+        result = str('{:04.1f}'.format(float(risk_score)))
+    else:
+        result = "No risk calculated"
+    return result
+
+@instrumented
+def get_risk_scores(threat_dicts):
+    """
+    Returns a list of risk score strings, one for each threat in threat_dicts.
+    All threats are scored at once: the impact scores form a matrix
+    (threats x impact types) multiplied by the vector of alignment weights,
+    using numpy when it is installed.
+    The method is based on octave allegro.
+    Arguments:
+    - threat_dicts: A list of dicts loaded from threats in data.json
+    """
+    assert(type(threat_dicts) is list)
+    if not threat_dicts:
+        return []
+    data=STORE.load(DATA)
+    impact_types, weights = get_impact_weights(data.get("global_impact_details", None) or [])
+    matrix = get_impact_matrix(threat_dicts, impact_types)
+    if numpy is not None and impact_types:
+        risk_scores = numpy.dot(numpy.array(matrix), numpy.array(weights))*10.0/45.0
+    else:
+        risk_scores = [sum(score*weight for score, weight in zip(row, weights))*10.0/45.0
+                       for row in matrix]
+    result = [format_risk_score(risk_score) for risk_score in risk_scores]
+    assert(type(result) is list)
+    return result
+
+def get_impact_hash(impact_scores):
+    """
+    Returns a hash string of a threat's impact_scores list.
+    """
+    return hashlib.sha1(json.dumps(impact_scores, sort_keys=True)).hexdigest()
+
+def get_weights_hash(global_impact_details):
+    """
+    Returns a hash string of the alignment weights in global_impact_details.
+    """
+    return hashlib.sha1(json.dumps(get_impact_weights(global_impact_details))).hexdigest()
+
+def verify_score_cache(data):
+    """
+    Returns the risk score cache stored in data["risk_scores"], after dropping
+    entries of threats which no longer exist or whose impact_scores changed
+    since they were scored. The cache has the format:
+    {"weights": hash of alignment weights,
+     "threats": {threat_id: {"impact": hash of impact_scores, "score": "03.3"}}}
+    """
+    cache = data.setdefault("risk_scores", {})
+    cache.setdefault("weights", "")
+    entries = cache.setdefault("threats", {})
+    threat_index = get_aspect_index("threat")
+    for threat_id, entry in list(entries.items()):
+        threat = threat_index.get(threat_id)
+        if threat is None or entry.get("impact", None) != get_impact_hash(threat.get("impact_scores", None)):
+            entries.pop(threat_id)
+    return cache
+
+def get_score_cache():
+    """
+    Returns the verified risk score cache of data.json.
+    """
+    return STORE.derived(DATA, "risk_score_cache", verify_score_cache)
 
-def get_container_dict(search_container_id):
+@instrumented
+def get_cached_risk_scores(threat_dicts):
     """
-    Returns a dict with container_id and container_name from the table containers in data.json
-    Returns an empty dict if nothgin is found.
+    Returns a list of risk score strings, one for each threat in threat_dicts.
+    Scores are read from the risk score cache. Only threats missing from the
+    cache are scored, and the cache is reset when the alignment weights change.
+    The cache is persisted with the next write of data.json.
     Arguments:
-    - search_container_id: string with container_id
+    - threat_dicts: A list of dicts loaded from threats in data.json
     """
-    assert(type(search_container_id) is str)
-    data=import_jsondata(DATA)
-    result={}
-    for index, container in enumerate(data["containers"]):
-        container_id = container.get("container_id", None)
-        if search_container_id in container_id:
-            container_name = container.get("container_name", "No name")
-            result.update({"container_id":container_id, "container_name":container_name})
-    assert(type(result) is dict)
+    assert(type(threat_dicts) is list)
+    data=STORE.load(DATA)
+    cache = get_score_cache()
+    weights_hash = get_weights_hash(data.get("global_impact_details", None) or [])
+    if cache["weights"] != weights_hash:
+        cache["weights"] = weights_hash
+        cache["threats"].clear()
+    entries = cache["threats"]
+    result = [None]*len(threat_dicts)
+    dirty = []
+    for index, threat_dict in enumerate(threat_dicts):
+        entry = entries.get(threat_dict.get("threat_id", None), None)
+        if entry is None:
+            dirty.append(index)
+        else:
+            result[index] = entry["score"]
+    risk_scores = get_risk_scores([threat_dicts[index] for index in dirty])
+    for index, risk_score in zip(dirty, risk_scores):
+        result[index] = risk_score
+        threat_id = threat_dicts[index].get("threat_id", None)
+        if threat_id:
+            impact_hash = get_impact_hash(threat_dicts[index].get("impact_scores", None))
+            entries[threat_id] = {"impact": impact_hash, "score": risk_score}
     return result
 
+def invalidate_risk_score(threat_id):
+    """
+    Returns nothing, but drops the cached risk score of threat_id.
+    """
+    get_score_cache()["threats"].pop(threat_id, None)
 
+@instrumented
 def get_risk_score(threat_dict):
     """
-    Returns a risk score as a string with 2 decimals. 
-    Returns "No risk score" string if an error is encountered 
-    The method is based on octave allegro.
+    Returns a risk score as a string with 1 decimal. 
+    Returns "No risk calculated" string if there is no risk.
     Arguments:
     - threat_dict: A dict loaded from threats in data.json 
     """
-    data=import_jsondata(DATA)
-    global_impact_details=data.get("global_impact_details", None)
-    risk_score = 0.0
-    impact_scores = threat_dict.get("impact_scores",None)
-    try:
-        for global_impact in global_impact_details: 
-            for impact_score in impact_scores:
-                global_impact_type = global_impact.get("type", None)
-	        impact_score_type = impact_score.get("type", None)
-                if global_impact_type in impact_score_type:
-                    # note that priority 1 is weighted 5 and 
-                    # priority 5 is weigted 1.
-		    # the weight is therefore weight=6-priority
-		    priority = global_impact.get("priority", None)
-		    weight = 6.0-float(priority)
-		    score = float(impact_score.get("score", None))
-                    risk_score += weight*score
-    except KeyError,e:
-	print "get_risk_score error: "+str(e)
-
-    risk_score=risk_score*10.0/45.0      
-    if risk_score>0.0:
-    	result = str('{:04.1f}'.format(risk_score))
-    else:
-	result = "No risk calculated"
-    assert(type(result) is str)
-    return result
+    return get_risk_scores([threat_dict])[0]
 
 
+@instrumented
 def inject_risk_scores(threat_table):
     """
     Returns an a threat table with a new or updated row named "risk score"
@@ -289,12 +2438,13 @@ def inject_risk_scores(threat_table):
     - threat_table: A list of threat dicts. 
     """
     assert(type(threat_table) is list)
-    for index,threat_dict in enumerate(threat_table):
-        risk_score=get_risk_score(threat_dict)
-	threat_table[index].update({"risk_score":risk_score})
+    risk_scores = get_cached_risk_scores(threat_table)
+    for index,risk_score in enumerate(risk_scores):
+        threat_table[index].update({"risk_score":risk_score})
     assert(type(threat_table) is list)
     return threat_table  
 
+@instrumented
 def inject_containers_and_controls(threat_table):
     """
     Returns an extended threat_table (list of threat dicts). Each threat dict gets container element injected:
@@ -306,50 +2456,36 @@ def inject_containers_and_controls(threat_table):
     Arguments:
     - threat_table: is a list of threat dicts.
     """
-    control_library = import_jsondata(CONTROL_LIBRARY)
-    data=import_jsondata(DATA)
+    graph = get_risk_graph()
     for index,threat_dict in enumerate(threat_table):
         containers=[]
-        containers_reported = []
-        asset_id = ""
         threat_table_id = threat_dict.get("threat_id",None)
-        for risk in data["risktable"]:
-            temp_threat_id = risk.get("threat_id", None)
-            if temp_threat_id and (temp_threat_id in threat_table_id):
-                temp_container_id=risk.get("container_id", None)
-                asset_id = risk.get("asset_id", None) or asset_id
-                new_data = {}
-                new_data["container_controls"]=[]
-                temp_control_ids=[]
-                if temp_container_id and not (temp_container_id in containers_reported):
-                    container_dict ={}
-                    container_dict=get_container_dict(str(temp_container_id))
-		    new_data.update(container_dict)
-		    containers_reported.append(str(temp_container_id))
-		    # loop through all risks with temp_container_id  and get container_id
-                    for id_dict in data["risktable"]:
-                        current_container_id = id_dict.get("container_id", None)
-                        if (current_container_id == temp_container_id):
-                            current_control_id  =id_dict.get("control_id", None)
-                            if current_control_id:
-                                control_dict = {}
-                                control_dict = get_control_dict(str(current_control_id))
-                                new_data["container_controls"].append(control_dict)
-                if new_data.get("container_name",None):
-                    containers.append(new_data)
-    	threat_table[index]["containers"]=containers
+        asset_ids = sorted(graph.linked("threat_id", [threat_table_id], "asset_id"))
+        asset_id = asset_ids[-1] if asset_ids else ""
+        for temp_container_id in sorted(graph.linked("threat_id", [threat_table_id], "container_id")):
+            new_data = {}
+            new_data["container_controls"]=[]
+            container_dict=get_container_dict(str(temp_container_id))
+            new_data.update(container_dict)
+            for current_control_id in sorted(graph.linked("container_id", [temp_container_id], "control_id")):
+                control_dict = get_control_dict(str(current_control_id))
+                new_data["container_controls"].append(control_dict)
+            if new_data.get("container_name",None):
+                containers.append(new_data)
+        threat_table[index]["containers"]=containers
         threat_table[index]["asset_id"]=asset_id
         asset_name=""
         asset_owner=""
-        for asset in data['assets']:
-            var_asset_id = asset.get("asset_id", None)
-            if var_asset_id == asset_id:
-                asset_name=asset.get("asset_name",None)
-                asset_owner=asset.get("asset_owner",None)
+        asset = get_aspect_index("asset").get(asset_id)
+        if asset is not None:
+            asset_name=asset.get("asset_name",None)
+            asset_owner=asset.get("asset_owner",None)
         threat_table[index]["asset_name"]=asset_name
         threat_table[index]["asset_owner"]=asset_owner
     return threat_table        
 
+@instrumented
+@transactional(DATA)
 def apply_to_risktable(risk_dict):
     """
     update_risktable updates the risktable element in data.json to contain a specified reference.
@@ -369,19 +2505,54 @@ def apply_to_risktable(risk_dict):
     assert(type(risk_dict) is dict)
     assert(len(risk_dict)>0) # Min. 1 keys
     assert(len(risk_dict)<4) # Max. 3 keys
-    data=import_jsondata(DATA)
-    risk_dict_already_exists=False
-    for var_dict in data["risktable"]:
-        if cmp(var_dict, risk_dict)==0:
-            risk_dict_already_exists=True
-    if risk_dict_already_exists:
-        pass
-    else:   
-        data["risktable"].append(risk_dict)
-        output = json.dumps(data, indent=4)
-        write_file(DATA, output, charset='utf-8')
+    apply_links([risk_dict])
     return jsonify(risk_dict)
 
+@instrumented
+@transactional(DATA)
+def apply_links(risk_dicts):
+    """
+    Returns the list of rows of risk_dicts which were added to the
+    risktable in data.json. Rows already in the risktable, or given twice,
+    are skipped, and all new rows are stored with one write.
+    Arguments:
+    - risk_dicts: list of dicts in the format used in risktable, see
+      apply_to_risktable()
+    """
+    assert(type(risk_dicts) is list)
+    added = []
+    data=STORE.load(DATA)
+    graph = get_risk_graph()
+    id_sequences = get_id_sequences()
+    for risk_dict in risk_dicts:
+        assert(type(risk_dict) is dict)
+        if graph.contains(risk_dict):
+            continue
+        data["risktable"].append(risk_dict)
+        graph.add(risk_dict)
+        id_sequences.observe(risk_dict)
+        added.append(risk_dict)
+    STORE.commit(DATA, [{"op":"append", "path":["risktable"], "value":risk_dict}
+                        for risk_dict in added])
+    return added
+
+def merge_aspect(aspect, existing_aspect, new_aspect_detail):
+    """
+    Returns nothing, but updates the existing_aspect dict with the details
+    of new_aspect_detail.
+    """
+    new_impact_scores = new_aspect_detail.get("impact_scores",None)
+    if aspect == "threat" and new_impact_scores:
+        for old_impact_score in existing_aspect.get("impact_scores", []):
+            for new_impact_score in new_impact_scores:
+                new_impact_type = new_impact_score.get("type",None)
+                old_impact_type = old_impact_score.get('type',None)
+                if new_impact_type in old_impact_type:
+                    old_impact_score.update(new_impact_score)
+    existing_aspect.update(new_aspect_detail)
+
+@instrumented
+@transactional(DATA)
 def apply_to_aspect(aspect, new_aspect_detail):
     """
     update_aspect_details():
@@ -391,78 +2562,177 @@ def apply_to_aspect(aspect, new_aspect_detail):
     """
     assert(type(aspect) is str)
     assert(type(new_aspect_detail) is dict)
-    data=import_jsondata(DATA)
-    if aspect in "asset":
-        asset_id_new= new_aspect_detail.get("asset_id", None)
-        if asset_id_new:
-            asset_found=False
-            for index,asset in enumerate(data['assets']):
-                asset_id_existing=asset.get("asset_id", None)
-                if asset_id_new in asset_id_existing:
-                    data["assets"][index].update(new_aspect_detail)  
-                    asset_found=True
-            if not asset_found:
-                data["assets"].append(new_aspect_detail)
-        else:
-            return False
-    elif aspect in "process":
-        process_id_new = new_aspect_detail.get("process_id", None)
-        if process_id_new:
-            process_found=False
-            for index, process in enumerate(data['processes']):
-	        process_id_existing = process.get("process_id", None)
-                if process_id_new in process_id_existing:
-                    data["processes"][index].update(new_aspect_detail)
-                    process_found = True
-            if not process_found:
-                data["processes"].append(new_aspect_detail)
-        else:
-            return False
-    elif aspect in "threat":
-        threat_id_new = new_aspect_detail.get("threat_id", None)
-        if threat_id_new:
-            threat_found=False
-            for index, threat in enumerate(data['threats']):
-	        threat_id_existing = threat.get("threat_id", None)
-                if threat_id_new in threat_id_existing:
-                    threat_found=True
-                    threat_index=index
-            if threat_found:
-	        new_impact_scores = new_aspect_detail.get("impact_scores",None)
-                if new_impact_scores:
-                     threat_details=data['threats'][threat_index]['impact_scores']
-                     for index, old_impact_score in enumerate(threat_details):
-                         for new_impact_score in new_impact_scores:
-                             new_impact_type = new_impact_score.get("type",None)
-			     old_impact_type = old_impact_score.get('type',None)
-                             if new_impact_type in old_impact_type:
-                                  data['threats'][threat_index]['impact_scores'][index].update(new_impact_score)
-                data["threats"][threat_index].update(new_aspect_detail)
-            if not threat_found:
-                data["threats"].append(new_aspect_detail)
-        else:
-            return False
-    elif aspect in "container":
-        container_id_new = new_aspect_detail.get("container_id", None)
-        if container_id_new:
-            container_found=False
-            for index, container in enumerate(data['containers']):
-	        container_id_existing = container.get("container_id", None)
-                if container_id_new in container_id_existing:
-                    data["containers"][index].update(new_aspect_detail)
-                    container_found = True
-            if not container_found:
-                data["containers"].append(new_aspect_detail)
-        else:
-            return False
-    outputdata = json.dumps(data, indent=4)
-    write_file(DATA, outputdata, charset='utf-8')
+    if aspect not in ASPECT_COLLECTIONS:
+        return True
+    collection, id_key = ASPECT_COLLECTIONS[aspect]
+    aspect_id_new = new_aspect_detail.get(id_key, None)
+    if not aspect_id_new:
+        return False
+    data=STORE.load(DATA)
+    aspect_index = get_aspect_index(aspect)
+    existing_aspect = aspect_index.get(aspect_id_new)
+    if existing_aspect is None:
+        data[collection].append(new_aspect_detail)
+        aspect_index.add(new_aspect_detail)
+        get_id_sequences().observe(new_aspect_detail)
+        operations = [{"op":"append", "path":[collection], "value":new_aspect_detail}]
+    else:
+        merge_aspect(aspect, existing_aspect, new_aspect_detail)
+        operations = [{"op":"update", "path":[collection], "key":id_key,
+                       "id":aspect_id_new, "value":existing_aspect}]
+    if aspect == "threat":
+        invalidate_risk_score(aspect_id_new)
+        get_cached_risk_scores([aspect_index.get(aspect_id_new)])
+        score_cache = get_score_cache()
+        operations.append({"op":"set", "path":["risk_scores", "weights"],
+                           "value":score_cache["weights"]})
+        operations.append({"op":"set", "path":["risk_scores", "threats", aspect_id_new],
+                           "value":score_cache["threats"][aspect_id_new]})
+    aspect_changed(id_key, aspect_id_new)
+    STORE.commit(DATA, operations)
     return True
 
     
+##################
+# Response cache #
+##################
+class ResponseCache(object):
+    """
+    ResponseCache keeps the most recently rendered bodies of read-only
+    views, keyed by url. An entry is only served while the ETag of the
+    documents the view depends on is unchanged.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, etag):
+        """
+        Returns (body, mimetype) cached for key with etag, or None.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries[key] = entry
+            return entry[1:]
+
+    def clear(self):
+        """
+        Returns nothing, but empties the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def put(self, key, etag, body, mimetype):
+        """
+        Returns nothing, but caches body, evicting the least recently used entry if full.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (etag, body, mimetype)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+RESPONSE_CACHE = ResponseCache(int(os.getenv("RESPONSE_CACHE_SIZE", "128")))
+
+def get_documents_etag(filenames):
+    """
+    Returns an ETag changing whenever one of the documents of filenames
+    changes, through a commit or on disk.
+    """
+    versions = []
+    for filename in filenames:
+        if filename in STORE.backends:
+            # The stamp of a backend differs per connection, so per worker
+            versions.append((STORE.path(filename), STORE.version(filename)))
+        else:
+            versions.append((STORE.path(filename), STORE.version(filename), STORE.stamp(filename)))
+    return hashlib.sha1(repr(versions)).hexdigest()
+
+def cached_view(*filenames):
+    """
+    Decorator for read-only views depending only on the documents of
+    filenames. A GET with a matching If-None-Match header is answered with
+    304 Not Modified, and the rendered body is served from RESPONSE_CACHE
+    until a document changes.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Views are also called by other routes, e.g. after a change
+            if request.method != "GET" or request.endpoint != function.__name__:
+                return function(*args, **kwargs)
+            etag = get_documents_etag(filenames)
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                key = request.script_root + request.full_path
+                if WORKSPACES is not None:
+                    key = request.headers.get(WORKSPACE_HEADER, "") + key
+                cached = RESPONSE_CACHE.get(key, etag)
+                if cached is not None:
+                    response = Response(cached[0], mimetype=cached[1])
+                else:
+                    response = make_response(function(*args, **kwargs))
+                    if response.status_code == 200 and not response.is_streamed:
+                        RESPONSE_CACHE.put(key, etag, response.get_data(), response.mimetype)
+            response.set_etag(etag)
+            if WORKSPACES is not None:
+                response.vary.add(WORKSPACE_HEADER)
+            return response
+        return wrapper
+    return decorator
+
 ##########################
 # Web Application Output #
 ##########################
+@app.errorhandler(VersionConflict)
+def version_conflict(error):
+    """
+    Displays a message when a form was based on an outdated assessment
+    """
+    if request.path.startswith("/api/"):
+        return jsonify({"error": str(error)}), 409
+    return "The assessment was changed by someone else. Reload the page and try again.", 409
+
+def get_row_version(aspect, row_id):
+    """
+    Returns a hash of the stored row row_id of aspect, or "" if there is no
+    such row. Forms editing a row post it back, so a change of the row
+    since the form was rendered is detected, while changes of other rows
+    are not conflicts.
+    Arguments:
+    - aspect: one of the keys of ASPECT_COLLECTIONS, such as "asset"
+    - row_id: the primary key of the row
+    """
+    row = get_aspect_index(aspect).get(row_id)
+    if row is None:
+        return ""
+    return hashlib.sha1(json.dumps(row, sort_keys=True)).hexdigest()
+
+def get_row_versions(view):
+    """
+    Returns a dict mapping the ids of the process, assets and threats of a
+    process view (see build_process_view) to their row versions.
+    """
+    row_versions = {}
+    for aspect, table in [("process", "process_table"), ("asset", "asset_table"),
+                          ("threat", "threat_table")]:
+        id_key = ASPECT_COLLECTIONS[aspect][1]
+        for row in view[table]:
+            row_versions[row[id_key]] = get_row_version(aspect, row[id_key])
+    return row_versions
+
+def check_row_version(aspect, row_id, expected_version):
+    """
+    Returns nothing, but raises VersionConflict if expected_version is given
+    and differs from the current version of the row, see get_row_version().
+    """
+    if expected_version not in [None, ""] and get_row_version(aspect, row_id) != expected_version:
+        raise VersionConflict("%s %s changed since the form was loaded" % (aspect, row_id))
+
 @app.route("/", methods=['GET'])
 def index():
     """
@@ -478,20 +2748,28 @@ def about():
     return render_template('about.html')
 
 @app.route("/alignment", methods=['GET'])
+@cached_view(DATA)
 def alignment():
-    data=import_jsondata(DATA)
+    data=STORE.load(DATA)
     global_impact_details=data["global_impact_details"]
     return render_template("alignment.html", global_impact_details=global_impact_details)
 
 @app.route("/assessments", methods=['GET'])
+@cached_view(DATA)
 def assessments():
     """
     Displays list of processes to analyse or delete 
     """
-    # create process_table
-    data=import_jsondata(DATA)
-    process_table=data['processes']
-    return render_template('assessments.html',process_table=process_table)
+    arguments = request.args.to_dict()
+    search = (arguments.get("search", None) or "").lower()
+    low = high = None
+    if search:
+        low, high = (search,), (search + u"\uffff",)
+    page = get_process_names().page(low=low, high=high, **get_page_arguments(arguments))
+    process_table = get_table(page["ids"])
+    process_table.sort(key=lambda process: (process.get("process_name", None) or "").lower())
+    page = get_page_links("assessments", page, arguments)
+    return render_template('assessments.html',process_table=process_table, page=page, search=search)
 
 @app.route("/analyse_process", methods=['GET'])
 def analyse_process():
@@ -501,154 +2779,107 @@ def analyse_process():
     action=request.args['action']
     process_ids = []
     process_ids.append(request.args['process_id'])
-    process_table = get_table(process_ids)
     if action=="Delete":
         process_id = str(process_ids[0])
         if process_id:
-            depending_ids=delete_cascading_ids(process_id)
-            for aspect_id in depending_ids:
-                delete_aspect(str(aspect_id))
+            delete_cascade(process_id)
         return assessments()
     if action=="Analyse":
-        asset_ids = get_process_assets(process_ids)
-        asset_table = get_table(asset_ids)
-        data = import_jsondata(DATA)
-        rxo_values = data["rxo_values"]
-        global_impact_details = data["global_impact_details"]
-
-        threat_ids = get_asset_threats(asset_ids)
-        threat_table = get_table(threat_ids)
-        threat_table = inject_containers_and_controls(threat_table)
-        threat_table = inject_risk_scores(threat_table)
-        threat_library = data.get("threat_library")
-        control_library = import_jsondata(CONTROL_LIBRARY)
-        container_library = data.get("container_library", None)
-        return render_template('analyse_process.html', process_table=process_table,
-						       asset_table=asset_table,
-						       rxo_values=rxo_values,
- 						       threat_library = threat_library,
-						       global_impact_details=global_impact_details,
-						       threat_table=threat_table,
-						       control_library=control_library,
-						       container_library=container_library)
+        view = build_process_view(process_ids[0])
+        return render_template('analyse_process.html', row_versions=get_row_versions(view), **view)
     if action=="Report":
-        asset_ids = get_process_assets(process_ids)
-        asset_table = get_table(asset_ids)
-        data = import_jsondata(DATA)
-        rxo_values = data["rxo_values"]
-        global_impact_details = data["global_impact_details"]
-
-        threat_ids = get_asset_threats(asset_ids)
-        threat_table = get_table(threat_ids)
-        threat_table = inject_containers_and_controls(threat_table)
-        threat_table = inject_risk_scores(threat_table)
-        threat_library = data.get("threat_library")
-        control_library = import_jsondata(CONTROL_LIBRARY)
-        container_library = data.get("container_library", None)
-        return render_template('report_process.html', process_table=process_table,
-						       asset_table=asset_table,
-						       rxo_values=rxo_values,
- 						       threat_library = threat_library,
-						       global_impact_details=global_impact_details,
-						       threat_table=threat_table,
-						       control_library=control_library,
-						       container_library=container_library)
+        return render_template('report_process.html', **build_process_view(process_ids[0]))
+
 
+# Id types allocated by IdSequences -> prefix of the ids
+ID_PREFIXES = {"process_id": "process", "asset_id": "asset",
+               "threat_id": "threat", "container_id": "container"}
 
+class IdSequences(object):
+    """
+    IdSequences holds the number of the last id allocated of each id type.
+    The numbers are stored in data["id_sequences"], and recovered from the
+    highest ids in data.json when the document is loaded, so ids are never
+    handed out twice, not even the ids of deleted aspects.
+    """
+    def __init__(self, data):
+        stored = data.get("id_sequences", None) or {}
+        self.last = dict((id_key, int(stored.get(id_key, 0))) for id_key in ID_PREFIXES)
+        rows = list(data.get("risktable", None) or [])
+        for aspect, (collection, id_key) in ASPECT_COLLECTIONS.items():
+            rows.extend(data.get(collection, None) or [])
+        for row in rows:
+            self.observe(row)
+
+    def observe(self, row):
+        """
+        Returns nothing, but makes sure the ids in row are not allocated
+        again, for rows stored with ids which were not reserved.
+        """
+        for id_key, prefix in ID_PREFIXES.items():
+            id_value = row.get(id_key, None)
+            if id_value and id_value.startswith(prefix) and id_value[len(prefix):].isdigit():
+                self.last[id_key] = max(self.last[id_key], int(id_value[len(prefix):]))
+
+def get_id_sequences():
+    """
+    Returns the IdSequences of data.json.
+    """
+    return STORE.derived(DATA, "id_sequences", IdSequences)
 
+@transactional(DATA)
+def reserve_ids(aspect_id_type, count):
+    """
+    Returns a list of count consecutive unused ids of aspect_id_type, such
+    as ["asset000008", "asset000009"], in constant time. The new sequence
+    number is committed before the ids are returned, so concurrent callers
+    never receive the same ids.
+    Arguments:
+    - aspect_id_type: "process_id", "asset_id", "threat_id" or "container_id"
+    - count: number of ids
+    """
+    assert(aspect_id_type in ID_PREFIXES)
+    if count < 1:
+        return []
+    data = STORE.load(DATA)
+    sequences = get_id_sequences()
+    first_number = sequences.last[aspect_id_type] + 1
+    sequences.last[aspect_id_type] += count
+    data.setdefault("id_sequences", {})[aspect_id_type] = sequences.last[aspect_id_type]
+    STORE.commit(DATA, [{"op":"set", "path":["id_sequences", aspect_id_type],
+                         "value":sequences.last[aspect_id_type]}])
+    prefix = ID_PREFIXES[aspect_id_type]
+    return [prefix + str(first_number + offset).zfill(6) for offset in range(count)]
 
 def get_next_id(aspect_id_type):
     """
     get_next_id returns next unique available ID number, depending on aspect_name.
-    The function will search data dict for any occurences. 
-    If none is found, the first number in the sequence is returned.
+    See reserve_ids().
     Arguments:
-    - aspect_id_type is one of the keys defined in schema["risktable"].
-    """
-    schema=import_jsondata(SCHEMA)
-    risktable_template = schema.get("risktable",None)
-    aspect_id_types = list(risktable_template[0].keys())
-    data = import_jsondata(DATA)
-    risktable=data.get("risktable", None)
-    if aspect_id_type is "process_id":
-        processes=data.get("processes",None)
-        process_ids=[]
-        for process in processes:
-            process_id = process.get("process_id",None)
-            if process_id:
-                process_ids.append(process_id)
-        for risk in risktable:
-            process_id = risk.get("process_id",None)
-            if process_id:
-                process_ids.append(process_id)
-        if not process_ids:
-            process_ids.append("process000000")
-        int_ids = [int(a[7:]) for a in process_ids]
-        return "process" + str(max(int_ids)+1).zfill(6)
-    if aspect_id_type is "asset_id":
-        assets=data.get("assets",None)
-        asset_ids = []
-        for asset in assets:
-            asset_id = asset.get("asset_id", None)
-            if asset_id: 
-                asset_ids.append(asset_id)    
-        for risk in risktable:
-            asset_id = risk.get("asset_id", None)
-            if asset_id:
-                asset_ids.append(asset_id)
-        if not asset_ids:
-            asset_ids.append("asset000000")
-        int_ids = [int(a[5:]) for a in asset_ids]
-        return "asset" + str(max(int_ids)+1).zfill(6)   
-    elif aspect_id_type is "threat_id":
-        threats=data.get("threats",None)
-        threat_ids = []
-        for threat in threats:
-            threat_id = threat.get("threat_id", None)
-            if threat_id: 
-                threat_ids.append(threat_id)    
-        for risk in risktable:
-            threat_id = risk.get("threat_id", None)
-            if threat_id:
-                threat_ids.append(threat_id)
-        if not threat_ids:
-            threat_ids.append("threat000000")
-        int_ids = [int(a[6:]) for a in threat_ids]
-        return "threat" + str(max(int_ids)+1).zfill(6)   
-    elif aspect_id_type is "container_id":
-        containers=data.get("containers",None)
-        container_ids = []
-        for container in containers:
-            container_id = container.get("container_id", None)
-            if container_id: 
-                container_ids.append(container_id)    
-        for risk in risktable:
-            container_id = risk.get("container_id", None)
-            if container_id:
-                container_ids.append(container_id)
-        if not container_ids:
-            container_ids.append("container000000")
-        int_ids = [int(a[9:]) for a in container_ids]
-        return "container" + str(max(int_ids)+1).zfill(6)   
+    - aspect_id_type: "process_id", "asset_id", "threat_id" or "container_id"
+    """
+    return reserve_ids(aspect_id_type, 1)[0]
 
 @app.route("/add_process", methods=['POST','GET'])
 def add_process():
-    schema=import_jsondata(SCHEMA)
+    schema=STORE.load(SCHEMA)
 
-    process_template = schema['processes'][0]
-    process_id = get_next_id("process_id")
-    process_template.update({"process_id":process_id})
+    with STORE.batch(DATA):
+        process_template = copy.deepcopy(schema['processes'][0])
+        process_id = get_next_id("process_id")
+        process_template.update({"process_id":process_id})
 
-    apply_to_aspect("process", process_template)
-    risk_ids = {'process_id':process_id}
-    apply_to_risktable(risk_ids)
+        apply_to_aspect("process", process_template)
+        risk_ids = {'process_id':process_id}
+        apply_to_risktable(risk_ids)
     return assessments()    
 
 
 @app.route("/add_asset", methods=['POST'])
+@batched(DATA)
 def add_asset():
-    schema=import_jsondata(SCHEMA)
-    asset_template = schema['assets'][0]
+    schema=STORE.load(SCHEMA)
+    asset_template = copy.deepcopy(schema['assets'][0])
     asset_id = get_next_id("asset_id")
     asset_template.update({"asset_id":asset_id}) 
 
@@ -664,9 +2895,10 @@ def add_asset():
     return redirect(url_for('analyse_process',process_id=process_id,action='Analyse'))
 
 @app.route("/add_threat", methods=['POST'])
+@batched(DATA)
 def add_threat():
-    schema=import_jsondata(SCHEMA)
-    threat_template = schema['threats'][0]
+    schema=STORE.load(SCHEMA)
+    threat_template = copy.deepcopy(schema['threats'][0])
     threat_id = get_next_id("threat_id")
     threat_template.update({"threat_id":threat_id}) 
 
@@ -685,6 +2917,7 @@ def add_threat():
     return redirect(url_for('analyse_process',process_id=process_id,action='Analyse'))
 
 @app.route("/add_container", methods=['POST'])
+@batched(DATA)
 def add_container():
     formdata = {}
     f = request.form
@@ -695,8 +2928,8 @@ def add_container():
     container_id = get_next_id("container_id")
     process_id = formdata.get("process_id",None)
     formdata.pop("process_id",None)
-    schema=import_jsondata(SCHEMA)
-    container_template = schema['containers'][0]
+    schema=STORE.load(SCHEMA)
+    container_template = copy.deepcopy(schema['containers'][0])
     container_template.update(formdata) 
     container_template.update({'container_id':container_id})
     container_name = container_template.get("container_name",None)
@@ -709,6 +2942,7 @@ def add_container():
         return "Select a name"
 
 @app.route("/add_control", methods=['POST'])
+@batched(DATA)
 def add_control():
     formdata = {}
     f = request.form
@@ -722,6 +2956,7 @@ def add_control():
     return redirect(url_for('analyse_process',process_id=process_id,action='Analyse'))
 
 @app.route("/update_process", methods=['POST'])
+@batched(DATA)
 def update_process():
     formdata = {}
     f = request.form
@@ -732,12 +2967,14 @@ def update_process():
     process_id = new_process_data.get("process_id",None)
     action = new_process_data.get("action",None)
     new_process_data.pop("action", None)
+    check_row_version("process", process_id, new_process_data.pop("row_version", None))
     apply_to_aspect("process", new_process_data)
     risk_ids = {'process_id':process_id}
     apply_to_risktable(risk_ids)
     return redirect(url_for('analyse_process',process_id=process_id,action='Analyse'))
 
 @app.route("/update_asset", methods=['POST'])
+@batched(DATA)
 def update_asset():
     #extract form data
     formdata = {}
@@ -749,12 +2986,10 @@ def update_asset():
     action = new_asset_data.get("action",None)
     process_id = new_asset_data.get("process_id",None)
     asset_id = new_asset_data.get("asset_id",None)
+    check_row_version("asset", asset_id, new_asset_data.pop("row_version", None))
     if action == "Delete asset":
         if asset_id:
-            depending_ids=[]
-            depending_ids=delete_cascading_ids(str(asset_id))
-            for aspect_id in depending_ids:
-                delete_aspect(str(aspect_id))
+            delete_cascade(str(asset_id))
     if action == "Apply asset changes":
         #clean data before storage
         new_asset_data.pop("process_id",None)
@@ -766,6 +3001,7 @@ def update_asset():
     return redirect(url_for('analyse_process',process_id=process_id,action='Analyse'))
 
 @app.route("/update_threat", methods=['POST'])
+@batched(DATA)
 def update_threat():
     # Get formdata
     formdata = {}
@@ -777,13 +3013,11 @@ def update_threat():
     # Update risktable
     process_id = formdata.get('process_id',None)
     threat_id = formdata.get('threat_id',None)
+    check_row_version("threat", threat_id, formdata.pop("row_version", None))
     asset_id = formdata.get("asset_id",None)
     if action == "Delete threat":
         if threat_id:
-            depending_ids=[]
-            depending_ids=delete_cascading_ids(str(threat_id))
-            for aspect_id in depending_ids:
-                delete_aspect(str(aspect_id))
+            delete_cascade(str(threat_id))
     if action == "Apply threat changes":
         risk_ids = {"threat_id":threat_id, "asset_id":asset_id}
         apply_to_risktable(risk_ids)
@@ -792,7 +3026,7 @@ def update_threat():
         formdata.pop("asset_id",None)
         # Get list of impact_score_types from data.json  
         impact_score_types=[]
-        data=import_jsondata(DATA)
+        data=STORE.load(DATA)
         global_impact_details=data.get("global_impact_details",None)
         for global_impact_detail in global_impact_details:
             impact_score_types.append(global_impact_detail.get("type",None))
@@ -811,6 +3045,7 @@ def update_threat():
         apply_to_aspect("threat", formdata)
     return redirect(url_for('analyse_process',process_id=process_id,action='Analyse'))
 
+@transactional(DATA)
 def delete_id_set(id_1, id_2):
     """
     delete_id deletes all lines from risktable in data.json, containing both ids.
@@ -820,79 +3055,132 @@ def delete_id_set(id_1, id_2):
     """
     assert(type(id_1) is str)
     assert(type(id_2) is str)
-    data=import_jsondata(DATA)
-    old_risktable = data.get("risktable",None)
+    delete_risk_rows([id_1, id_2])
+    return True
+
+@instrumented
+@transactional(DATA)
+def delete_risk_rows(ids):
+    """
+    Returns the list of risktable rows deleted from data.json, which are
+    all rows containing every id in ids.
+    Arguments:
+    - ids: list of ids, e.g. ["threat000001", "container000001"]
+    """
+    assert(type(ids) is list)
+    assert(len(ids)>0)
+    data=STORE.load(DATA)
+    graph = get_risk_graph()
+    ids = set(ids)
     new_risktable = []
-    for risk in old_risktable:
-        id_1_found=False
-        id_2_found=False
-        for key,value in risk.iteritems():
-            if value==id_1: id_1_found=True
-            if value==id_2: id_2_found=True
-        if not (id_1_found and id_2_found):
+    deleted = []
+    for risk in data["risktable"]:
+        if ids.issubset(risk.values()):
+            graph.remove(risk)
+            deleted.append(risk)
+        else:
             new_risktable.append(risk)
     data['risktable']=new_risktable
-    output = json.dumps(data, indent=4)
-    write_file(DATA, output, charset='utf-8')
-    return True
+    if deleted:
+        STORE.commit(DATA, [{"op":"unlink", "path":["risktable"], "ids":sorted(ids), "match":"all"}])
+    return deleted
+
+# Id prefix -> id type of the aspects which can be deleted with their dependents
+CASCADE_ID_TYPES = {"proce": "process_id", "asset": "asset_id",
+                    "threa": "threat_id", "conta": "container_id"}
+# Links followed from an aspect to its dependents
+CASCADE_EDGES = RISK_EDGES[:3]
+
+def resolve_cascade(aspect_id):
+    """
+    Returns a set with aspect_id and all ids depending on it, found with a
+    breadth first search over the process->asset->threat->container links
+    of the risk graph. A child depends on the deleted ids only when all of
+    its parents are deleted; a child shared with a parent which is kept is
+    kept too. The result does not depend on the order of the risktable rows.
+    Arguments:
+    - aspect_id: a process_id, asset_id, threat_id or container_id
+    """
+    assert(type(aspect_id) is str)
+    graph = get_risk_graph()
+    result = set([aspect_id])
+    queue = collections.deque([(CASCADE_ID_TYPES[aspect_id[0:5]], aspect_id)])
+    while queue:
+        id_type, current_id = queue.popleft()
+        for parent_key, child_key in CASCADE_EDGES:
+            if parent_key != id_type:
+                continue
+            for child_id in graph.linked(parent_key, [current_id], child_key):
+                if child_id in result:
+                    continue
+                if graph.linked(child_key, [child_id], parent_key) <= result:
+                    result.add(child_id)
+                    queue.append((child_key, child_id))
+    return result
 
-def delete_cascading_ids(aspect_id):
+@instrumented
+@transactional(DATA)
+def delete_cascade(aspect_id, dry_run=False):
+    """
+    Returns a dict describing what is deleted, after deleting aspect_id and
+    the ids depending on it (see resolve_cascade) from data.json:
+    {"process_id":[ids], "asset_id":[ids], "threat_id":[ids],
+     "container_id":[ids], "risktable_rows":number of rows}
+    All risktable rows referring to a deleted id and all deleted processes,
+    assets, threats and containers are removed in one journal commit.
+    Arguments:
+    - aspect_id: a process_id, asset_id, threat_id or container_id
+    - dry_run: if True, only returns what would be deleted
+    """
     assert(type(aspect_id) is str)
     prefix = aspect_id[0:5]
-    assert(prefix in ["proce","asset","threa"])
-    data=import_jsondata(DATA)
-    old_risktable = data.get("risktable",None)
-    id_order = ["process_id","asset_id","threat_id"]
-    remove_list=[]
-    remove_list.append(aspect_id)
-    for risk in old_risktable:
-        remove_risk = False
-        for id_type in id_order:
-            for id_key, id_value in risk.iteritems():
-                if id_type == id_key:
-                    if id_value in remove_list:
-                        remove_risk=True
-                        break
-            if remove_risk:
-                for id_key, id_value in risk.iteritems():
-                    if id_type==id_key:
-                        remove_list.append(id_value)
+    assert(prefix in CASCADE_ID_TYPES)
+    data=STORE.load(DATA)
+    graph = get_risk_graph()
+    remove_ids = resolve_cascade(aspect_id)
+    result = {"risktable_rows":0}
     new_risktable = []
-    for risk in old_risktable:
-        keep_risk=True
-        for id_key, id_value in risk.iteritems():
-            if id_value in remove_list:
-                keep_risk=False
-        if keep_risk:
+    for risk in data["risktable"]:
+        if remove_ids.isdisjoint(risk.values()):
             new_risktable.append(risk)
-    data['risktable']=new_risktable
-    output = json.dumps(data, indent=4)
-    write_file(DATA, output, charset='utf-8')
-    return list(set(remove_list))
+        else:
+            result["risktable_rows"] += 1
+            if not dry_run:
+                graph.remove(risk)
+    if not dry_run:
+        data["risktable"] = new_risktable
+    operations = [{"op":"unlink", "path":["risktable"], "ids":sorted(remove_ids), "match":"any"}]
+    for aspect in ["process", "asset", "threat", "container"]:
+        collection, id_key = ASPECT_COLLECTIONS[aspect]
+        aspect_index = get_aspect_index(aspect)
+        aspect_ids = sorted(x for x in remove_ids if aspect_index.get(x) is not None)
+        result[id_key] = aspect_ids
+        if aspect_ids and not dry_run:
+            for x in aspect_ids:
+                aspect_changed(id_key, x)
+                aspect_index.remove(x)
+            data[collection] = [row for row in data[collection]
+                                if row.get(id_key, None) not in remove_ids]
+            operations.append({"op":"delete", "path":[collection], "key":id_key, "ids":aspect_ids})
+    if dry_run:
+        return result
+    score_cache = get_score_cache()
+    for threat_id in sorted(remove_ids):
+        if threat_id in score_cache["threats"]:
+            score_cache["threats"].pop(threat_id)
+            operations.append({"op":"unset", "path":["risk_scores", "threats", threat_id]})
+    STORE.commit(DATA, operations)
+    return result
 
-def delete_aspect(aspect_id):
-    assert(type(aspect_id) is str)
-    ref = ""
-    key = ""
-    if aspect_id[0:7]=="process":
-        ref="processes"
-        key="process_id"
-    elif aspect_id[0:5]=="asset":
-        ref="assets"
-        key="asset_id"
-    elif aspect_id[0:6]=="threat":
-        ref="threats"
-        key="threat_id"
-    if ref:
-        data=import_jsondata(DATA)
-        for index,aspect in enumerate(data[ref]):
-            row_id = aspect.get(key,None)
-            if row_id == aspect_id:
-                data[ref].pop(index)
-                break  
-        output = json.dumps(data, indent=4)
-        write_file(DATA, output, charset='utf-8')
-    return True
+@app.route("/delete_preview", methods=['GET'])
+def delete_preview():
+    """
+    Returns json describing what deleting the aspect_id argument would delete
+    """
+    aspect_id = request.args.get('aspect_id', "")
+    if aspect_id[0:5] not in CASCADE_ID_TYPES:
+        return jsonify({"error":"aspect_id must be a process_id, asset_id, threat_id or container_id"}), 400
+    return jsonify(delete_cascade(str(aspect_id), dry_run=True))
 
 @app.route("/delete_control",methods=['POST','GET'])
 def delete_control():
@@ -924,9 +3212,13 @@ def delete_container():
 
 
 @app.route("/show_json", methods=['GET'])
+@cached_view(DATA)
 def show_json():
-    data = import_jsondata(DATA)
-    return jsonify(data)
+    """
+    Displays data.json as indented json, whatever the snapshot format
+    """
+    data = STORE.load(DATA)
+    return Response(json.dumps(data, indent=4), mimetype="application/json")
 
 @app.route("/reports", methods=['GET'])
 def reports():
@@ -937,97 +3229,57 @@ def risk_acceptance():
     return render_template("risk_acceptance.html") 
 
 @app.route("/controls_soa", methods=['GET'])
+@cached_view(DATA, CONTROL_LIBRARY, DELIVERABLES)
 def controls_soa():
-    data = import_jsondata(DATA)
-    control_library=import_jsondata(CONTROL_LIBRARY)
-    control_table = control_library['control_library']
+    soa = get_soa()
+    control_deliverables = get_control_deliverables()
+    deliverables_import = STORE.load(DELIVERABLES)
+    container_index = get_aspect_index("container")
+    asset_index = get_aspect_index("asset")
+    control_library=STORE.load(CONTROL_LIBRARY)
+    control_table = [dict(control) for control in control_library['control_library']]
     for index,control in enumerate(control_table):
         control_id = control.get("control_id",None)
         control_counter=0
         control_containers=[]
-        if control_id:
-            #find control_containers+control_counter
-            for risk in data['risktable']:
-                risktable_control_id=risk.get("control_id",None)
-                if control_id==risktable_control_id:
-                    control_counter+=1
-                    container_id = risk.get("container_id",None) 
-                    if container_id:
-                        container_dict=get_container_dict(str(container_id))
-                        container_name=container_dict.get("container_name", "None")
-                        control_containers.append(container_name)
-            #find control_assets
-            related_ids = []
-            for risk in data['risktable']:
-                risktable_control_id = risk.get("control_id", None)
-                risktable_container_id = risk.get("container_id", None)
-                if control_id == risktable_control_id:
-                    if risktable_control_id and risktable_container_id:
-                        related_ids.append(risktable_container_id)
-            for risk in data['risktable']:
-                risktable_container_id = risk.get("container_id", None)
-                risktable_threat_id = risk.get("threat_id",None)
-                if risktable_container_id in related_ids:
-                    related_ids.append(risktable_threat_id)
-            control_asset_ids =[]
-            for risk in data['risktable']:
-                risktable_threat_id = risk.get("threat_id",None)
-                risktable_asset_id = risk.get("asset_id", None)
-                if risktable_threat_id in related_ids:
-                    control_asset_ids.append(risktable_asset_id)
-            control_assets=[]
-            for asset in data['assets']:
-                asset_id=asset.get("asset_id",None)
-                if asset_id in control_asset_ids:
-                    asset_name = asset.get("asset_name",None)
-                    control_assets.append(asset_name)
+        control_assets=[]
+        entry = soa.get(control_id) if control_id else None
+        if entry:
+            control_counter = entry["control_count"]
+            for container_id in entry["container_ids"]:
+                container = container_index.get(container_id)
+                control_containers.append(container.get("container_name", "No name") if container else "None")
+            for asset_id in entry["asset_ids"]:
+                asset = asset_index.get(asset_id)
+                if asset is not None:
+                    control_assets.append(asset.get("asset_name",None))
         control_table[index]["control_containers"]=set(control_containers)
         control_table[index]["control_assets"]=set(control_assets)  
         control_table[index]["control_count"]=control_counter   
-        
-        deliverables = import_jsondata(DELIVERABLES)
         deliverable_names=[]
-        for deliverable in deliverables["deliverables"]:
-            deliverable_control_references = deliverable.get("controls",None)
-            if deliverable_control_references:
-                for dcontrol_id in deliverable_control_references:
-                    if dcontrol_id == control_id:
-                        deliverable_name = deliverable.get("name", None)
-                        if deliverable_name:
-                            deliverable_names.append(deliverable_name)
-        control_table[index]["deliverable_names"]=set(deliverable_names)      
+        for position in control_deliverables.get(control_id, []):
+            deliverable_name = deliverables_import["deliverables"][position].get("name", None)
+            if deliverable_name:
+                deliverable_names.append(deliverable_name)
+        control_table[index]["deliverable_names"]=set(deliverable_names)
     return render_template("controls_soa.html",control_table=control_table) 
 
 @app.route("/deliverables", methods=['GET'])
+@cached_view(DATA, CONTROL_LIBRARY, DELIVERABLES)
 def deliverables():
-    data = import_jsondata(DATA)
-    deliverables_import = import_jsondata(DELIVERABLES)
-    deliverables_table = deliverables_import['deliverables']
-    # Count the number of times the deliverable was relevant in the SOA
-    control_library=import_jsondata(CONTROL_LIBRARY)
-    control_table = control_library['control_library']
-    for index,control in enumerate(control_table):
-        control_id = control.get("control_id",None)
-        control_counter=0
-        if control_id:
-            for risk in data['risktable']:
-                risktable_control_id=risk.get("control_id",None)
-                if control_id==risktable_control_id:
-                    control_counter+=1
-            index_to_change = None
-            for index2,deliverable in enumerate(deliverables_table):
-                deliverable_control_references = deliverable.get("controls",None)
-                for dcontrol_id in deliverable_control_references:
-                    if dcontrol_id == control_id:
-                        index_to_change = index2
-            if index_to_change: 
-                deliverables_table[index_to_change]["count"]=control_counter 
+    """
+    Displays the deliverables with the number of times they were relevant in
+    the SOA. Returns json instead when called with format=json.
+    """
+    deliverables_import = STORE.load(DELIVERABLES)
+    deliverables_table = get_deliverable_coverage()
     deliverable_maturity = deliverables_import.get("deliverable_maturity",None)
+    if request.args.get("format", None) == "json":
+        return jsonify({"deliverables": deliverables_table, "deliverable_maturity": deliverable_maturity})
     return render_template("deliverables.html", deliverables_table=deliverables_table, deliverable_maturity=deliverable_maturity)
 
 @app.route("/update_deliverables", methods=['POST'])
 def update_deliverables():
-    deliverables_import = import_jsondata(DELIVERABLES)
     formdata = {}
     f = request.form
     for key in f.keys():
@@ -1036,46 +3288,960 @@ def update_deliverables():
     maturity_current = formdata.get('maturity_current',None)
     maturity_planned = formdata.get('maturity_planned',None)
     name = formdata.get('name', None)
-    if name:
+    with STORE.transaction(DELIVERABLES):
+        deliverables_import = STORE.load(DELIVERABLES)
         delivery_index = None
         for index, deliverable in enumerate(deliverables_import["deliverables"]):
             var_name = deliverable.get("name", None)
-            if var_name == name:
+            if name and var_name == name:
                 delivery_index = index
-	        break
+                break
         if delivery_index != None:
-            deliverables_import["deliverables"][delivery_index].update(formdata)   
-    output = json.dumps(deliverables_import, indent=4)
-    write_file(DELIVERABLES, output, charset='utf-8')
+            deliverable = deliverables_import["deliverables"][delivery_index]
+            deliverable.update(formdata)   
+            STORE.commit(DELIVERABLES, [{"op":"update", "path":["deliverables"], "key":"name",
+                                         "id":name, "value":deliverable}])
+            STORE.drop_derived(DELIVERABLES)
     return deliverables()    
 
 @app.route("/risk_report", methods=['POST','GET'])
+@cached_view(DATA, CONTROL_LIBRARY)
 def risk_report():
-    data = import_jsondata(DATA)
-    threat_ids=[]
-    for risk in data['risktable']:
-        threat_id = risk.get('threat_id',None) 
-        if threat_id:
-            threat_ids.append(threat_id)
-    threat_table = get_table(threat_ids)
+    """
+    Displays a page of the risks in the risktable, sorted by risk score.
+    Arguments (all optional):
+    - process_id, control_id, asset_owner: only risks linked to them
+    - score_min, score_max: only risks scored within the range
+    - order: "desc" (default, highest score first) or "asc"
+    - offset, limit, after: the page, see get_page_arguments()
+    """
+    arguments = request.args.to_dict()
+    page = get_risk_page(arguments)
+    threat_table = get_table(page["ids"])
     threat_table = inject_containers_and_controls(threat_table)
     threat_table = inject_risk_scores(threat_table)
-    for index,threat in enumerate(threat_table):
+    threat_table = inject_process_names(threat_table)
+    positions = dict((threat_id, index) for index, threat_id in enumerate(page["ids"]))
+    threat_table.sort(key=lambda threat: positions[threat["threat_id"]])
+    page = get_page_links("risk_report", page, arguments)
+    return render_template("risk_report.html",threat_table=threat_table, page=page, filters=arguments)
+
+def get_risk_page(arguments):
+    """
+    Returns a page of threat ids from the RiskRanking, see SortedPages.page().
+    Arguments:
+    - arguments: dict of request arguments, see risk_report()
+    """
+    graph = get_risk_graph()
+    threat_ids = None
+    for id_key in ["process_id", "control_id"]:
+        if arguments.get(id_key, None):
+            linked = graph.reachable(id_key, [arguments[id_key]], "threat_id")
+            threat_ids = linked if threat_ids is None else threat_ids & linked
+    if arguments.get("asset_owner", None):
+        asset_ids = get_asset_owners().asset_ids(arguments["asset_owner"])
+        linked = graph.linked("asset_id", asset_ids, "threat_id")
+        threat_ids = linked if threat_ids is None else threat_ids & linked
+    low = high = None
+    try:
+        if arguments.get("score_max", None):
+            low = (0, -float(arguments["score_max"]))
+        if arguments.get("score_min", None):
+            high = (0, -float(arguments["score_min"]), u"\uffff")
+    except ValueError:
+        pass
+    if low is not None and high is None:
+        high = (1,)
+    if high is not None and low is None:
+        low = (0,)
+    reverse = arguments.get("order", "desc") == "asc"
+    return get_risk_ranking().page(threat_ids, low=low, high=high, reverse=reverse,
+                                   **get_page_arguments(arguments))
+
+@instrumented
+def inject_process_names(threat_table):
+    """
+    Returns threat_table where each threat dict has "process_id" and
+    "process_name" of the process owning its asset. The process is
+    found through the risk graph and the process index.
+    Arguments:
+    - threat_table: is a list of threat dicts.
+    """
+    assert(type(threat_table) is list)
+    process_index = get_aspect_index("process")
+    for threat in threat_table:
         process_name = ""
-        threat_id = threat.get("threat_id", None)
-        process_id = get_threat_process(str(threat_id), data)   
-        for process in data['processes']:
-            var_process_id = process.get("process_id", None)
-            if var_process_id:
-                if process_id == var_process_id:
-                    process_name = process.get("process_name", "")
-        threat_table[index]['process_name']=process_name
-    return render_template("risk_report.html",threat_table=threat_table) 
+        process_id = get_threat_process(str(threat.get("threat_id", None)))
+        process = process_index.get(process_id)
+        if process is not None:
+            process_name = process.get("process_name", "")
+        threat["process_id"] = process_id or ""
+        threat["process_name"] = process_name
+    return threat_table
+
+# Columns of the risk register export
+RISK_EXPORT_COLUMNS = ["threat_id", "threat_name", "process_id", "process_name",
+                       "asset_id", "asset_name", "asset_owner", "risk_score",
+                       "threat_action_executed", "containers", "controls"]
+
+def get_risk_register(chunk_size=SQLITE_CHUNK):
+    """
+    Yields one dict per threat in the risktable with the RISK_EXPORT_COLUMNS,
+    sorted by threat_id. Threats are enriched chunk_size at a time, so the
+    memory used does not grow with the size of the register.
+    Arguments:
+    - chunk_size: number of threats enriched at a time
+    """
+    threat_ids = sorted(get_risk_graph().ids("threat_id"))
+    for chunk in chunks(threat_ids, chunk_size):
+        threat_table = get_table(chunk)
+        threat_table = inject_containers_and_controls(threat_table)
+        threat_table = inject_risk_scores(threat_table)
+        threat_table = inject_process_names(threat_table)
+        for threat in threat_table:
+            row = dict((column, threat.get(column, None) or "") for column in RISK_EXPORT_COLUMNS)
+            row["containers"] = [container.get("container_name", "") for container in threat["containers"]]
+            row["controls"] = sorted(set(control.get("control_id", "")
+                                         for container in threat["containers"]
+                                         for control in container["container_controls"]))
+            yield row
+
+def csv_line(values):
+    """
+    Returns values as one line of CSV encoded in UTF-8.
+    """
+    line = io.BytesIO()
+    csv.writer(line).writerow([value.encode("utf-8") if isinstance(value, unicode) else value
+                               for value in values])
+    return line.getvalue()
+
+@app.route("/risk_export", methods=['GET'])
+def risk_export():
+    """
+    Streams the complete risk register, one line per threat.
+    The format is CSV (?format=csv, the default) or JSON lines (?format=ndjson).
+    In CSV, several containers or controls are separated by semicolons.
+    """
+    export_format = request.args.get("format", "csv")
+    if export_format not in ["csv", "ndjson"]:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    def generate():
+        if export_format == "csv":
+            yield csv_line(RISK_EXPORT_COLUMNS)
+        for row in get_risk_register():
+            if export_format == "ndjson":
+                yield json.dumps(row, sort_keys=True) + "\n"
+            else:
+                row["containers"] = ";".join(row["containers"])
+                row["controls"] = ";".join(row["controls"])
+                yield csv_line([row[column] for column in RISK_EXPORT_COLUMNS])
+    mimetype = {"csv": "text/csv", "ndjson": "application/x-ndjson"}[export_format]
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = "attachment; filename=risk_register.%s" % export_format
+    return response
+
+############
+# JSON API #
+############
+# Collection in the URL of the API -> aspect type
+API_ASPECTS = {"processes": "process", "assets": "asset",
+               "threats": "threat", "containers": "container"}
+
+class ApiError(Exception):
+    """
+    Raised when a request to the JSON API is invalid. The message is
+    returned to the client with status code 400 (or status, if given).
+    """
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+@app.errorhandler(ApiError)
+def api_error(error):
+    """
+    Returns the message of an ApiError as JSON
+    """
+    return jsonify({"error": str(error)}), error.status
+
+def get_api_body():
+    """
+    Returns the JSON body of an API request as a dict with "rows" or "ids"
+    and "document_version". A list body is returned as {"rows": list},
+    and a single row as {"rows": [row]}.
+    """
+    body = request.get_json(force=True, silent=True)
+    if type(body) is list:
+        body = {"rows": body}
+    if type(body) is not dict:
+        raise ApiError("The request body must be a JSON object or list")
+    document_version = body.pop("document_version", None)
+    if "rows" not in body and "ids" not in body:
+        body = {"rows": [body]}
+    body["document_version"] = document_version
+    if type(body.get("rows", [])) is not list or type(body.get("ids", [])) is not list:
+        raise ApiError("rows and ids must be lists")
+    for row in body.get("rows", []):
+        if type(row) is not dict:
+            raise ApiError("Every row must be a JSON object")
+    return body
+
+def get_api_aspect(collection):
+    """
+    Returns the aspect type of an API collection, such as "asset" for "assets".
+    """
+    if collection not in API_ASPECTS:
+        raise ApiError("Unknown collection " + collection, 404)
+    return API_ASPECTS[collection]
+
+def get_api_id(aspect, aspect_id):
+    """
+    Returns aspect_id after checking that it is the id of an existing row
+    of aspect. Raises ApiError with status 400 for an id of another aspect
+    and 404 for an unknown id.
+    """
+    id_key = ASPECT_COLLECTIONS[aspect][1]
+    if not isinstance(aspect_id, basestring) or not aspect_id.startswith(ID_PREFIXES[id_key]):
+        raise ApiError("%s is not a %s" % (aspect_id, id_key))
+    if get_aspect_index(aspect).get(aspect_id) is None:
+        raise ApiError("Unknown %s %s" % (id_key, aspect_id), 404)
+    return aspect_id
+
+def get_api_details(aspect, row):
+    """
+    Returns the details of an API row of aspect, without its id, checked
+    against schema.json like an import row (see validate_import_row).
+    impact_scores may be given as a list of {"type":..., "score":...};
+    the returned impact_scores only contain the given types.
+    Raises ApiError if the row is invalid.
+    """
+    collection, id_key = ASPECT_COLLECTIONS[aspect]
+    row = dict(row)
+    row.pop(id_key, None)
+    for key in ["type", "ref"]:
+        if key in row:
+            raise ApiError("Unknown column %s for a %s" % (key, aspect))
+    if IMPORT_PARENTS[aspect] in row:
+        raise ApiError("Link a %s through /api/v1/risktable" % aspect)
+    impact_scores = row.pop("impact_scores", None)
+    if impact_scores is not None:
+        if aspect != "threat" or type(impact_scores) is not list:
+            raise ApiError("impact_scores must be a list of {\"type\":..., \"score\":...}")
+        for impact_score in impact_scores:
+            if type(impact_score) is not dict or not isinstance(impact_score.get("type", None), basestring):
+                raise ApiError("impact_scores must be a list of {\"type\":..., \"score\":...}")
+            row["impact_" + impact_score["type"]] = impact_score.get("score", None)
+    row["type"] = aspect
+    try:
+        return validate_import_row(row, set())["details"]
+    except ImportRowError as error:
+        raise ApiError(str(error))
+
+def api_response(result, status=200):
+    """
+    Returns result as JSON with the new version of data.json added.
+    """
+    result["document_version"] = STORE.version(DATA)
+    return jsonify(result), status
+
+@app.route("/api/v1/<collection>", methods=['GET'])
+def api_list(collection):
+    """
+    Returns a page of the rows of collection, sorted by id.
+    Arguments: offset and limit, see get_page_arguments()
+    """
+    aspect = get_api_aspect(collection)
+    page = get_page_arguments(request.args)
+    aspect_ids = sorted(get_aspect_index(aspect).ids())
+    page_ids = aspect_ids[page["offset"]:page["offset"] + page["limit"]]
+    return api_response({"rows": get_table(page_ids), "total": len(aspect_ids),
+                         "offset": page["offset"], "limit": page["limit"]})
+
+@app.route("/api/v1/<collection>/<aspect_id>", methods=['GET'])
+def api_get(collection, aspect_id):
+    """
+    Returns the row of collection with aspect_id.
+    """
+    aspect = get_api_aspect(collection)
+    return api_response({"rows": get_table([get_api_id(aspect, aspect_id)])})
+
+@app.route("/api/v1/<collection>", methods=['POST'])
+def api_create(collection):
+    """
+    Creates all rows in the request body in one transaction and returns
+    the created rows. Rows without an id get the next free id, and
+    missing details are filled in from schema.json.
+    """
+    aspect = get_api_aspect(collection)
+    id_key = ASPECT_COLLECTIONS[aspect][1]
+    body = get_api_body()
+    schema = STORE.load(SCHEMA)
+    created = []
+    with STORE.batch(DATA, body.get("document_version", None)):
+        aspect_index = get_aspect_index(aspect)
+        rows = body.get("rows", [])
+        new_ids = collections.deque(reserve_ids(id_key, len([x for x in rows if not x.get(id_key, None)])))
+        for row in rows:
+            new_row = copy.deepcopy(schema[collection][0])
+            new_row.update(get_api_details(aspect, row))
+            if "impact_scores" in new_row:
+                new_row["impact_scores"] = merge_impact_scores(schema[collection][0], new_row["impact_scores"])
+            aspect_id = row.get(id_key, None)
+            if not aspect_id:
+                aspect_id = new_ids.popleft()
+            elif not isinstance(aspect_id, basestring) or not aspect_id.startswith(ID_PREFIXES[id_key]):
+                raise ApiError("%s is not a %s" % (aspect_id, id_key))
+            elif aspect_index.get(aspect_id) is not None:
+                raise ApiError("%s %s already exists" % (id_key, aspect_id), 409)
+            new_row[id_key] = aspect_id
+            apply_to_aspect(aspect, new_row)
+            created.append(new_row[id_key])
+    return api_response({"rows": get_table(created)}, 201)
+
+@app.route("/api/v1/<collection>", methods=['PATCH'])
+def api_update(collection):
+    """
+    Updates all rows in the request body in one transaction and returns
+    the updated rows. Every row must have the id of an existing row, and
+    only the given details are changed.
+    """
+    aspect = get_api_aspect(collection)
+    id_key = ASPECT_COLLECTIONS[aspect][1]
+    body = get_api_body()
+    updated = []
+    with STORE.batch(DATA, body.get("document_version", None)):
+        for row in body.get("rows", []):
+            aspect_id = get_api_id(aspect, row.get(id_key, None))
+            details = get_api_details(aspect, row)
+            if "impact_scores" in details:
+                details["impact_scores"] = merge_impact_scores(get_aspect_index(aspect).get(aspect_id),
+                                                               details["impact_scores"])
+            details[id_key] = aspect_id
+            apply_to_aspect(aspect, details)
+            updated.append(aspect_id)
+    return api_response({"rows": get_table(updated)})
+
+@app.route("/api/v1/<collection>", methods=['DELETE'])
+def api_delete(collection):
+    """
+    Deletes the ids in the request body ({"ids":[...]}) in one transaction,
+    with the risktable rows and aspects depending on them (see
+    delete_cascade), and returns the deleted ids per id type.
+    """
+    aspect = get_api_aspect(collection)
+    body = get_api_body()
+    result = {"risktable_rows": 0}
+    with STORE.batch(DATA, body.get("document_version", None)):
+        for aspect_id in body.get("ids", []):
+            for key, value in delete_cascade(str(get_api_id(aspect, aspect_id))).items():
+                if key == "risktable_rows":
+                    result[key] += value
+                else:
+                    result[key] = sorted(set(result.get(key, [])) | set(value))
+    return api_response({"deleted": result})
+
+def get_api_links(body):
+    """
+    Returns the risktable rows of an API request body, after checking that
+    each has 1 to 3 of the id keys in schema.json, with existing ids.
+    """
+    id_keys = set(STORE.load(SCHEMA)["risktable"][0].keys())
+    links = []
+    for row in body.get("rows", []):
+        if not 0 < len(row) < 4 or not id_keys.issuperset(row.keys()):
+            raise ApiError("A risktable row needs 1 to 3 of " + ", ".join(sorted(id_keys)))
+        for key, value in row.items():
+            if not isinstance(value, basestring):
+                raise ApiError("%s must be a string" % key)
+            if get_link_index(key).get(value) is None:
+                raise ApiError("Unknown %s %s" % (key, value))
+        links.append(dict((str(key), value) for key, value in row.items()))
+    return links
+
+@app.route("/api/v1/risktable", methods=['GET'])
+def api_risktable():
+    """
+    Returns a page of the risktable rows containing all ids given as
+    arguments, such as ?threat_id=threat000001.
+    """
+    page = get_page_arguments(request.args)
+    filters = dict((key, value) for key, value in request.args.items()
+                   if key.endswith("_id") and value)
+    if filters:
+        rows = get_risk_graph().rows(filters)
+    else:
+        rows = STORE.load(DATA)["risktable"]
+    return api_response({"rows": rows[page["offset"]:page["offset"] + page["limit"]],
+                         "total": len(rows), "offset": page["offset"], "limit": page["limit"]})
+
+@app.route("/api/v1/risktable", methods=['POST'])
+def api_link():
+    """
+    Adds the risktable rows in the request body in one transaction and
+    returns the rows which were not in the risktable yet.
+    """
+    body = get_api_body()
+    links = get_api_links(body)
+    with STORE.batch(DATA, body.get("document_version", None)):
+        added = apply_links(links)
+    return api_response({"rows": added}, 201)
+
+@app.route("/api/v1/risktable", methods=['DELETE'])
+def api_unlink():
+    """
+    Deletes, in one transaction, the risktable rows containing all ids of
+    each row in the request body, and returns the deleted rows.
+    """
+    body = get_api_body()
+    links = get_api_links(body)
+    deleted = []
+    with STORE.batch(DATA, body.get("document_version", None)):
+        for link in links:
+            deleted.extend(delete_risk_rows(link.values()))
+    return api_response({"rows": deleted})
+
+##########
+# Import #
+##########
+# Row type of an import file -> id column linking the row to its parent
+IMPORT_PARENTS = {"process": None, "asset": "process_id",
+                  "threat": "asset_id", "container": "threat_id"}
+# Id columns of a "link" row of an import file
+IMPORT_LINK_KEYS = ["process_id", "asset_id", "threat_id", "container_id", "control_id"]
+# Detail -> allowed values, for details restricted by the forms
+IMPORT_CHOICES = {"asset_criticality_c": ["True", "False"],
+                  "asset_criticality_i": ["True", "False"],
+                  "asset_criticality_a": ["True", "False"],
+                  "threat_probability": ["0", "1", "2", "3"],
+                  "threat_action_executed": ["True", "False"]}
+IMPORT_SCORES = ["0", "1", "2", "3"]
+
+class ImportRowError(Exception):
+    """
+    Raised when a row of an import file is invalid.
+    """
+    pass
+
+def read_import_rows(stream, import_format):
+    """
+    Yields (line number, row dict, error message or None) for each row of
+    an import file. Empty CSV cells are left out of the row.
+    Arguments:
+    - stream: file object with the import file
+    - import_format: "csv" (with a header line) or "ndjson" (JSON lines)
+    """
+    if import_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            values = dict((key.strip().decode("utf-8"), value.strip().decode("utf-8"))
+                          for key, value in row.items()
+                          if key is not None and isinstance(value, str) and value.strip())
+            yield reader.line_num, values, None
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield line_number, None, "Invalid JSON: " + str(error)
+            continue
+        if type(row) is not dict:
+            yield line_number, None, "A row must be a JSON object"
+            continue
+        yield line_number, row, None
+
+def get_import_format(filename, default="ndjson"):
+    """
+    Returns "csv" or "ndjson", guessed from the extension of filename.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    return {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}.get(extension, default)
+
+def get_link_index(id_key):
+    """
+    Returns the index of the rows an id of a risktable column refers to,
+    such as the AspectIndex of assets for "asset_id".
+    """
+    if id_key == "control_id":
+        return get_control_index()
+    return get_aspect_index(id_key[:-len("_id")])
+
+def merge_impact_scores(existing_row, impact_scores):
+    """
+    Returns the impact_scores of existing_row with the scores of the types
+    in impact_scores replaced, and a score for every impact type.
+    """
+    scores = dict((x.get("type", None), x.get("score", "0"))
+                  for x in existing_row.get("impact_scores", None) or [])
+    scores.update((x["type"], x["score"]) for x in impact_scores)
+    return [{"type": impact_type, "score": scores.get(impact_type, "0")}
+            for impact_type in get_impact_type_list(STORE.load(DATA))]
+
+def validate_import_row(row, known_ids):
+    """
+    Returns a dict describing a valid import row:
+    {"type": row type, "ref": reference or None, "id": id of an existing
+     row or None, "details": details of the aspect, "links": {id key: id}}
+    Raises ImportRowError if the row does not match schema.json.
+    Arguments:
+    - row: dict read by read_import_rows()
+    - known_ids: set of the references defined by the rows before
+    """
+    row = dict(row)
+    row_type = row.pop("type", None)
+    ref = row.pop("ref", None)
+    if row_type not in IMPORT_PARENTS and row_type != "link":
+        raise ImportRowError("type must be one of %s or link" % ", ".join(sorted(IMPORT_PARENTS)))
+    for key, value in row.items():
+        if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+            row[key] = value = unicode(value)
+        if not isinstance(value, basestring):
+            raise ImportRowError("%s must be a string" % key)
+        row[key] = value.strip()
+    if ref is not None and not isinstance(ref, basestring):
+        raise ImportRowError("ref must be a string")
+    if ref and ref in known_ids:
+        raise ImportRowError("Duplicate ref " + ref)
+    result = {"type": row_type, "ref": ref or None, "id": None, "details": {}, "links": {}}
+    if row_type == "link":
+        link_keys = IMPORT_LINK_KEYS
+    else:
+        collection, id_key = ASPECT_COLLECTIONS[row_type]
+        link_keys = [IMPORT_PARENTS[row_type]] if IMPORT_PARENTS[row_type] else []
+        template = STORE.load(SCHEMA)[collection][0]
+        aspect_id = row.pop(id_key, None)
+        if aspect_id:
+            if get_aspect_index(row_type).get(aspect_id) is None:
+                raise ImportRowError("Unknown %s %s; leave it empty to create a new %s"
+                                     % (id_key, aspect_id, row_type))
+            result["id"] = aspect_id
+    for key in link_keys:
+        value = row.pop(key, None)
+        if not value:
+            continue
+        if value not in known_ids:
+            if get_link_index(key).get(value) is None:
+                raise ImportRowError("Unknown %s or ref %s" % (key, value))
+        result["links"][key] = value
+    if row_type == "link":
+        if row:
+            raise ImportRowError("Unknown columns for a link: " + ", ".join(sorted(row)))
+        if not 1 < len(result["links"]) < 4:
+            raise ImportRowError("A link needs 2 or 3 of " + ", ".join(IMPORT_LINK_KEYS))
+        return result
+    data = STORE.load(DATA)
+    impact_types = get_impact_type_list(data)
+    impact_scores = []
+    for key in sorted(row):
+        value = row[key]
+        if key.startswith("impact_") and row_type == "threat":
+            impact_type = key[len("impact_"):]
+            if impact_type not in impact_types:
+                raise ImportRowError("Unknown impact type " + impact_type)
+            if value not in IMPORT_SCORES:
+                raise ImportRowError("%s must be one of %s" % (key, ", ".join(IMPORT_SCORES)))
+            impact_scores.append({"type": impact_type, "score": value})
+        elif key not in template or key == "impact_scores":
+            raise ImportRowError("Unknown column %s for a %s" % (key, row_type))
+        elif key in IMPORT_CHOICES and value not in IMPORT_CHOICES[key]:
+            raise ImportRowError("%s must be one of %s" % (key, ", ".join(IMPORT_CHOICES[key])))
+        elif key in ["asset_rpo_days", "asset_rto_days"] and value not in data["rxo_values"]:
+            raise ImportRowError("%s must be one of %s" % (key, ", ".join(data["rxo_values"])))
+        else:
+            result["details"][key] = value
+    if impact_scores:
+        result["details"]["impact_scores"] = impact_scores
+    return result
+
+@instrumented
+def import_rows(rows, dry_run=False, strict=False):
+    """
+    Returns a report of importing rows into data.json:
+    {"created": {row type: number}, "updated": {row type: number},
+     "links": number of new risktable rows, "ids": {ref: new id},
+     "errors": [{"line": line number, "error": message}]}
+    Each row is a process, asset, threat or container, or a link between
+    them. Rows without an id create new aspects, and other rows refer to
+    them by the value of their "ref" column. Invalid rows are reported and
+    skipped; the valid rows are stored in one write, with their ids
+    reserved in one block per id type.
+    Arguments:
+    - rows: iterable of (line number, row, error) as read by read_import_rows()
+    - dry_run: if True, only the report is returned
+    - strict: if True, nothing is stored when a row is invalid
+    """
+    report = {"created": {}, "updated": {}, "links": 0, "ids": {}, "errors": []}
+    with STORE.batch(DATA):
+        valid = []
+        known_ids = set()
+        for line_number, row, error in rows:
+            try:
+                if error:
+                    raise ImportRowError(error)
+                result = validate_import_row(row, known_ids)
+            except ImportRowError as error:
+                report["errors"].append({"line": line_number, "error": str(error)})
+                continue
+            if result["ref"]:
+                known_ids.add(result["ref"])
+            valid.append(result)
+        if dry_run or (strict and report["errors"]):
+            return report
+        new_ids = {}
+        for aspect, (collection, id_key) in ASPECT_COLLECTIONS.items():
+            count = len([x for x in valid if x["type"] == aspect and x["id"] is None])
+            new_ids[aspect] = collections.deque(reserve_ids(id_key, count))
+        schema = STORE.load(SCHEMA)
+        new_links = []
+        for result in valid:
+            links = dict((key, report["ids"].get(value, value)) for key, value in result["links"].items())
+            if result["type"] != "link":
+                aspect = result["type"]
+                collection, id_key = ASPECT_COLLECTIONS[aspect]
+                details = result["details"]
+                if result["id"] is None:
+                    existing_row = new_row = copy.deepcopy(schema[collection][0])
+                    new_row[id_key] = new_ids[aspect].popleft()
+                    counter = report["created"]
+                else:
+                    existing_row = get_aspect_index(aspect).get(result["id"])
+                    new_row = {id_key: result["id"]}
+                    counter = report["updated"]
+                if "impact_scores" in details:
+                    details["impact_scores"] = merge_impact_scores(existing_row, details["impact_scores"])
+                new_row.update(details)
+                apply_to_aspect(str(aspect), new_row)
+                counter[aspect] = counter.get(aspect, 0) + 1
+                if result["ref"]:
+                    report["ids"][result["ref"]] = new_row[id_key]
+                if not links:
+                    continue
+                links[id_key] = new_row[id_key]
+            new_links.append(dict((str(key), str(value)) for key, value in links.items()))
+        report["links"] = len(apply_links(new_links))
+    return report
+
+@app.route("/api/v1/import", methods=['POST'])
+def api_import():
+    """
+    Imports an uploaded CSV or JSON lines file (see import_rows) and
+    returns the report. The file is sent as the form field "file" or as
+    the request body.
+    Arguments (all optional):
+    - format: "csv" or "ndjson", else guessed from the file name
+    - dry_run, strict: "1" to validate only, or to import nothing if a row is invalid
+    """
+    upload = request.files.get("file", None)
+    if upload is not None:
+        stream = upload.stream
+        import_format = request.args.get("format", None) or get_import_format(upload.filename)
+    else:
+        stream = io.BytesIO(request.get_data())
+        import_format = request.args.get("format", None) or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    if import_format not in ["csv", "ndjson"]:
+        raise ApiError("format must be csv or ndjson")
+    report = import_rows(read_import_rows(stream, import_format),
+                         dry_run=request.args.get("dry_run", "") == "1",
+                         strict=request.args.get("strict", "") == "1")
+    return api_response(report, 400 if report["errors"] and request.args.get("strict", "") == "1" else 200)
+
+##############
+# Benchmarks #
+##############
+# Top level keys of data.json which generate_assessment() builds itself
+GENERATED_KEYS = ["processes", "assets", "threats", "containers", "risktable", "risk_scores",
+                  "id_sequences", "journal_sequence", "schema_version", "schema_fingerprint"]
+
+def generate_assessment(base, schema, control_ids, processes=10, assets=5, threats=5,
+                        containers=2, controls=3, seed=0):
+    """
+    Returns a synthetic data.json document with processes processes, each
+    with assets assets, each with threats threats, each with containers
+    containers, each protected by controls controls. Rows are made from
+    the templates in schema.json with random names and scores.
+    Arguments:
+    - base: document whose other keys (alignment, libraries) are kept
+    - schema: the document loaded from schema.json
+    - control_ids: list of control ids to pick controls from
+    - seed: seed of the random numbers, so the output is reproducible
+    """
+    generator = random.Random(seed)
+    data = dict((key, copy.deepcopy(value)) for key, value in base.items() if key not in GENERATED_KEYS)
+    for collection, id_key in ASPECT_COLLECTIONS.values():
+        data[collection] = []
+    data["risktable"] = []
+    impact_types = get_impact_type_list(data)
+    rxo_values = data.get("rxo_values", None) or ["Not selected"]
+    numbers = dict((id_key, 0) for id_key in ID_PREFIXES)
+    def new_row(aspect, **details):
+        collection, id_key = ASPECT_COLLECTIONS[aspect]
+        numbers[id_key] += 1
+        row = copy.deepcopy(schema[collection][0])
+        row.update(details)
+        row[id_key] = ID_PREFIXES[id_key] + str(numbers[id_key]).zfill(6)
+        data[collection].append(row)
+        return row[id_key]
+    for p in range(processes):
+        process_id = new_row("process", process_name="Process %d" % (p+1),
+                             process_business_unit="Unit %d" % (p % 10 + 1))
+        data["risktable"].append({"process_id": process_id})
+        for a in range(assets):
+            asset_id = new_row("asset", asset_name="Asset %d.%d" % (p+1, a+1),
+                               asset_owner="Owner %d" % generator.randint(1, 20),
+                               asset_criticality_c=generator.choice(["True", "False"]),
+                               asset_criticality_i=generator.choice(["True", "False"]),
+                               asset_criticality_a=generator.choice(["True", "False"]),
+                               asset_rpo_days=generator.choice(rxo_values),
+                               asset_rto_days=generator.choice(rxo_values))
+            data["risktable"].append({"process_id": process_id, "asset_id": asset_id})
+            for t in range(threats):
+                impact_scores = [{"type": impact_type, "score": str(generator.randint(0, 3))}
+                                 for impact_type in impact_types]
+                threat_id = new_row("threat", threat_name="Threat %d.%d.%d" % (p+1, a+1, t+1),
+                                    threat_probability=str(generator.randint(0, 3)),
+                                    threat_action_executed=generator.choice(["True", "False", ""]),
+                                    impact_scores=impact_scores)
+                data["risktable"].append({"asset_id": asset_id, "threat_id": threat_id})
+                for c in range(containers):
+                    container_id = new_row("container", container_name="Container %d" % numbers["container_id"])
+                    data["risktable"].append({"threat_id": threat_id, "container_id": container_id})
+                    for control_id in generator.sample(control_ids, min(controls, len(control_ids))):
+                        data["risktable"].append({"container_id": container_id, "control_id": control_id})
+    migrate_data(data, schema)
+    return data
+
+def get_benchmark_routes(sample, iterations):
+    """
+    Returns a list of (name, method, function(iteration) returning the url
+    and the form, or a JSON body string) for every route of the web
+    application. Read-only routes come first; the mutating routes work on
+    the aspects in sample, and the delete routes delete the aspects created
+    by the routes before them.
+    """
+    process_id, asset_id, threat_id, container_id = sample
+    control_ids = sorted(get_control_index().ids())[:iterations]
+    created = {}
+    def new_id(id_key, iteration):
+        # The last ids of id_key, reserved by the previous route
+        if iteration == 0:
+            last = get_id_sequences().last[id_key]
+            created[id_key] = [ID_PREFIXES[id_key] + str(number).zfill(6)
+                               for number in range(last - iterations + 1, last + 1)]
+        return created[id_key][iteration]
+    def control_link(iteration):
+        return {"threat_id": threat_id, "container_id": container_id,
+                "control_id": control_ids[iteration % len(control_ids)]}
+    def get(url):
+        return lambda iteration: (url, None)
+    def post(url, **form):
+        return lambda iteration: (url, dict((key, value(iteration) if callable(value) else value)
+                                             for key, value in form.items()))
+    def send(url, body):
+        return lambda iteration: (url, json.dumps(body(iteration)))
+    return [("index", "GET", get("/")),
+            ("about", "GET", get("/about")),
+            ("reports", "GET", get("/reports")),
+            ("risk_acceptance", "GET", get("/risk_acceptance")),
+            ("metrics", "GET", get("/metrics")),
+            ("assessments", "GET", get("/assessments")),
+            ("analyse_process Analyse", "GET", get("/analyse_process?action=Analyse&process_id=" + process_id)),
+            ("analyse_process Report", "GET", get("/analyse_process?action=Report&process_id=" + process_id)),
+            ("risk_report", "GET", get("/risk_report")),
+            ("risk_export", "GET", get("/risk_export")),
+            ("controls_soa", "GET", get("/controls_soa")),
+            ("deliverables", "GET", get("/deliverables")),
+            ("alignment", "GET", get("/alignment")),
+            ("show_json", "GET", get("/show_json")),
+            ("delete_preview", "GET", get("/delete_preview?aspect_id=" + process_id)),
+            ("api assets", "GET", get("/api/v1/assets")),
+            ("api asset", "GET", get("/api/v1/assets/" + asset_id)),
+            ("api risktable", "GET", get("/api/v1/risktable?process_id=" + process_id)),
+            ("add_process", "POST", get("/add_process")),
+            ("update_process", "POST", post("/update_process", process_id=process_id,
+                                            process_name=lambda iteration: "Process %d" % iteration)),
+            ("add_asset", "POST", post("/add_asset", process_id=process_id)),
+            ("update_asset", "POST", post("/update_asset", process_id=process_id, asset_id=asset_id,
+                                          action="Apply asset changes",
+                                          asset_name=lambda iteration: "Asset %d" % iteration)),
+            ("add_threat", "POST", post("/add_threat", process_id=process_id, asset_id=asset_id,
+                                        threat_name=lambda iteration: "Threat %d" % iteration)),
+            ("update_threat", "POST", post("/update_threat", process_id=process_id, asset_id=asset_id,
+                                           threat_id=threat_id, action="Apply threat changes",
+                                           legal=lambda iteration: str(iteration % 4))),
+            ("add_container", "POST", post("/add_container", process_id=process_id, threat_id=threat_id,
+                                           container_name=lambda iteration: "Container %d" % iteration)),
+            ("delete_container", "POST", post("/delete_container", process_id=process_id, threat_id=threat_id,
+                                              container_id=lambda iteration: new_id("container_id", iteration))),
+            ("add_control", "POST", post("/add_control", process_id=process_id, threat_id=threat_id,
+                                         container_id=container_id,
+                                         control_id=lambda iteration: control_ids[iteration % len(control_ids)])),
+            ("delete_control", "POST", post("/delete_control", process_id=process_id, container_id=container_id,
+                                            control_id=lambda iteration: control_ids[iteration % len(control_ids)])),
+            ("update_deliverables", "POST", post("/update_deliverables", name="Information Security Policy",
+                                                 maturity_current=lambda iteration: str(iteration % 4))),
+            ("analyse_process Delete", "GET",
+             lambda iteration: ("/analyse_process?action=Delete&process_id=" + new_id("process_id", iteration),
+                                None)),
+            ("api create assets", "POST", send("/api/v1/assets",
+                                               lambda iteration: [{"asset_name": "API asset %d" % iteration}])),
+            ("api update assets", "PATCH", send("/api/v1/assets",
+                                                lambda iteration: [{"asset_id": asset_id,
+                                                                    "asset_owner": "Owner %d" % iteration}])),
+            ("api delete assets", "DELETE", send("/api/v1/assets",
+                                                 lambda iteration: {"ids": [new_id("asset_id", iteration)]})),
+            ("api link", "POST", send("/api/v1/risktable", lambda iteration: [control_link(iteration)])),
+            ("api unlink", "DELETE", send("/api/v1/risktable", lambda iteration: [control_link(iteration)])),
+            ("api import", "POST", send("/api/v1/import?format=ndjson",
+                                        lambda iteration: {"type": "asset", "process_id": process_id,
+                                                           "asset_name": "Imported %d" % iteration}))]
+
+def percentile(values, fraction):
+    """
+    Returns the value below which fraction of the sorted list values lie.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_benchmark(data_file, iterations=20):
+    """
+    Returns a list of dicts with the latency percentiles (in milliseconds)
+    and the json files parsed per request of every route, measured with
+    Flask's test client. The routes run against copies of data_file and
+    the other documents, which are not changed.
+    Arguments:
+    - data_file: data.json file to benchmark, e.g. made by generate_assessment()
+    - iterations: number of requests per route
+    """
+    # The documents are copied to a temporary directory, which is made the
+    # working directory, so the relative document paths point to the copies.
+    working_directory = os.getcwd()
+    directory = tempfile.mkdtemp()
+    backend = STORE.backends.pop(DATA, None)
+    try:
+        os.mkdir(os.path.join(directory, os.path.dirname(DATA)))
+        for filename, source in [(DATA, data_file), (SCHEMA, SCHEMA),
+                                 (CONTROL_LIBRARY, CONTROL_LIBRARY), (DELIVERABLES, DELIVERABLES)]:
+            shutil.copy(source, os.path.join(directory, filename))
+        os.chdir(directory)
+        STORE.invalidate()
+        if backend is not None:
+            STORE.backends[DATA] = SqliteBackend(DATA_SQLITE, seed_filename=DATA)
+        fix_data_structure()
+        graph = get_risk_graph()
+        container_id = sorted(graph.ids("container_id"))[0]
+        threat_id = sorted(graph.linked("container_id", [container_id], "threat_id"))[0]
+        asset_id = sorted(graph.linked("threat_id", [threat_id], "asset_id"))[0]
+        process_id = sorted(graph.linked("asset_id", [asset_id], "process_id"))[0]
+        client = app.test_client()
+        results = []
+        for name, method, build in get_benchmark_routes((process_id, asset_id, threat_id, container_id),
+                                                        iterations):
+            timings = []
+            parses = METRICS.calls("import_jsondata")
+            for iteration in range(iterations):
+                url, form = build(iteration)
+                # Measure rendering, not the cache of read-only views
+                RESPONSE_CACHE.clear()
+                content_type = "application/json" if isinstance(form, basestring) else None
+                start = time.time()
+                response = client.open(url, method=method, data=form, content_type=content_type)
+                response.get_data()
+                timings.append((time.time() - start) * 1000)
+                assert response.status_code < 400, "%s returned %d" % (url, response.status_code)
+            timings.sort()
+            results.append({"route": name, "p50": percentile(timings, 0.5), "p90": percentile(timings, 0.9),
+                            "p99": percentile(timings, 0.99), "max": timings[-1],
+                            "parses": (METRICS.calls("import_jsondata") - parses) / float(iterations)})
+        return results
+    finally:
+        os.chdir(working_directory)
+        STORE.invalidate()
+        STORE.backends.pop(DATA, None)
+        if backend is not None:
+            STORE.backends[DATA] = backend
+        shutil.rmtree(directory)
+
+#################
+# Command lines #
+#################
+def run_command(arguments):
+    """
+    Runs a maintenance command, such as "python openisms.py sqlite-import"
+    Arguments:
+    - arguments: list of command line arguments, without the program name
+    """
+    parser = argparse.ArgumentParser(prog="openisms.py")
+    subparsers = parser.add_subparsers(dest="command")
+    sqlite_import = subparsers.add_parser("sqlite-import", help="Import a data.json file into a SQLite database")
+    sqlite_import.add_argument("json_file", nargs="?", default=DATA)
+    sqlite_import.add_argument("sqlite_file", nargs="?", default=DATA_SQLITE)
+    sqlite_export = subparsers.add_parser("sqlite-export", help="Export a SQLite database to a data.json file")
+    sqlite_export.add_argument("sqlite_file", nargs="?", default=DATA_SQLITE)
+    sqlite_export.add_argument("json_file", nargs="?", default=DATA)
+    import_file = subparsers.add_parser("import", help="Import processes, assets, threats, containers and links "
+                                                       "from a CSV or JSON lines file")
+    import_file.add_argument("file")
+    import_file.add_argument("--format", choices=["csv", "ndjson"], default=None)
+    import_file.add_argument("--dry-run", action="store_true", help="Only validate the file")
+    import_file.add_argument("--strict", action="store_true", help="Import nothing if a row is invalid")
+    generate = subparsers.add_parser("generate", help="Write a synthetic data.json file")
+    generate.add_argument("json_file")
+    generate.add_argument("--processes", type=int, default=10)
+    generate.add_argument("--assets", type=int, default=5, help="Assets per process")
+    generate.add_argument("--threats", type=int, default=5, help="Threats per asset")
+    generate.add_argument("--containers", type=int, default=2, help="Containers per threat")
+    generate.add_argument("--controls", type=int, default=3, help="Controls per container")
+    generate.add_argument("--seed", type=int, default=0)
+    benchmark = subparsers.add_parser("benchmark", help="Measure the latency of every route")
+    benchmark.add_argument("json_file", nargs="?", default=DATA)
+    benchmark.add_argument("--iterations", type=int, default=20, help="Requests per route")
+    benchmark.add_argument("--json", action="store_true", help="Print the results as json")
+    convert = subparsers.add_parser("convert", help="Convert a document to another snapshot format")
+    convert.add_argument("input_file")
+    convert.add_argument("output_file")
+    convert.add_argument("--format", choices=SNAPSHOT_FORMATS, default="json")
+    options = parser.parse_args(arguments)
+    if options.command == "sqlite-import":
+        data = AssessmentStore().load(options.json_file)
+        SqliteBackend(options.sqlite_file).import_document(data)
+    elif options.command == "sqlite-export":
+        data = SqliteBackend(options.sqlite_file).export_document()
+        AssessmentStore().save(options.json_file, data)
+    elif options.command == "import":
+        import_format = options.format or get_import_format(options.file)
+        with open(options.file, 'rb') as f, app.app_context():
+            report = import_rows(read_import_rows(f, import_format),
+                                 dry_run=options.dry_run, strict=options.strict)
+        print(json.dumps(report, indent=4, sort_keys=True))
+        return 1 if report["errors"] else 0
+    elif options.command == "convert":
+        contents = encode_snapshot(AssessmentStore().load(options.input_file), options.format)
+        temporary_filename = options.output_file + ".tmp"
+        with open(temporary_filename, 'wb') as f:
+            f.write(contents)
+        os.rename(temporary_filename, options.output_file)
+    elif options.command == "generate":
+        store = AssessmentStore()
+        data = generate_assessment(store.load(DATA), store.load(SCHEMA), sorted(get_control_index().ids()),
+                                   processes=options.processes, assets=options.assets,
+                                   threats=options.threats, containers=options.containers,
+                                   controls=options.controls, seed=options.seed)
+        store.save(options.json_file, data)
+    elif options.command == "benchmark":
+        results = run_benchmark(options.json_file, options.iterations)
+        if options.json:
+            print(json.dumps(results, indent=4, sort_keys=True))
+            return
+        print("%-26s %9s %9s %9s %9s %8s" % ("route", "p50 ms", "p90 ms", "p99 ms", "max ms", "parses"))
+        for result in results:
+            print("%-26s %9.2f %9.2f %9.2f %9.2f %8.2f" % (result["route"], result["p50"], result["p90"],
+                                                         result["p99"], result["max"], result["parses"]))
 
 #############
 # Main code #
 #############
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
     fix_data_structure()
     # Try and get HOSTNAME env variable, defaults to 127.0.0.1
     host = os.getenv('HOSTNAME', '127.0.0.1')
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Shared set up of the tests, run with "python -m unittest discover tests"
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import openisms
+
+class AssessmentTestCase(unittest.TestCase):
+    """
+    Runs every test in a temporary copy of the assessments directory,
+    which is made the working directory, so the documents of the
+    repository are never changed.
+    """
+    def setUp(self):
+        self.working_directory = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(ROOT, "assessments"), os.path.join(self.directory, "assessments"),
+                        ignore=shutil.ignore_patterns("*.journal", "*.tmp", "*.sqlite", "*.lock"))
+        os.chdir(self.directory)
+        self.backends = dict(openisms.DEFAULT_STORE.backends)
+        openisms.DEFAULT_STORE.backends.clear()
+        openisms.STORE.invalidate()
+        openisms.RESPONSE_CACHE = openisms.ResponseCache(openisms.RESPONSE_CACHE.size)
+        openisms.fix_data_structure()
+        self.client = openisms.app.test_client()
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        for backend in openisms.DEFAULT_STORE.backends.values():
+            backend.close()
+        openisms.DEFAULT_STORE.backends.clear()
+        openisms.DEFAULT_STORE.backends.update(self.backends)
+        openisms.STORE.invalidate()
+        shutil.rmtree(self.directory)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+
+from tests.support import AssessmentTestCase, openisms
+
+class ApiTest(AssessmentTestCase):
+    def call(self, method, url, body=None, status=200):
+        response = self.client.open(url, method=method, content_type="application/json",
+                                    data=json.dumps(body) if body is not None else None)
+        self.assertEqual(response.status_code, status, response.data)
+        return json.loads(response.data)
+
+    def test_create_update_and_delete(self):
+        rows = self.call("POST", "/api/v1/assets", [{"asset_name": "CMDB"}, {"asset_name": "Wiki"}], 201)["rows"]
+        asset_ids = [row["asset_id"] for row in rows]
+        self.assertEqual([row["asset_name"] for row in rows], ["CMDB", "Wiki"])
+        rows = self.call("PATCH", "/api/v1/assets", [{"asset_id": asset_ids[0], "asset_owner": "CIO"}])["rows"]
+        self.assertEqual((rows[0]["asset_name"], rows[0]["asset_owner"]), ("CMDB", "CIO"))
+        self.call("POST", "/api/v1/risktable", [{"process_id": "process000001", "asset_id": asset_ids[0]}], 201)
+        deleted = self.call("DELETE", "/api/v1/assets", {"ids": asset_ids})["deleted"]
+        self.assertEqual(deleted["asset_id"], sorted(asset_ids))
+        self.assertEqual(deleted["risktable_rows"], 1)
+        self.call("GET", "/api/v1/assets/" + asset_ids[0], status=404)
+
+    def test_failed_batch_changes_nothing(self):
+        total = self.call("GET", "/api/v1/assets")["total"]
+        self.call("POST", "/api/v1/assets", [{"asset_name": "new"}, {"asset_id": "asset000001"}], 409)
+        self.assertEqual(self.call("GET", "/api/v1/assets")["total"], total)
+
+    def test_ids_of_other_collections_are_rejected(self):
+        threat = openisms.get_aspect_index("threat").get("threat000001")
+        self.call("GET", "/api/v1/assets/threat000001", status=400)
+        self.call("PATCH", "/api/v1/assets", [{"asset_id": "threat000001", "asset_name": "x"}], 400)
+        self.call("DELETE", "/api/v1/assets", {"ids": ["process000003"]}, 400)
+        self.call("DELETE", "/api/v1/threats", {"ids": ["container000001"]}, 400)
+        self.call("DELETE", "/api/v1/assets", {"ids": ["asset999999"]}, 404)
+        self.assertIsNotNone(openisms.get_aspect_index("process").get("process000003"))
+        self.assertEqual(openisms.get_aspect_index("threat").get("threat000001"), threat)
+        self.assertIsNone(openisms.get_aspect_index("asset").get("threat000001"))
+
+    def test_invalid_values_are_rejected(self):
+        self.call("POST", "/api/v1/threats", [{"threat_name": "x", "impact_scores": "notalist"}], 400)
+        self.call("PATCH", "/api/v1/assets", [{"asset_id": "asset000001", "asset_owner": None}], 400)
+        self.call("PATCH", "/api/v1/assets", [{"asset_id": "asset000001", "unknown": "x"}], 400)
+        self.call("POST", "/api/v1/risktable", [{"asset_id": ["asset000001"]}], 400)
+        self.call("POST", "/api/v1/risktable", [{"process_id": "process000001", "asset_id": "asset999999"}], 400)
+        response = self.client.get("/risk_report?asset_owner=bob")
+        self.assertEqual(response.status_code, 200)
+
+    def test_impact_scores_are_merged(self):
+        impact_types = openisms.get_impact_type_list(openisms.STORE.load(openisms.DATA))
+        rows = self.call("POST", "/api/v1/threats",
+                         [{"threat_name": "x", "impact_scores": [{"type": impact_types[0], "score": "3"}]}],
+                         201)["rows"]
+        scores = dict((x["type"], x["score"]) for x in rows[0]["impact_scores"])
+        self.assertEqual(sorted(scores), sorted(impact_types))
+        self.assertEqual(scores[impact_types[0]], "3")
+
+    def test_containers_are_deleted_with_their_rows(self):
+        deleted = self.call("DELETE", "/api/v1/containers", {"ids": ["container000001"]})["deleted"]
+        self.assertEqual(deleted["container_id"], ["container000001"])
+        self.assertEqual(self.call("GET", "/api/v1/risktable?container_id=container000001")["total"], 0)
+        self.call("GET", "/api/v1/containers/container000001", status=404)
+        preview = self.client.get("/delete_preview?aspect_id=container000002")
+        self.assertEqual(json.loads(preview.data)["container_id"], ["container000002"])
+
+    def test_risktable_filters(self):
+        self.call("POST", "/api/v1/risktable", [{"asset_id": "asset000001", "threat_id": "threat000003"}], 201)
+        risktable = openisms.STORE.load(openisms.DATA)["risktable"]
+        for filters in [{"threat_id": "threat000001"}, {"threat_id": "threat000001", "container_id": "container000001"},
+                        {"asset_id": "asset000001"}, {"control_id": "AC-03"}, {"threat_id": "threat999999"}]:
+            expected = [risk for risk in risktable if all(risk.get(k) == v for k, v in filters.items())]
+            query = "&".join("%s=%s" % item for item in filters.items())
+            result = self.call("GET", "/api/v1/risktable?limit=2&" + query)
+            self.assertEqual(result["total"], len(expected))
+            rows = result["rows"] + self.call("GET", "/api/v1/risktable?offset=2&" + query)["rows"]
+            self.assertEqual(sorted(json.dumps(x, sort_keys=True) for x in rows),
+                             sorted(json.dumps(x, sort_keys=True) for x in expected))
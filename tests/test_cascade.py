@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import json
+
+from tests.support import AssessmentTestCase, openisms
+
+DATA = openisms.DATA
+STORE = openisms.STORE
+
+def risktable_rows(*ids):
+    return [risk for risk in STORE.load(DATA)["risktable"] if set(ids) <= set(risk.values())]
+
+class CascadeTest(AssessmentTestCase):
+    def add(self, aspect, row, links):
+        openisms.apply_to_aspect(aspect, row)
+        openisms.apply_links(links)
+
+    def test_child_rows_listed_before_their_parent_are_deleted(self):
+        openisms.apply_to_aspect("process", {"process_id": "process000500", "process_name": "Last"})
+        self.add("threat", {"threat_id": "threat000500", "threat_name": "Flood"},
+                 [{"asset_id": "asset000500", "threat_id": "threat000500"}])
+        self.add("asset", {"asset_id": "asset000500", "asset_name": "Archive"},
+                 [{"process_id": "process000500", "asset_id": "asset000500"}])
+        self.assertEqual(openisms.resolve_cascade("process000500"),
+                         set(["process000500", "asset000500", "threat000500"]))
+        result = openisms.delete_cascade("process000500")
+        self.assertEqual(result["threat_id"], ["threat000500"])
+        self.assertIsNone(openisms.get_aspect_index("threat").get("threat000500"))
+        self.assertFalse(risktable_rows("threat000500"))
+
+    def test_shared_children_are_kept(self):
+        self.add("container", {"container_id": "container000500", "container_name": "Vault"},
+                 [{"threat_id": "threat000001", "container_id": "container000500"},
+                  {"threat_id": "threat000003", "container_id": "container000500"}])
+        result = openisms.delete_cascade("threat000001")
+        self.assertNotIn("container000500", result["container_id"])
+        self.assertIsNotNone(openisms.get_aspect_index("container").get("container000500"))
+        self.assertTrue(risktable_rows("threat000003", "container000500"))
+        self.assertFalse(risktable_rows("threat000001"))
+        result = openisms.delete_cascade("threat000003")
+        self.assertEqual(result["container_id"], ["container000500"])
+        self.assertFalse(risktable_rows("container000500"))
+
+    def test_dry_run_changes_nothing(self):
+        before = json.dumps(STORE.load(DATA), sort_keys=True)
+        version = STORE.version(DATA)
+        preview = self.client.get("/delete_preview?aspect_id=process000001")
+        self.assertEqual(preview.status_code, 200)
+        self.assertEqual(json.dumps(STORE.load(DATA), sort_keys=True), before)
+        self.assertEqual(STORE.version(DATA), version)
+        self.assertEqual(json.loads(preview.data), openisms.delete_cascade("process000001"))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import json
+
+from tests.support import AssessmentTestCase, openisms
+
+DELIVERABLES = openisms.DELIVERABLES
+STORE = openisms.STORE
+
+class DeliverablesTest(AssessmentTestCase):
+    def test_every_deliverable_counts_all_its_controls(self):
+        graph = openisms.get_risk_graph()
+        shared, other = sorted(graph.ids("control_id"))[:2]
+        with open(DELIVERABLES) as f:
+            deliverables = json.load(f)
+        deliverables["deliverables"][0]["controls"] = [shared, other]
+        deliverables["deliverables"][1]["controls"] = [shared, "Clause 4.1"]
+        with open(DELIVERABLES, 'w') as f:
+            json.dump(deliverables, f, indent=4)
+        STORE.invalidate()
+        response = self.client.get("/deliverables?format=json")
+        counts = [x["count"] for x in json.loads(response.data)["deliverables"]]
+        self.assertEqual(counts[0], graph.count("control_id", shared) + graph.count("control_id", other))
+        self.assertEqual(counts[1], graph.count("control_id", shared))
+        self.assertTrue(counts[1] > 0)
+        self.assertEqual(counts[2:], [0] * (len(counts) - 2))
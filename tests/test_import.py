@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import io
+
+from tests.support import AssessmentTestCase, openisms
+
+DATA = openisms.DATA
+STORE = openisms.STORE
+
+CSV = b"""type,ref,process_id,asset_id,threat_id,container_id,control_id,process_name,asset_name,asset_owner,asset_criticality_a,threat_name,impact_legal
+process,p1,,,,,,Imported process,,,,,
+asset,a1,p1,,,,,,CRM,Sales,True,,
+asset,a2,p1,,,,,,ERP,Finance,maybe,,
+threat,t1,,a1,,,,,,,,Data leak,3
+container,c1,,,t1,,,,,,,,
+link,,,,,c1,AC-02,,,,,,
+asset,,process000002,asset000001,,,,,,CISO,,,
+link,,,,,c1,XX-99,,,,,,
+"""
+
+class ImportTest(AssessmentTestCase):
+    def run_import(self, contents=CSV, **options):
+        with openisms.app.app_context():
+            return openisms.import_rows(openisms.read_import_rows(io.BytesIO(contents), "csv"), **options)
+
+    def journal_lines(self):
+        try:
+            with open(openisms.journal_filename(DATA), 'rb') as f:
+                return len(f.readlines())
+        except IOError:
+            return 0
+
+    def test_refs_are_resolved_in_one_journal_record(self):
+        report = self.run_import()
+        self.assertEqual(report["created"], {"process": 1, "asset": 1, "threat": 1, "container": 1})
+        self.assertEqual(report["updated"], {"asset": 1})
+        self.assertEqual(sorted(report["ids"]), ["a1", "c1", "p1", "t1"])
+        self.assertEqual(self.journal_lines(), 1)
+        ids = report["ids"]
+        graph = openisms.get_risk_graph()
+        self.assertEqual(graph.linked("process_id", [ids["p1"]], "asset_id"), set([ids["a1"]]))
+        self.assertEqual(graph.linked("asset_id", [ids["a1"]], "threat_id"), set([ids["t1"]]))
+        self.assertEqual(graph.linked("threat_id", [ids["t1"]], "container_id"), set([ids["c1"]]))
+        self.assertEqual(graph.linked("container_id", [ids["c1"]], "control_id"), set(["AC-02"]))
+        threat = openisms.get_aspect_index("threat").get(ids["t1"])
+        self.assertIn({"type": "legal", "score": "3"}, threat["impact_scores"])
+        self.assertEqual(openisms.get_aspect_index("asset").get("asset000001")["asset_owner"], "CISO")
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        report = self.run_import()
+        self.assertEqual([x["line"] for x in report["errors"]], [4, 9])
+        self.assertIn("asset_criticality_a", report["errors"][0]["error"])
+        self.assertIn("XX-99", report["errors"][1]["error"])
+        names = [x["asset_name"] for x in STORE.load(DATA)["assets"]]
+        self.assertIn("CRM", names)
+        self.assertNotIn("ERP", names)
+
+    def test_strict_and_dry_run_store_nothing(self):
+        version = STORE.version(DATA)
+        for options in [{"strict": True}, {"dry_run": True}]:
+            report = self.run_import(**options)
+            self.assertEqual(len(report["errors"]), 2)
+            self.assertEqual(report["created"], {})
+            self.assertEqual(STORE.version(DATA), version)
+            self.assertEqual(self.journal_lines(), 0)
+        valid = b"\n".join(line for line in CSV.split(b"\n") if b"maybe" not in line and b"XX-99" not in line)
+        report = self.run_import(valid, strict=True)
+        self.assertEqual(report["errors"], [])
+        self.assertEqual(STORE.version(DATA), version + 1)
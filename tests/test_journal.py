@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+
+from tests.support import AssessmentTestCase, openisms
+
+DATA = openisms.DATA
+
+def add_process(store, process_id):
+    with store.transaction(DATA):
+        data = store.load(DATA)
+        row = {"process_id": process_id, "process_name": "Process " + process_id}
+        data["processes"].append(row)
+        store.commit(DATA, [{"op": "append", "path": ["processes"], "value": row}])
+
+def process_ids(data):
+    return [row["process_id"] for row in data["processes"]]
+
+class JournalTest(AssessmentTestCase):
+    def test_replay_operations(self):
+        data = {"assets": [{"asset_id": "a1", "asset_name": "x"}, {"asset_id": "a2"}],
+                "risktable": [{"asset_id": "a1", "threat_id": "t1"}, {"asset_id": "a2"}]}
+        openisms.replay_operations(data, [
+            {"op": "append", "path": ["assets"], "value": {"asset_id": "a3"}},
+            {"op": "update", "path": ["assets"], "key": "asset_id", "id": "a1", "value": {"asset_id": "a1"}},
+            {"op": "delete", "path": ["assets"], "key": "asset_id", "ids": ["a2"]},
+            {"op": "unlink", "path": ["risktable"], "ids": ["a1", "t1"], "match": "all"},
+            {"op": "set", "path": ["risk_scores", "threats", "t1"], "value": 4},
+            {"op": "unset", "path": ["risk_scores", "weights"]}])
+        self.assertEqual(data, {"assets": [{"asset_id": "a1"}, {"asset_id": "a3"}],
+                                "risktable": [{"asset_id": "a2"}],
+                                "risk_scores": {"threats": {"t1": 4}}})
+
+    def test_commits_are_replayed_by_another_store(self):
+        writer = openisms.AssessmentStore(compact_every=100)
+        add_process(writer, "process000101")
+        add_process(writer, "process000102")
+        reader = openisms.AssessmentStore()
+        data = reader.load(DATA)
+        self.assertEqual(process_ids(data), process_ids(writer.load(DATA)))
+        self.assertEqual(reader.version(DATA), writer.version(DATA))
+        add_process(writer, "process000103")
+        self.assertIn("process000103", process_ids(reader.load(DATA)))
+
+    def test_journal_is_compacted_into_the_snapshot(self):
+        store = openisms.AssessmentStore(compact_every=3)
+        for number in range(101, 105):
+            add_process(store, "process000%d" % number)
+        journal = openisms.journal_filename(DATA)
+        with open(journal) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        snapshot = openisms.import_jsondata(DATA)
+        self.assertIn("process000103", process_ids(snapshot))
+        self.assertNotIn("process000104", process_ids(snapshot))
+        self.assertEqual(process_ids(openisms.AssessmentStore().load(DATA)), process_ids(store.load(DATA)))
+
+    def test_torn_last_line_is_ignored_and_overwritten(self):
+        store = openisms.AssessmentStore(compact_every=100)
+        add_process(store, "process000101")
+        add_process(store, "process000102")
+        journal = openisms.journal_filename(DATA)
+        with open(journal, 'rb') as f:
+            contents = f.read()
+        with open(journal, 'wb') as f:
+            f.write(contents[:-5])
+        recovered = openisms.AssessmentStore(compact_every=100)
+        self.assertIn("process000101", process_ids(recovered.load(DATA)))
+        self.assertNotIn("process000102", process_ids(recovered.load(DATA)))
+        add_process(recovered, "process000103")
+        with open(journal, 'rb') as f:
+            lines = f.readlines()
+        self.assertEqual([json.loads(line)["sequence"] for line in lines], [1, 2])
+        data = openisms.AssessmentStore().load(DATA)
+        self.assertEqual(process_ids(data)[-2:], ["process000101", "process000103"])
+
+    def test_journal_left_by_a_crashed_compaction_is_harmless(self):
+        store = openisms.AssessmentStore(compact_every=100)
+        add_process(store, "process000101")
+        journal = openisms.journal_filename(DATA)
+        shutil.copy(journal, journal + ".old")
+        with store.transaction(DATA):
+            store.compact(DATA)
+        os.rename(journal + ".old", journal)
+        data = openisms.AssessmentStore().load(DATA)
+        self.assertEqual(process_ids(data).count("process000101"), 1)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+
+from tests.support import AssessmentTestCase, ROOT, openisms
+
+DATA = openisms.DATA
+SCHEMA = openisms.SCHEMA
+STORE = openisms.STORE
+
+def rewrite(filename, change):
+    with open(filename) as f:
+        document = json.load(f)
+    change(document)
+    with open(filename, 'w') as f:
+        json.dump(document, f, indent=4)
+    STORE.invalidate()
+
+class MigrationTest(AssessmentTestCase):
+    def test_current_file_is_not_rewritten(self):
+        stat = os.stat(DATA)
+        self.assertFalse(openisms.fix_data_structure())
+        STORE.invalidate()
+        self.assertFalse(openisms.fix_data_structure())
+        self.assertEqual(os.stat(DATA).st_mtime, stat.st_mtime)
+        self.assertEqual(os.stat(DATA).st_size, stat.st_size)
+
+    def test_old_file_is_migrated(self):
+        shutil.copy(os.path.join(ROOT, DATA), DATA)
+        STORE.invalidate()
+        self.assertNotIn("schema_version", STORE.load(DATA))
+        self.assertTrue(openisms.fix_data_structure())
+        data = openisms.import_jsondata(DATA)
+        self.assertEqual(data["schema_version"], openisms.SCHEMA_VERSION)
+        template = STORE.load(SCHEMA)["containers"][0]
+        for container in data["containers"]:
+            self.assertTrue(set(template) <= set(container))
+
+    def test_schema_change_adds_missing_keys_once(self):
+        asset_owners = dict((x["asset_id"], x["asset_owner"]) for x in STORE.load(DATA)["assets"])
+        rewrite(SCHEMA, lambda schema: schema["assets"][0].update({"asset_location": "unknown",
+                                                                   "asset_owner": "nobody"}))
+        self.assertTrue(openisms.fix_data_structure())
+        stat = os.stat(DATA)
+        for asset in openisms.import_jsondata(DATA)["assets"]:
+            self.assertEqual(asset["asset_location"], "unknown")
+            self.assertEqual(asset["asset_owner"], asset_owners[asset["asset_id"]])
+        STORE.invalidate()
+        self.assertFalse(openisms.fix_data_structure())
+        self.assertEqual(os.stat(DATA).st_mtime, stat.st_mtime)
+
+    def test_new_impact_type_is_scored_once(self):
+        def add_impact_type(data):
+            data["global_impact_details"].append({"type": "environmental", "priority": "6"})
+            data["threats"][0]["impact_scores"].append({"type": "environmental", "score": "2"})
+        rewrite(DATA, add_impact_type)
+        self.assertTrue(openisms.fix_data_structure())
+        for index, threat in enumerate(STORE.load(DATA)["threats"]):
+            scores = [x["score"] for x in threat["impact_scores"] if x["type"] == "environmental"]
+            self.assertEqual(scores, ["2"] if index == 0 else ["0"])
+        self.assertFalse(openisms.fix_data_structure())
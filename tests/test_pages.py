@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+from tests.support import AssessmentTestCase, openisms
+
+class SlowPages(openisms.SortedPages):
+    def __init__(self, row_ids):
+        openisms.SortedPages.__init__(self, row_ids)
+        self.computing = threading.Event()
+        self.release = threading.Event()
+
+    def sort_key(self, row_id):
+        self.computing.set()
+        self.release.wait(5)
+        return (row_id,)
+
+class PagesTest(AssessmentTestCase):
+    def test_readers_wait_for_a_refresh_in_another_thread(self):
+        pages = SlowPages(["a", "b"])
+        refresh = threading.Thread(target=pages.refresh)
+        refresh.start()
+        pages.computing.wait(5)
+        results = []
+        reader = threading.Thread(target=lambda: results.append(pages.page()))
+        reader.start()
+        reader.join(0.2)
+        pages.release.set()
+        refresh.join()
+        reader.join()
+        self.assertEqual(results[0]["ids"], ["a", "b"])
+        self.assertEqual(pages.page()["ids"], ["a", "b"])
+        self.assertEqual(pages.keys, [("a",), ("b",)])
+        self.assertEqual(sorted(pages.positions), ["a", "b"])
+
+    def test_filtered_pages_match_the_full_pages(self):
+        ranking = openisms.get_risk_ranking()
+        threat_ids = set(ranking.page(limit=openisms.PAGE_LIMIT_MAX)["ids"])
+        for arguments in [{}, {"offset": 2, "limit": 3}, {"reverse": True, "limit": 4},
+                          {"low": (0, -2.0), "high": (1,)}, {"low": (0,), "high": (0, -1.0), "reverse": True}]:
+            full = ranking.page(**arguments)
+            self.assertEqual(ranking.page(threat_ids, **arguments), full)
+            if full["next"] is not None:
+                arguments["after"] = full["next"]
+                self.assertEqual(ranking.page(threat_ids, **arguments), ranking.page(**arguments))
+
+    def test_asset_owner_filter_follows_changes(self):
+        graph = openisms.get_risk_graph()
+        asset_id = sorted(x for x in graph.ids("asset_id") if graph.linked("asset_id", [x], "threat_id"))[0]
+        threat_index = openisms.get_aspect_index("threat")
+        threat_ids = set(x for x in graph.linked("asset_id", [asset_id], "threat_id") if threat_index.get(x))
+        self.assertTrue(threat_ids)
+        def owned_threats(asset_owner):
+            with openisms.app.test_request_context():
+                return set(openisms.get_risk_page({"asset_owner": asset_owner, "limit": 500})["ids"])
+        for asset_owner in ["Alice", "Bob"]:
+            response = self.client.patch("/api/v1/assets", content_type="application/json",
+                                         data=json.dumps([{"asset_id": asset_id, "asset_owner": asset_owner}]))
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(owned_threats(asset_owner.upper()), threat_ids)
+        self.assertEqual(owned_threats("alice"), set())
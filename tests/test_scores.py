@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+from tests.support import AssessmentTestCase, ROOT, openisms
+
+DATA = openisms.DATA
+STORE = openisms.STORE
+
+def score_threat(threat_dict, global_impact_details):
+    """
+    The per threat scoring replaced by get_risk_scores(), kept as reference.
+    """
+    risk_score = 0.0
+    for global_impact in global_impact_details:
+        for impact_score in threat_dict.get("impact_scores", None):
+            if global_impact.get("type", None) in impact_score.get("type", None):
+                weight = 6.0-float(global_impact.get("priority", None))
+                risk_score += weight*float(impact_score.get("score", None))
+    risk_score = risk_score*10.0/45.0
+    if risk_score > 0.0:
+        return str('{:04.1f}'.format(risk_score))
+    return "No risk calculated"
+
+class RiskScoreTest(AssessmentTestCase):
+    def setUp(self):
+        AssessmentTestCase.setUp(self)
+        self.numpy = openisms.numpy
+        data = openisms.import_jsondata(os.path.join(ROOT, DATA))
+        self.threats = data["threats"]
+        self.expected = [score_threat(threat, data["global_impact_details"]) for threat in self.threats]
+
+    def tearDown(self):
+        openisms.numpy = self.numpy
+        AssessmentTestCase.tearDown(self)
+
+    def test_pure_python_scores_match_the_per_threat_scores(self):
+        openisms.numpy = None
+        self.assertEqual(openisms.get_risk_scores(self.threats), self.expected)
+
+    @unittest.skipIf(openisms.numpy is None, "numpy is not installed")
+    def test_numpy_scores_match_the_per_threat_scores(self):
+        self.assertEqual(openisms.get_risk_scores(self.threats), self.expected)
+
+    def test_every_score_combination_matches(self):
+        data = STORE.load(DATA)
+        impact_types = openisms.get_impact_type_list(data)
+        threats = [{"impact_scores": [{"type": impact_type, "score": str((number >> (2*position)) % 4)}
+                                      for position, impact_type in enumerate(impact_types)]}
+                   for number in range(4 ** len(impact_types))]
+        expected = [score_threat(threat, data["global_impact_details"]) for threat in threats]
+        self.assertEqual(openisms.get_risk_scores(threats), expected)
+        openisms.numpy = None
+        self.assertEqual(openisms.get_risk_scores(threats), expected)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import zlib
+
+from tests.support import AssessmentTestCase, openisms
+
+DATA = openisms.DATA
+
+def available_formats():
+    if openisms.msgpack is None:
+        return [x for x in openisms.SNAPSHOT_FORMATS if not x.startswith("msgpack")]
+    return openisms.SNAPSHOT_FORMATS
+
+def snapshot_kind(contents):
+    """
+    Returns the snapshot format contents was written in.
+    """
+    suffix = ""
+    if contents[:1] == b"\x78":
+        contents = zlib.decompress(contents)
+        suffix = "-zlib"
+    if contents[:1] != b"{":
+        return "msgpack" + suffix
+    if b"\n" not in contents:
+        return "json-min" + suffix
+    return "json" + suffix
+
+class SnapshotTest(AssessmentTestCase):
+    def setUp(self):
+        AssessmentTestCase.setUp(self)
+        self.snapshot_format = openisms.SNAPSHOT_FORMAT
+        self.data = openisms.import_jsondata(DATA)
+
+    def tearDown(self):
+        openisms.SNAPSHOT_FORMAT = self.snapshot_format
+        AssessmentTestCase.tearDown(self)
+
+    def assertSameDocument(self, first, second):
+        self.assertEqual(json.dumps(first, sort_keys=True), json.dumps(second, sort_keys=True))
+
+    def test_every_format_is_detected(self):
+        for snapshot_format in available_formats():
+            contents = openisms.encode_snapshot(self.data, snapshot_format)
+            self.assertSameDocument(openisms.decode_snapshot(contents), self.data)
+        with self.assertRaises(ValueError):
+            openisms.encode_snapshot(self.data, "yaml")
+
+    def test_save_and_load_in_every_format(self):
+        for snapshot_format in available_formats():
+            openisms.SNAPSHOT_FORMAT = snapshot_format
+            store = openisms.AssessmentStore()
+            store.save(DATA, self.data)
+            with open(DATA, 'rb') as f:
+                self.assertEqual(snapshot_kind(f.read()), snapshot_format)
+            self.assertSameDocument(openisms.AssessmentStore().load(DATA), self.data)
+
+    def test_convert_command(self):
+        for snapshot_format in available_formats():
+            openisms.run_command(["convert", DATA, "assessments/converted", "--format", snapshot_format])
+            self.assertSameDocument(openisms.import_jsondata("assessments/converted"), self.data)
+        openisms.run_command(["convert", "assessments/converted", "assessments/back.json"])
+        with open("assessments/back.json", 'rb') as f:
+            self.assertEqual(snapshot_kind(f.read()), "json")
+        self.assertSameDocument(openisms.import_jsondata("assessments/back.json"), self.data)
+
+    def test_convert_replays_the_journal(self):
+        openisms.apply_to_aspect("process", {"process_id": "process000500", "process_name": "Journaled"})
+        openisms.run_command(["convert", DATA, "assessments/converted.json"])
+        converted = openisms.import_jsondata("assessments/converted.json")
+        self.assertIn("process000500", [x["process_id"] for x in converted["processes"]])
+
+    @unittest.skipIf(openisms.msgpack is not None, "msgpack is installed")
+    def test_msgpack_needs_the_package(self):
+        with self.assertRaises(ValueError):
+            openisms.encode_snapshot(self.data, "msgpack")
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from tests.support import AssessmentTestCase, openisms
+
+class SlowSoa(openisms.SoaMaterializer):
+    def __init__(self, graph):
+        self.computing = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        openisms.SoaMaterializer.__init__(self, graph)
+
+    def _refresh(self, control_id):
+        self.computing.set()
+        self.release.wait(5)
+        openisms.SoaMaterializer._refresh(self, control_id)
+
+class SoaTest(AssessmentTestCase):
+    def test_readers_wait_for_a_refresh_in_another_thread(self):
+        graph = openisms.get_risk_graph()
+        soa = SlowSoa(graph)
+        control_id = sorted(graph.ids("control_id"))[0]
+        expected = soa.get(control_id)
+        soa.entries.pop(control_id)
+        soa._dirty.add(control_id)
+        soa.computing.clear()
+        soa.release.clear()
+        refresh = threading.Thread(target=soa.get, args=("none",))
+        refresh.start()
+        soa.computing.wait(5)
+        results = []
+        reader = threading.Thread(target=lambda: results.append(soa.get(control_id)))
+        reader.start()
+        reader.join(0.2)
+        soa.release.set()
+        refresh.join()
+        reader.join()
+        self.assertEqual(results, [expected])
+        self.assertEqual(sorted(soa.entries), sorted(graph.ids("control_id")))
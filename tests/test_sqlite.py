@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import json
+
+from tests.support import AssessmentTestCase, openisms
+
+DATA = openisms.DATA
+STORE = openisms.STORE
+
+class SqliteBackendTest(AssessmentTestCase):
+    def setUp(self):
+        AssessmentTestCase.setUp(self)
+        openisms.DEFAULT_STORE.backends[DATA] = openisms.SqliteBackend("assessments/data.sqlite",
+                                                                       seed_filename=DATA)
+        STORE.invalidate()
+        STORE.load(DATA)
+
+    def export(self):
+        backend = openisms.SqliteBackend("assessments/data.sqlite")
+        try:
+            return backend.export_document()
+        finally:
+            backend.close()
+
+    def test_round_trip(self):
+        data = openisms.import_jsondata(DATA)
+        backend = openisms.SqliteBackend("assessments/copy.sqlite")
+        backend.import_document(data)
+        backend.close()
+        backend = openisms.SqliteBackend("assessments/copy.sqlite")
+        self.assertEqual(json.dumps(backend.export_document(), sort_keys=True), json.dumps(data, sort_keys=True))
+        backend.close()
+
+    def test_risktable_is_indexed_on_id_columns_only(self):
+        backend = openisms.SqliteBackend("assessments/data.sqlite")
+        try:
+            indexes = [row[1] for row in backend.connection().execute("PRAGMA index_list(risktable)")]
+        finally:
+            backend.close()
+        self.assertEqual(sorted(indexes), sorted("risktable_" + x for x in openisms.SQLITE_RISK_COLUMNS))
+
+    def test_writes_update_the_loaded_document(self):
+        data = STORE.load(DATA)
+        version = STORE.version(DATA)
+        self.client.post("/add_asset", data={"process_id": "process000001"})
+        self.client.post("/api/v1/threats", data=json.dumps([{"threat_name": "flood"}]),
+                         content_type="application/json")
+        self.assertIs(STORE.load(DATA), data)
+        self.assertEqual(STORE.version(DATA), version + 2)
+        exported = self.export()
+        self.assertEqual(json.dumps(exported, sort_keys=True), json.dumps(data, sort_keys=True))
+        self.assertIn("flood", [x["threat_name"] for x in exported["threats"]])
+
+    def test_failed_batch_is_rolled_back(self):
+        before = self.export()
+        with self.assertRaises(ValueError):
+            with STORE.batch(DATA):
+                openisms.apply_to_aspect("process", {"process_id": "process000099"})
+                STORE.load(DATA)
+                raise ValueError()
+        self.assertEqual(self.export(), before)
+        self.assertIsNone(openisms.get_aspect_index("process").get("process000099"))
+
+    def test_etag_is_the_same_in_every_worker(self):
+        other = openisms.SqliteBackend("assessments/data.sqlite")
+        other.apply_operations([{"op":"set", "path":["id_sequences", "asset_id"], "value":90}])
+        etag = openisms.get_documents_etag([DATA])
+        worker = openisms.DEFAULT_STORE.backends[DATA]
+        openisms.DEFAULT_STORE.backends[DATA] = other
+        STORE.invalidate()
+        try:
+            self.assertEqual(openisms.get_documents_etag([DATA]), etag)
+        finally:
+            openisms.DEFAULT_STORE.backends[DATA] = worker
+            other.close()
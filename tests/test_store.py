@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import threading
+import time
+
+from tests.support import AssessmentTestCase, openisms
+
+DATA = openisms.DATA
+STORE = openisms.STORE
+
+class ConcurrencyTest(AssessmentTestCase):
+    def test_readers_do_not_wait_for_writers(self):
+        started = threading.Event()
+        def write():
+            with STORE.transaction(DATA):
+                openisms.apply_to_aspect("process", {"process_id": "process000099", "process_name": "slow"})
+                started.set()
+                time.sleep(1)
+        writer = threading.Thread(target=write)
+        writer.start()
+        started.wait()
+        start = time.time()
+        response = self.client.get("/assessments")
+        elapsed = time.time() - start
+        writer.join()
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.5)
+
+    def test_writers_in_threads_are_serialized(self):
+        def add_assets():
+            client = openisms.app.test_client()
+            for iteration in range(10):
+                client.post("/add_asset", data={"process_id": "process000001"})
+        before = len(STORE.load(DATA)["assets"])
+        threads = [threading.Thread(target=add_assets) for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        STORE.invalidate()
+        asset_ids = [asset["asset_id"] for asset in STORE.load(DATA)["assets"]]
+        self.assertEqual(len(asset_ids), before + 40)
+        self.assertEqual(len(set(asset_ids)), len(asset_ids))
+
+    def test_stale_form_is_rejected(self):
+        page = self.client.get("/analyse_process?action=Analyse&process_id=process000001").data
+        version = re.search(r'name="row_version" value="(\w+)"', page).group(1)
+        self.assertEqual(version, openisms.get_row_version("process", "process000001"))
+        form = {"process_id": "process000001", "process_name": "first", "row_version": version}
+        self.assertEqual(self.client.post("/update_process", data=form).status_code, 302)
+        form["process_name"] = "second"
+        self.assertEqual(self.client.post("/update_process", data=form).status_code, 409)
+        self.assertEqual(openisms.get_aspect_index("process").get("process000001")["process_name"], "first")
+
+    def test_changes_of_other_rows_are_not_conflicts(self):
+        page = self.client.get("/analyse_process?action=Analyse&process_id=process000001").data
+        version = re.search(r'name="row_version" value="(\w+)"', page).group(1)
+        self.client.post("/add_asset", data={"process_id": "process000002"})
+        self.client.post("/update_process", data={"process_id": "process000002", "process_name": "other"})
+        form = {"process_id": "process000001", "process_name": "first", "row_version": version}
+        self.assertEqual(self.client.post("/update_process", data=form).status_code, 302)
+        self.assertEqual(openisms.get_aspect_index("process").get("process000001")["process_name"], "first")
+
+    def test_form_post_is_one_journal_line(self):
+        journal = openisms.journal_filename(DATA)
+        self.client.post("/add_asset", data={"process_id": "process000001"})
+        with open(journal, 'rb') as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 1)
+        asset_id = [x["value"]["asset_id"] for x in json.loads(lines[0])["operations"] if x["op"] == "append"
+                    and x["path"] == ["assets"]][0]
+        with open(journal, 'wb') as f:
+            f.write(lines[0][:-10])
+        STORE.invalidate()
+        data = STORE.load(DATA)
+        self.assertNotIn(asset_id, [x["asset_id"] for x in data["assets"]])
+        self.assertFalse([x for x in data["risktable"] if x.get("asset_id", None) == asset_id])
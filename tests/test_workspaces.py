@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+
+from tests.support import AssessmentTestCase, openisms
+
+class WorkspacesTest(AssessmentTestCase):
+    def setUp(self):
+        AssessmentTestCase.setUp(self)
+        for name in ["sales", "hr"]:
+            os.makedirs(os.path.join("workspaces", name))
+            shutil.copy(openisms.DATA, os.path.join("workspaces", name, "data.json"))
+        self.workspaces = openisms.WORKSPACES
+        # Room for one workspace with all its documents loaded
+        openisms.WORKSPACES = openisms.Workspaces("workspaces", 600 * 1024)
+
+    def tearDown(self):
+        openisms.WORKSPACES = self.workspaces
+        AssessmentTestCase.tearDown(self)
+
+    def create_process(self, workspace, name):
+        response = self.client.post("/api/v1/processes", data=json.dumps([{"process_name": name}]),
+                                    content_type="application/json", headers={"X-Workspace": workspace})
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def process_names(self, workspace=None):
+        headers = {"X-Workspace": workspace} if workspace else {}
+        response = self.client.get("/api/v1/processes?limit=500", headers=headers)
+        return [row["process_name"] for row in json.loads(response.data)["rows"]]
+
+    def test_workspaces_are_separate(self):
+        self.create_process("sales", "Sales only")
+        self.create_process("hr", "HR only")
+        self.assertIn("Sales only", self.process_names("sales"))
+        self.assertNotIn("HR only", self.process_names("sales"))
+        self.assertIn("HR only", self.process_names("hr"))
+        self.assertNotIn("Sales only", self.process_names())
+        self.assertEqual(self.client.get("/assessments", headers={"X-Workspace": "nope"}).status_code, 404)
+        self.assertEqual(self.client.get("/assessments", headers={"X-Workspace": "../x"}).status_code, 404)
+
+    def test_least_recently_used_workspace_is_flushed_and_evicted(self):
+        self.create_process("sales", "Sales only")
+        self.client.get("/controls_soa", headers={"X-Workspace": "sales"})
+        self.assertEqual(openisms.WORKSPACES.names(), ["sales"])
+        self.create_process("hr", "HR only")
+        self.client.get("/controls_soa", headers={"X-Workspace": "hr"})
+        self.assertEqual(openisms.WORKSPACES.names(), ["hr"])
+        self.assertIn("Sales only", json.dumps(openisms.import_jsondata("workspaces/sales/data.json")))
+        self.assertEqual(os.path.getsize("workspaces/sales/data.json.journal"), 0)
+        self.assertIn("Sales only", self.process_names("sales"))